@@ -0,0 +1,41 @@
+"""Request body size cap, enforced before any JSON is parsed"""
+
+from flask import request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+def _too_large(max_bytes):
+    """Build the JSON 413 response"""
+    response = jsonify({
+        'error': f'Request body too large. The maximum is {max_bytes} bytes.',
+        'status_code': 413
+    })
+    response.status_code = 413
+    return response
+
+def init_body_limit(app, max_bytes):
+    """
+    Reject request bodies larger than max_bytes with 413 before they are read
+    
+    Bodies with a Content-Length header are rejected without reading them.
+    Chunked bodies are read up to the limit (Flask's MAX_CONTENT_LENGTH) and
+    rejected as soon as they go over it.
+    
+    Args:
+        app (Flask): The application
+        max_bytes (int): Largest accepted body in bytes
+    """
+    app.config['MAX_CONTENT_LENGTH'] = max_bytes
+    
+    @app.before_request
+    def enforce_body_limit():
+        if request.content_length is not None:
+            if request.content_length > max_bytes:
+                return _too_large(max_bytes)
+            return None
+        
+        if request.method in ('POST', 'PUT', 'PATCH'):
+            try:
+                request.get_data(cache=True)
+            except RequestEntityTooLarge:
+                return _too_large(max_bytes)
+        return None
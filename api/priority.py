@@ -0,0 +1,75 @@
+"""Assigns each generation request a priority class and client for the upstream scheduler"""
+
+import time
+
+from flask import request, g
+
+from api.rate_limit import client_identity, hash_api_key
+from services.scheduler import PRIORITY_CLASSES, set_ticket, reset_ticket
+from util.metrics import PRIORITY_REQUEST_LATENCY
+
+def resolve_priority(header_value, key_class, path_class):
+    """
+    Pick the priority class of a request
+    
+    The API key's class (or the endpoint's, for requests without a configured
+    key) is the highest class the request may use. The X-Priority header can
+    only lower it, so a bulk client cannot jump ahead of interactive users by
+    sending ``X-Priority: interactive``.
+    
+    Args:
+        header_value (str): X-Priority header, or None
+        key_class (str): Class configured for the caller's API key, or None
+        path_class (str): Default class of the endpoint
+    
+    Returns:
+        str: interactive, batch or background
+    """
+    ceiling = key_class if key_class in PRIORITY_CLASSES else path_class
+    requested = (header_value or '').strip().lower()
+    if requested in PRIORITY_CLASSES and PRIORITY_CLASSES.index(requested) > PRIORITY_CLASSES.index(ceiling):
+        return requested
+    return ceiling
+
+def init_priority(app, scheduler, key_classes=None, path_classes=None, prefix='/api/generate/',
+                  submit_paths=('/api/jobs',), trust_forwarded_for=False, known_keys=None):
+    """
+    Tag generation requests with their priority class and client, and record per-class latency
+    
+    Args:
+        app (Flask): The application
+        scheduler (FairScheduler): Scheduler that records per-class request latency
+        key_classes (dict): API key -> highest class it may use
+        path_classes (dict): Path -> default class (other generation paths are interactive)
+        prefix (str): Path prefix of the generation endpoints
+        submit_paths (tuple): Extra POST paths that generate (e.g. job submission)
+        trust_forwarded_for (bool): Identify anonymous clients by X-Forwarded-For (behind a proxy)
+        known_keys (iterable): Issued API keys (keys in key_classes are always known); requests
+            with any other key are scheduled by IP
+    """
+    key_classes = {hash_api_key(key): priority_class for key, priority_class in (key_classes or {}).items()}
+    known_keys = frozenset(hash_api_key(key) for key in (known_keys or ())) | key_classes.keys()
+    path_classes = path_classes or {}
+    
+    @app.before_request
+    def assign_priority():
+        if not (request.path.startswith(prefix) or (request.method == 'POST' and request.path in submit_paths)):
+            return None
+        
+        client_id = client_identity(trust_forwarded_for, known_keys)
+        priority_class = resolve_priority(request.headers.get('X-Priority'), key_classes.get(client_id),
+                                          path_classes.get(request.path, 'interactive'))
+        g.priority_class = priority_class
+        g.priority_started = time.perf_counter()
+        g.priority_token = set_ticket(priority_class, client_id)
+        return None
+    
+    @app.teardown_request
+    def record_priority_latency(error=None):
+        token = g.pop('priority_token', None)
+        if token is None:
+            return
+        reset_ticket(token)
+        duration = time.perf_counter() - g.pop('priority_started')
+        PRIORITY_REQUEST_LATENCY.observe(duration, priority=g.priority_class)
+        scheduler.record_latency(g.priority_class, duration)
@@ -0,0 +1,87 @@
+"""Admin-only profiling: a sampling profiler over live traffic and per-request cProfile"""
+
+import hmac
+import threading
+
+from flask import request, g
+
+from util.profiler import StackSampler, RequestProfiles
+
+# Profiles of requests sent with X-Profile, fetched from GET /api/admin/profile/<id>
+request_profiles = RequestProfiles()
+
+# Only one sampling window per worker at a time
+_sampling = threading.Lock()
+
+def check_admin(admin_token):
+    """
+    Check the X-Admin-Token header of the current request
+    
+    Args:
+        admin_token (str): Configured ADMIN_TOKEN (empty disables the admin endpoints)
+    
+    Returns:
+        tuple: (error body, status code) to return, or None if the caller is an admin
+    """
+    if not admin_token:
+        return {'error': 'Not found', 'status_code': 404}, 404
+    supplied = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), admin_token.encode('utf-8')):
+        return {'error': 'Admin token missing or invalid', 'status_code': 403}, 403
+    return None
+
+def sample_worker(seconds, interval=0.01, include_idle=False):
+    """
+    Sample every thread of this worker for a while
+    
+    Args:
+        seconds (float): How long to sample
+        interval (float): Seconds between samples
+        include_idle (bool): Keep threads parked in thread pools, locks and selectors
+    
+    Returns:
+        StackSampler: The finished sampler, or None if another sampling window is running
+    """
+    if not _sampling.acquire(blocking=False):
+        return None
+    try:
+        return StackSampler(interval, include_idle).run(seconds)
+    finally:
+        _sampling.release()
+
+def init_request_profiling(app, admin_token):
+    """
+    Profile single requests sent with ``X-Profile: true`` and a valid X-Admin-Token
+    
+    The response carries an X-Profile-ID header; the profile is fetched from
+    GET /api/admin/profile/<id>. Without an admin token no hook is installed,
+    so ordinary requests pay nothing.
+    
+    Args:
+        app (Flask): The application
+        admin_token (str): Configured ADMIN_TOKEN
+    """
+    if not admin_token:
+        return
+    
+    @app.before_request
+    def start_request_profile():
+        if 'X-Profile' not in request.headers:
+            return None
+        if request.headers['X-Profile'].lower() in ('1', 'true', 'yes') and check_admin(admin_token) is None:
+            g.request_profiler = request_profiles.start()
+        return None
+    
+    @app.after_request
+    def finish_request_profile(response):
+        profiler = g.pop('request_profiler', None)
+        if profiler is not None:
+            response.headers['X-Profile-ID'] = request_profiles.finish(profiler)
+        return response
+    
+    @app.teardown_request
+    def stop_request_profile(error=None):
+        # after_request does not run when the handler raised; never leave a profiler enabled
+        profiler = g.pop('request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
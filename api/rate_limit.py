@@ -0,0 +1,238 @@
+"""Per-client token-bucket rate limiting for the generation endpoints"""
+
+import hashlib
+import math
+import threading
+import time
+
+from flask import request, jsonify
+
+def client_identity(trust_forwarded_for=False, known_keys=frozenset()):
+    """
+    Identify the caller of the current request
+    
+    Only issued API keys identify a client. Any other X-API-Key is ignored, so
+    a client cannot get a fresh bucket by sending a new random key.
+    
+    Args:
+        trust_forwarded_for (bool): Use X-Forwarded-For for anonymous clients (behind a proxy)
+        known_keys (set): Client ids (see hash_api_key()) of the issued API keys
+    
+    Returns:
+        str: 'key:<hash of X-API-Key>' for a known key, else 'ip:<address>'
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        client_id = hash_api_key(api_key)
+        if client_id in known_keys:
+            return client_id
+    
+    address = request.remote_addr
+    if trust_forwarded_for and request.headers.get('X-Forwarded-For'):
+        address = request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return f"ip:{address}"
+
+def hash_api_key(api_key):
+    """Return the client id of an API key (the key itself is never stored)"""
+    return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+
+class InMemoryBackend:
+    """Token buckets kept in this process (limits are per worker)"""
+    
+    def __init__(self, max_keys=100000):
+        """
+        Initialize the backend
+        
+        Args:
+            max_keys (int): Number of buckets kept before idle, refilled buckets are dropped
+        """
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [tokens, last_refill]
+        self._lock = threading.Lock()
+    
+    def consume(self, key, capacity, refill_rate, cost=1):
+        """
+        Take tokens from a bucket
+        
+        Args:
+            key (str): Bucket key
+            capacity (float): Bucket size (maximum burst)
+            refill_rate (float): Tokens added per second
+            cost (float): Tokens needed for this request
+        
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now, capacity, refill_rate)
+                bucket = self._buckets[key] = [capacity, now]
+            
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return True, 0.0
+            
+            bucket[0] = tokens
+            return False, (cost - tokens) / refill_rate
+    
+    def _prune(self, now, capacity, refill_rate):
+        """Drop buckets that have refilled completely (they behave like new ones)"""
+        full_after = capacity / refill_rate
+        for key in [key for key, (_, last) in self._buckets.items() if now - last >= full_after]:
+            del self._buckets[key]
+
+class RedisBackend:
+    """Token buckets stored in Redis so every worker and host shares the same limits"""
+    
+    # Atomic refill-and-take; returns {allowed, retry_after_ms}
+    _SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, retry_after}
+"""
+    
+    def __init__(self, url, prefix='ratelimit:'):
+        """
+        Initialize the backend
+        
+        Args:
+            url (str): Redis URL, e.g. redis://localhost:6379/0
+            prefix (str): Prefix for the bucket keys
+        """
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis rate limit backend needs the 'redis' package: pip install redis")
+        
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+    
+    def consume(self, key, capacity, refill_rate, cost=1):
+        """Take tokens from a bucket (same contract as InMemoryBackend.consume)"""
+        allowed, retry_after_ms = self._script(
+            keys=[self.prefix + key],
+            args=[capacity, refill_rate, cost, time.time()]
+        )
+        return bool(allowed), retry_after_ms / 1000
+
+class RateLimiter:
+    """Applies per-endpoint token buckets to each client"""
+    
+    def __init__(self, limits, backend=None, trust_forwarded_for=False, known_keys=None):
+        """
+        Initialize the rate limiter
+        
+        Args:
+            limits (dict): Endpoint name -> (burst capacity, tokens refilled per second)
+            backend: Object with a consume() method; defaults to InMemoryBackend
+            trust_forwarded_for (bool): Identify anonymous clients by X-Forwarded-For (behind a proxy)
+            known_keys (iterable): Issued API keys; requests with any other key are limited by IP
+        """
+        self.limits = limits
+        self.backend = backend or InMemoryBackend()
+        self.trust_forwarded_for = trust_forwarded_for
+        self.known_keys = frozenset(hash_api_key(key) for key in (known_keys or ()))
+    
+    def client_id(self):
+        """Identify the caller by a known X-API-Key header, falling back to IP address"""
+        return client_identity(self.trust_forwarded_for, self.known_keys)
+    
+    def check(self, endpoint, client_id, cost=1):
+        """
+        Take tokens for a client on an endpoint
+        
+        Args:
+            endpoint (str): Endpoint name, e.g. 'simple'
+            client_id (str): Client identity
+            cost (int): Tokens the request needs (e.g. one per batch item)
+        
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return True, 0.0
+        capacity, refill_rate = limit
+        # A request bigger than the burst takes the whole bucket rather than never getting through
+        return self.backend.consume(f"{endpoint}:{client_id}", capacity, refill_rate, min(cost, capacity))
+
+def parse_limit(value):
+    """
+    Parse a 'burst:per_second' limit string
+    
+    Args:
+        value (str): e.g. '60:1' for bursts of 60 refilled at 1 request per second
+    
+    Returns:
+        tuple: (capacity, refill_rate)
+    """
+    capacity, refill_rate = value.split(':')
+    capacity, refill_rate = float(capacity), float(refill_rate)
+    if capacity < 1 or refill_rate <= 0:
+        raise ValueError(f"Invalid rate limit '{value}': burst must be >= 1 and rate > 0")
+    return capacity, refill_rate
+
+def batch_item_cost():
+    """Tokens for a batch request: one per item (a malformed body costs 1 and is rejected by the handler)"""
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    return max(1, len(items)) if isinstance(items, list) else 1
+
+def init_rate_limiting(app, limiter, prefix='/api/generate/', submit_paths=None, costs=None):
+    """
+    Reject over-limit generation requests with 429 before any work is done
+    
+    Args:
+        app (Flask): The application
+        limiter (RateLimiter): Limiter to apply
+        prefix (str): Path prefix of the rate-limited endpoints
+        submit_paths (dict): Extra POST paths to limit, mapped to their endpoint name (e.g. {'/api/jobs': 'jobs'})
+        costs (dict): Endpoint name -> function returning the tokens the current request needs
+            (e.g. {'batch': batch_item_cost}); other requests take one token
+    """
+    submit_paths = submit_paths or {}
+    costs = costs or {}
+    
+    @app.before_request
+    def enforce_rate_limit():
+        if request.path.startswith(prefix):
+            endpoint = request.path[len(prefix):].split('/', 1)[0]
+        elif request.method == 'POST' and request.path in submit_paths:
+            endpoint = submit_paths[request.path]
+        else:
+            return None
+        
+        cost = costs[endpoint]() if endpoint in costs else 1
+        allowed, retry_after = limiter.check(endpoint, limiter.client_id(), cost)
+        if allowed:
+            return None
+        
+        response = jsonify({
+            'error': 'Rate limit exceeded. Please retry later.',
+            'status_code': 429
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
@@ -1,27 +1,291 @@
 """Flask API routes for text generation endpoints"""
 
-from flask import request
-from flask_restx import Namespace, Resource
+from flask import request, Response, current_app
+from flask_restx import Namespace, Resource, marshal
 from datetime import datetime
+from functools import wraps
+import math
+import threading
 import traceback
 
 from services.gemini_service import GeminiService
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticCache
+from services.response_store import PersistentResponseStore
+from services.single_flight import SingleFlight
+from services.job_queue import JobQueue
+from services.job_store import PersistentJobStore
+from services.token_budget import InputBudget
+from services.template_registry import get_template_registry
+from services.resilience import ResilientCaller, RetryPolicy, CircuitBreaker
+from services.concurrency_limiter import AdaptiveConcurrencyLimiter
+from services.scheduler import FairScheduler, PRIORITY_CLASSES
+from services.cache_warmer import PopularityTracker, CacheWarmer
+from api.rate_limit import hash_api_key
 from util.config import Config
-from exception.generation_exceptions import APIKeyException, GenerationException, InvalidInputException
+from util import metrics
+from util.metrics import StageClock, stage_timer, track_request
+from exception.generation_exceptions import (APIKeyException, GenerationException, InvalidInputException,
+                                             QueueFullException)
 from api.swagger_config import configure_swagger_models
+from api.streaming import sse_response
+from api.profiling import check_admin, sample_worker, request_profiles
 
 # Create API namespace
-api = Namespace('api', description='Text Generation API using LangChain and Gemini')
+# (path='/' because the Api object already mounts everything under the /api prefix)
+api = Namespace('api', description='Text Generation API using LangChain and Gemini', path='/')
 
 # Configure Swagger models
-models = configure_swagger_models(api)
+models = configure_swagger_models(api, get_template_registry(), Config.MODEL_TIERS)
 
-# Initialize Gemini service (will be done once when app starts)
-try:
-    gemini_service = GeminiService(Config.get_api_key())
-except APIKeyException as e:
-    print(f"Warning: {e}")
-    gemini_service = None
+# On-disk store behind the in-memory cache, shared by every worker on this host
+response_store = None
+if Config.CACHE_ENABLED and Config.CACHE_STORE_ENABLED:
+    response_store = PersistentResponseStore(
+        Config.CACHE_STORE_PATH,
+        max_bytes=Config.CACHE_STORE_MAX_BYTES,
+        compaction_interval=Config.CACHE_STORE_COMPACTION_SECONDS
+    )
+
+# Shared response cache in front of the model
+response_cache = None
+if Config.CACHE_ENABLED:
+    response_cache = ResponseCache(
+        max_entries=Config.CACHE_MAX_ENTRIES,
+        max_bytes=Config.CACHE_MAX_BYTES,
+        default_ttl=Config.CACHE_DEFAULT_TTL,
+        ttls=Config.CACHE_TTLS,
+        store=response_store
+    )
+
+# Optional near-duplicate cache behind the exact cache
+semantic_cache = None
+if Config.SEMANTIC_CACHE_ENABLED:
+    semantic_cache = SemanticCache(
+        threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+        capacity=Config.SEMANTIC_CACHE_CAPACITY,
+        dim=Config.SEMANTIC_CACHE_DIM,
+        ttl=Config.CACHE_TTLS['simple'],
+        endpoints=[endpoint.strip() for endpoint in Config.SEMANTIC_CACHE_ENDPOINTS]
+    )
+
+# Per-endpoint limit on the estimated tokens of user input
+input_budget = InputBudget(Config.INPUT_TOKEN_BUDGETS, policy=Config.INPUT_BUDGET_POLICY)
+
+# Coalescer that lets identical concurrent requests share one upstream call
+single_flight = SingleFlight() if Config.COALESCE_ENABLED else None
+
+# Retries, circuit breaker and hedging around every upstream call
+resilience = ResilientCaller(
+    retry=RetryPolicy(Config.RETRY_MAX_ATTEMPTS, Config.RETRY_BASE_DELAY, Config.RETRY_MAX_DELAY),
+    breaker=CircuitBreaker(Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RECOVERY_SECONDS),
+    hedge=Config.HEDGE_ENABLED,
+    hedge_percentile=Config.HEDGE_PERCENTILE,
+    hedge_min_samples=Config.HEDGE_MIN_SAMPLES
+)
+
+# Orders calls waiting for the limiter by priority class, sharing fairly between clients
+scheduler = FairScheduler(
+    client_weights={hash_api_key(key): weight for key, weight in Config.CLIENT_WEIGHTS.items()},
+    aging=Config.SCHEDULER_AGING_SECONDS,
+    queue_timeouts=Config.SCHEDULER_QUEUE_TIMEOUTS
+)
+
+# Adaptive limit on concurrent upstream calls; excess calls queue briefly, then are shed with a 503
+limiter = None
+if Config.CONCURRENCY_LIMIT_ENABLED:
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=Config.CONCURRENCY_INITIAL_LIMIT,
+        min_limit=Config.CONCURRENCY_MIN_LIMIT,
+        max_limit=Config.CONCURRENCY_MAX_LIMIT,
+        max_queue=Config.CONCURRENCY_MAX_QUEUE,
+        queue_timeout=Config.CONCURRENCY_QUEUE_TIMEOUT,
+        latency_tolerance=Config.CONCURRENCY_LATENCY_TOLERANCE,
+        backoff=Config.CONCURRENCY_BACKOFF,
+        scheduler=scheduler
+    )
+
+# Gemini service, created on first use or by warmup_service() (see create_app)
+gemini_service = None
+_service_lock = threading.Lock()
+
+def _backend():
+    """Return the API keys and client factory for the configured LLM_BACKEND"""
+    if Config.LLM_BACKEND == 'fake':
+        from services.fake_llm import FakeChatModel
+        return ['fake-key'], lambda key, model_name: FakeChatModel.from_config(Config)
+    return Config.get_api_keys(), None
+
+def get_gemini_service():
+    """
+    Return the shared GeminiService, creating it on first use
+    
+    Returns:
+        GeminiService: The service, or None if no API key is configured
+    """
+    global gemini_service
+    if gemini_service is None:
+        with _service_lock:
+            if gemini_service is None:
+                try:
+                    api_keys, client_factory = _backend()
+                    gemini_service = GeminiService(
+                        api_keys,
+                        cache=response_cache,
+                        semantic_cache=semantic_cache,
+                        single_flight=single_flight,
+                        pool_strategy=Config.KEY_POOL_STRATEGY,
+                        key_cooldown=Config.KEY_COOLDOWN_SECONDS,
+                        resilience=resilience,
+                        client_factory=client_factory,
+                        model_tiers=Config.MODEL_TIERS,
+                        default_tier=Config.DEFAULT_MODEL_TIER,
+                        auto_tiers=Config.MODEL_AUTO_TIERS,
+                        max_output_tokens=Config.DEFAULT_MAX_LENGTH,
+                        temperature=Config.DEFAULT_TEMPERATURE,
+                        max_length_limit=Config.MAX_LENGTH_LIMIT,
+                        input_budget=input_budget,
+                        limiter=limiter,
+                        max_candidates=Config.MAX_CANDIDATES,
+                        popularity=popularity
+                    )
+                    # Started with the service so it only runs in processes that serve requests
+                    # (never in a preloading gunicorn master)
+                    if cache_warmer is not None:
+                        cache_warmer.start()
+                except APIKeyException as e:
+                    print(f"Warning: {e}")
+    return gemini_service
+
+def _run_job(item, use_cache):
+    """Generate one background job with the shared Gemini service"""
+    service = get_gemini_service()
+    if service is None:
+        raise GenerationException("Gemini service not available. Please check API key configuration.")
+    return service.generate_item(item, use_cache=use_cache)
+
+def _open_job_store():
+    """Open the job store every worker on this host shares (called on first use, never at import)"""
+    return PersistentJobStore(Config.JOB_STORE_PATH)
+
+# Bounded worker pool for POST /api/jobs
+job_queue = JobQueue(
+    _run_job,
+    max_workers=Config.JOB_WORKERS,
+    max_queue=Config.JOB_MAX_QUEUE,
+    result_ttl=Config.JOB_RESULT_TTL,
+    # Jobs are kept where every worker on this host can run and report them
+    store=_open_job_store if Config.JOB_STORE_ENABLED else None
+)
+
+# Popular styled/creative requests, regenerated off-peak so peak-hour repeats are cache hits
+popularity = None
+cache_warmer = None
+if Config.CACHE_WARM_ENABLED and response_cache is not None:
+    popularity = PopularityTracker(max_tracked=Config.CACHE_WARM_TRACKED, half_life=Config.CACHE_WARM_HALF_LIFE)
+    cache_warmer = CacheWarmer(
+        popularity,
+        get_gemini_service,
+        response_cache,
+        top_k=Config.CACHE_WARM_TOP_K,
+        rate=Config.CACHE_WARM_RATE,
+        max_per_run=Config.CACHE_WARM_MAX_PER_RUN,
+        ttl=Config.CACHE_WARM_TTL,
+        refresh_ahead=Config.CACHE_WARM_REFRESH_AHEAD,
+        off_peak_hours=Config.CACHE_WARM_OFF_PEAK_HOURS,
+        interval=Config.CACHE_WARM_INTERVAL,
+        # Calls waiting for a limiter slot mean there is no spare upstream capacity
+        busy=lambda: len(scheduler) > 0,
+        snapshot_path=Config.CACHE_WARM_SNAPSHOT_PATH or None,
+        lock_path=Config.CACHE_WARM_LOCK_PATH or None
+    )
+    try:
+        loaded = cache_warmer.load_snapshot()
+        if loaded:
+            print(f"Loaded {loaded} warmed responses from {Config.CACHE_WARM_SNAPSHOT_PATH}")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: could not load the cache warming snapshot: {e}")
+
+def warmup_service():
+    """Create the Gemini service ahead of the first request (imports LangChain and builds the client)"""
+    return get_gemini_service()
+
+def after_fork():
+    """Reset state that must not be shared between forked worker processes"""
+    if response_store is not None:
+        response_store.after_fork()
+    job_queue.after_fork()
+
+def shutdown_service():
+    """Release background resources when a worker exits"""
+    job_queue.shutdown()
+    resilience.shutdown()
+    if cache_warmer is not None:
+        cache_warmer.stop()
+    if response_store is not None:
+        response_store.close()
+
+def marshal_success(model):
+    """
+    Marshal successful responses with a model, passing error tuples and
+    streaming responses through unchanged
+    
+    Args:
+        model: Swagger model used for the 200 response
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            if isinstance(result, tuple) and result[1] >= 400:
+                return result
+            with stage_timer('serialization'):
+                return marshal(result, model)
+        return api.response(200, 'Success', model)(wrapper)
+    return decorator
+
+def error_headers(error):
+    """Return a Retry-After header for errors that carry one (e.g. an open circuit)"""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return {}
+    return {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+def request_flag(data, name, default):
+    """
+    Read a boolean field of a request body
+    
+    Args:
+        data (dict): Parsed JSON body
+        name (str): Field name
+        default (bool): Value when the field is missing or null
+    
+    Returns:
+        bool: The field's value
+    
+    Raises:
+        InvalidInputException: If the field is not a JSON boolean (e.g. the string "false")
+    """
+    value = data.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, bool):
+        raise InvalidInputException(f"{name} must be true or false")
+    return value
+
+def async_handler(func):
+    """
+    Let a Resource method be an ``async def``
+    
+    flask-restx calls Resource methods directly, so the coroutine is handed to
+    Flask's async support (``flask[async]``) to run to completion.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return current_app.ensure_sync(func)(*args, **kwargs)
+    return wrapper
 
 @api.route('/health')
 class HealthCheck(Resource):
@@ -37,28 +301,278 @@ class HealthCheck(Resource):
             'timestamp': datetime.now().isoformat()
         }
 
+@api.route('/cache/stats')
+class CacheStats(Resource):
+    """Response cache statistics endpoint"""
+    
+    @api.doc('cache_stats')
+    @api.marshal_with(models['cache_stats_response'])
+    def get(self):
+        """Get response cache hit/miss/eviction counters"""
+        if response_cache is None:
+            return {'enabled': False}
+        return dict(response_cache.stats(), enabled=True)
+
+@api.route('/cache/store/stats')
+class ResponseStoreStats(Resource):
+    """Persistent response store statistics endpoint"""
+    
+    @api.doc('response_store_stats')
+    @api.marshal_with(models['response_store_stats_response'])
+    def get(self):
+        """Get size, hit and eviction counters of the on-disk response store"""
+        if response_store is None:
+            return {'enabled': False}
+        return dict(response_store.stats(), enabled=True)
+
+@api.route('/cache/semantic/stats')
+class SemanticCacheStats(Resource):
+    """Semantic (near-duplicate) cache statistics endpoint"""
+    
+    @api.doc('semantic_cache_stats')
+    @api.marshal_with(models['semantic_cache_stats_response'])
+    def get(self):
+        """Get semantic cache hit rate and similarity scores"""
+        if semantic_cache is None:
+            return {'enabled': False}
+        return dict(semantic_cache.stats(), enabled=True)
+
+@api.route('/cache/warmer/stats')
+class CacheWarmerStats(Resource):
+    """Cache warming statistics endpoint"""
+    
+    @api.doc('cache_warmer_stats')
+    @api.marshal_with(models['cache_warmer_stats_response'])
+    def get(self):
+        """Get how many popular items are tracked and how many answers were warmed"""
+        if cache_warmer is None:
+            return {'enabled': False}
+        return dict(cache_warmer.stats(), enabled=True)
+
+@api.route('/coalescing/stats')
+class CoalescingStats(Resource):
+    """Request coalescing statistics endpoint"""
+    
+    @api.doc('coalescing_stats')
+    @api.marshal_with(models['coalescing_stats_response'])
+    def get(self):
+        """Get how many upstream calls were saved by coalescing identical requests"""
+        if single_flight is None:
+            return {'enabled': False}
+        return dict(single_flight.stats(), enabled=True)
+
+@api.route('/keys/stats')
+class KeyPoolStats(Resource):
+    """API key pool statistics endpoint"""
+    
+    @api.doc('key_pool_stats')
+    @api.marshal_with(models['key_pool_stats_response'])
+    def get(self):
+        """Get per-key usage, in-flight calls and quota cooldowns"""
+        # Only report on a service that already exists; don't build one just for stats
+        if gemini_service is None:
+            return {'strategy': Config.KEY_POOL_STRATEGY, 'keys': []}
+        return gemini_service.pool_stats()
+
+@api.route('/resilience/stats')
+class ResilienceStats(Resource):
+    """Retry, hedging and circuit breaker statistics endpoint"""
+    
+    @api.doc('resilience_stats')
+    @api.marshal_with(models['resilience_stats_response'])
+    def get(self):
+        """Get retry and hedge counters and the circuit breaker state"""
+        return resilience.stats()
+
+@api.route('/concurrency/stats')
+class ConcurrencyStats(Resource):
+    """Upstream concurrency limiter statistics endpoint"""
+    
+    @api.doc('concurrency_stats')
+    @api.marshal_with(models['concurrency_stats_response'])
+    def get(self):
+        """Get the adaptive concurrency limit, queue depth and how many calls were shed"""
+        if limiter is None:
+            return {'enabled': False}
+        return dict(limiter.stats(), enabled=True)
+
+@api.route('/scheduler/stats')
+class SchedulerStats(Resource):
+    """Priority scheduler statistics endpoint"""
+    
+    @api.doc('scheduler_stats')
+    @api.marshal_with(models['scheduler_stats_response'])
+    def get(self):
+        """Get queue depth, queue wait and request latency per priority class"""
+        stats = scheduler.stats()
+        stats['classes'] = [dict(values, name=name) for name, values in stats['classes'].items()]
+        return stats
+
+@api.route('/admin/profile')
+class AdminProfile(Resource):
+    """Sampling profiler endpoint (admin only)"""
+    
+    @api.doc('profile_worker', params={
+        'seconds': 'How long to sample (default 10, at most ADMIN_PROFILE_MAX_SECONDS)',
+        'interval': 'Seconds between samples (default 0.01)',
+        'idle': 'Set to true to keep threads parked in thread pools, locks and selectors'
+    })
+    @api.produces(['text/plain'])
+    @api.response(400, 'Invalid parameters', models['error_response'])
+    @api.response(403, 'Admin token missing or invalid', models['error_response'])
+    @api.response(409, 'A profile is already running in this worker', models['error_response'])
+    def post(self):
+        """Sample the stacks of every thread in this worker and return them collapsed for a flame graph"""
+        denied = check_admin(Config.ADMIN_TOKEN)
+        if denied is not None:
+            return denied
+        
+        try:
+            seconds = float(request.args.get('seconds', 10))
+            interval = float(request.args.get('interval', 0.01))
+        except ValueError:
+            return {'error': 'seconds and interval must be numbers', 'status_code': 400}, 400
+        if not 0 < seconds <= Config.ADMIN_PROFILE_MAX_SECONDS:
+            return {
+                'error': f'seconds must be between 0 and {Config.ADMIN_PROFILE_MAX_SECONDS:g}',
+                'status_code': 400
+            }, 400
+        if not 0.001 <= interval <= 1:
+            return {'error': 'interval must be between 0.001 and 1 second', 'status_code': 400}, 400
+        
+        include_idle = request.args.get('idle', '').lower() in ('1', 'true', 'yes')
+        sampler = sample_worker(seconds, interval, include_idle)
+        if sampler is None:
+            return {'error': 'A profile is already running in this worker', 'status_code': 409}, 409
+        return Response(sampler.collapsed(), mimetype='text/plain',
+                        headers={'X-Profile-Samples': str(sampler.samples)})
+
+@api.route('/admin/profile/<string:profile_id>')
+class AdminRequestProfile(Resource):
+    """Per-request profile endpoint (admin only)"""
+    
+    @api.doc('get_request_profile', params={'format': "'pstats' (text table, default) or 'prof' (binary for snakeviz)"})
+    @api.produces(['text/plain', 'application/octet-stream'])
+    @api.response(400, 'Unknown format', models['error_response'])
+    @api.response(403, 'Admin token missing or invalid', models['error_response'])
+    @api.response(404, 'Unknown profile', models['error_response'])
+    def get(self, profile_id):
+        """Get the cProfile result of a request sent with X-Profile: true"""
+        denied = check_admin(Config.ADMIN_TOKEN)
+        if denied is not None:
+            return denied
+        
+        try:
+            profile = request_profiles.get(profile_id, request.args.get('format', 'pstats'))
+        except ValueError as e:
+            return {'error': str(e), 'status_code': 400}, 400
+        if profile is None:
+            return {'error': 'Profile not found (only the most recent ones are kept)', 'status_code': 404}, 404
+        content, mimetype = profile
+        return Response(content, mimetype=mimetype)
+
+@api.route('/metrics')
+class Metrics(Resource):
+    """Prometheus metrics endpoint"""
+    
+    @api.doc('metrics')
+    @api.produces(['text/plain'])
+    def get(self):
+        """Get request, latency, token and cache metrics in Prometheus text format"""
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def _collect_component_stats():
+    """Expose the cache, coalescing, key pool and resilience counters as metrics"""
+    families = []
+    if response_cache is not None:
+        stats = response_cache.stats()
+        families.append(('response_cache_events_total', 'counter', 'Response cache hits, misses, evictions and expirations',
+                         [({'event': event}, stats[event]) for event in ('hits', 'misses', 'evictions', 'expirations')]))
+        families.append(('response_cache_entries', 'gauge', 'Entries in the response cache', [({}, stats['entries'])]))
+        if response_store is not None:
+            families.append(('response_store_errors_total', 'counter',
+                             'Persistent store reads and writes that failed (served from memory instead)',
+                             [({}, stats['store_errors'])]))
+    if response_store is not None:
+        stats = response_store.stats()
+        families.append(('response_store_lookups_total', 'counter', 'Persistent store hits and misses',
+                         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]))
+        if stats['bytes'] is not None:
+            families.append(('response_store_bytes', 'gauge', 'Size of stored prompts and content',
+                             [({}, stats['bytes'])]))
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        families.append(('semantic_cache_lookups_total', 'counter', 'Semantic cache hits and misses',
+                         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]))
+        families.append(('semantic_cache_entries', 'gauge', 'Entries in the semantic cache', [({}, stats['entries'])]))
+    if cache_warmer is not None:
+        stats = cache_warmer.stats()
+        families.append(('cache_warm_items_total', 'counter', 'Popular items warmed, already fresh or failed',
+                         [({'result': result}, stats[result]) for result in ('warmed', 'fresh', 'failed')]))
+        families.append(('cache_warm_tracked_items', 'gauge', 'Items tracked for cache warming',
+                         [({}, stats['tracked'])]))
+    if single_flight is not None:
+        stats = single_flight.stats()
+        families.append(('coalescing_calls_total', 'counter', 'Upstream executions and requests served by coalescing',
+                         [({'outcome': 'executed'}, stats['executions']), ({'outcome': 'coalesced'}, stats['coalesced'])]))
+    if gemini_service is not None:
+        keys = gemini_service.pool_stats()['keys']
+        families.append(('upstream_key_in_flight', 'gauge', 'Upstream calls in flight per API key and tier',
+                         [({'key_id': key['key_id'], 'tier': key['tier']}, key['in_flight']) for key in keys]))
+        families.append(('upstream_key_requests_total', 'counter', 'Upstream calls per API key and tier',
+                         [({'key_id': key['key_id'], 'tier': key['tier']}, key['requests']) for key in keys]))
+    stats = job_queue.stats()
+    families.append(('job_queue_jobs', 'gauge', 'Background jobs waiting and running',
+                     [({'state': 'queued'}, stats['queued']), ({'state': 'running'}, stats['running'])]))
+    families.append(('job_queue_jobs_total', 'counter', 'Background jobs by outcome',
+                     [({'outcome': outcome}, stats[outcome]) for outcome in ('succeeded', 'failed', 'rejected')]))
+    stats = resilience.stats()
+    families.append(('upstream_retries_total', 'counter', 'Upstream calls retried', [({}, stats['retries'])]))
+    families.append(('upstream_hedges_total', 'counter', 'Hedged upstream calls sent and won',
+                     [({'outcome': 'sent'}, stats['hedges_sent']), ({'outcome': 'won'}, stats['hedges_won'])]))
+    families.append(('circuit_open', 'gauge', '1 while the circuit breaker is not closed',
+                     [({}, int(stats['circuit']['state'] != 'closed'))]))
+    if limiter is not None:
+        stats = limiter.stats()
+        families.append(('upstream_concurrency_limit', 'gauge', 'Current adaptive limit on concurrent upstream calls',
+                         [({}, stats['limit'])]))
+        families.append(('upstream_concurrency_in_flight', 'gauge', 'Upstream calls holding a limiter slot',
+                         [({}, stats['in_flight'])]))
+        families.append(('upstream_concurrency_queue_depth', 'gauge', 'Upstream calls waiting for a limiter slot',
+                         [({}, stats['queue_depth'])]))
+        families.append(('upstream_shed_total', 'counter', 'Upstream calls shed by the concurrency limiter',
+                         [({'reason': 'queue_full'}, stats['shed_queue_full']),
+                          ({'reason': 'deadline'}, stats['shed_deadline'])]))
+    classes = scheduler.stats()['classes']
+    families.append(('scheduler_waiting_calls', 'gauge', 'Upstream calls waiting for a slot by priority class',
+                     [({'priority': name}, classes[name]['waiting']) for name in PRIORITY_CLASSES]))
+    families.append(('scheduler_dispatched_total', 'counter', 'Waiting calls that got a slot by priority class',
+                     [({'priority': name}, classes[name]['dispatched']) for name in PRIORITY_CLASSES]))
+    return families
+
+metrics.registry.register_collector(_collect_component_stats)
+
 @api.route('/generate/simple')
 class SimpleGeneration(Resource):
     """Simple text generation endpoint"""
     
     @api.doc('generate_simple_text')
     @api.expect(models['simple_request'])
-    @api.marshal_with(models['text_response'])
+    @track_request('simple')
+    @marshal_success(models['text_response'])
     @api.response(400, 'Invalid input', models['error_response'])
+    @api.response(413, 'Request body or input over its size limit', models['error_response'])
+    @api.response(429, 'Rate limit exceeded', models['error_response'])
     @api.response(500, 'Generation failed', models['error_response'])
+    @api.response(503, 'Upstream unavailable (circuit open) or overloaded', models['error_response'])
     def post(self):
         """Generate simple text from a prompt"""
         try:
-            # Check if service is available
-            if gemini_service is None:
-                return {
-                    'error': 'Gemini service not available. Please check API key configuration.',
-                    'status_code': 500
-                }, 500
-            
             # Get JSON data from request
-            data = request.get_json()
-            if not data:
+            stages = StageClock()
+            data = request.get_json(silent=True)
+            stages.mark('parse')
+            if data is None:
                 return {
                     'error': 'No JSON data provided',
                     'status_code': 400
@@ -71,21 +585,37 @@ class SimpleGeneration(Resource):
                     'status_code': 400
                 }, 400
             
+            stages.mark('validation')
+            
+            # Check if service is available
+            service = get_gemini_service()
+            if service is None:
+                return {
+                    'error': 'Gemini service not available. Please check API key configuration.',
+                    'status_code': 500
+                }, 500
+            
             # Generate text using Gemini service
-            response = gemini_service.generate_simple_text(prompt)
+            use_cache = request_flag(data, 'use_cache', True)
+            similar = request_flag(data, 'similar', False)
+            options = GeminiService.item_options(data)
+            if request_flag(data, 'stream', False):
+                return sse_response(service.stream_simple_text(prompt, use_cache=use_cache, **options))
             
-            return response.to_dict()
+            response = service.generate_simple_text(prompt, use_cache=use_cache, similar=similar, **options)
             
+            return response.to_dict()
+        
         except InvalidInputException as e:
             return {
                 'error': str(e),
-                'status_code': 400
-            }, 400
+                'status_code': e.status_code
+            }, e.status_code
         except GenerationException as e:
             return {
                 'error': str(e),
-                'status_code': 500
-            }, 500
+                'status_code': e.status_code
+            }, e.status_code, error_headers(e)
         except Exception as e:
             print(f"Unexpected error in simple generation: {e}")
             print(traceback.format_exc())
@@ -100,22 +630,21 @@ class StyledGeneration(Resource):
     
     @api.doc('generate_styled_text')
     @api.expect(models['styled_request'])
-    @api.marshal_with(models['text_response'])
+    @track_request('styled')
+    @marshal_success(models['text_response'])
     @api.response(400, 'Invalid input', models['error_response'])
+    @api.response(413, 'Request body or input over its size limit', models['error_response'])
+    @api.response(429, 'Rate limit exceeded', models['error_response'])
     @api.response(500, 'Generation failed', models['error_response'])
+    @api.response(503, 'Upstream unavailable (circuit open) or overloaded', models['error_response'])
     def post(self):
         """Generate styled text with specific tone"""
         try:
-            # Check if service is available
-            if gemini_service is None:
-                return {
-                    'error': 'Gemini service not available. Please check API key configuration.',
-                    'status_code': 500
-                }, 500
-            
             # Get JSON data from request
-            data = request.get_json()
-            if not data:
+            stages = StageClock()
+            data = request.get_json(silent=True)
+            stages.mark('parse')
+            if data is None:
                 return {
                     'error': 'No JSON data provided',
                     'status_code': 400
@@ -136,21 +665,37 @@ class StyledGeneration(Resource):
                     'status_code': 400
                 }, 400
             
+            stages.mark('validation')
+            
+            # Check if service is available
+            service = get_gemini_service()
+            if service is None:
+                return {
+                    'error': 'Gemini service not available. Please check API key configuration.',
+                    'status_code': 500
+                }, 500
+            
             # Generate styled text using Gemini service
-            response = gemini_service.generate_with_template(topic, style)
+            use_cache = request_flag(data, 'use_cache', True)
+            similar = request_flag(data, 'similar', False)
+            options = GeminiService.item_options(data)
+            if request_flag(data, 'stream', False):
+                return sse_response(service.stream_with_template(topic, style, use_cache=use_cache, **options))
             
-            return response.to_dict()
+            response = service.generate_with_template(topic, style, use_cache=use_cache, similar=similar, **options)
             
+            return response.to_dict()
+        
         except InvalidInputException as e:
             return {
                 'error': str(e),
-                'status_code': 400
-            }, 400
+                'status_code': e.status_code
+            }, e.status_code
         except GenerationException as e:
             return {
                 'error': str(e),
-                'status_code': 500
-            }, 500
+                'status_code': e.status_code
+            }, e.status_code, error_headers(e)
         except Exception as e:
             print(f"Unexpected error in styled generation: {e}")
             print(traceback.format_exc())
@@ -165,22 +710,21 @@ class CreativeGeneration(Resource):
     
     @api.doc('generate_creative_content')
     @api.expect(models['creative_request'])
-    @api.marshal_with(models['text_response'])
+    @track_request('creative')
+    @marshal_success(models['text_response'])
     @api.response(400, 'Invalid input', models['error_response'])
+    @api.response(413, 'Request body or input over its size limit', models['error_response'])
+    @api.response(429, 'Rate limit exceeded', models['error_response'])
     @api.response(500, 'Generation failed', models['error_response'])
+    @api.response(503, 'Upstream unavailable (circuit open) or overloaded', models['error_response'])
     def post(self):
         """Generate creative content like poems, stories, jokes, or facts"""
         try:
-            # Check if service is available
-            if gemini_service is None:
-                return {
-                    'error': 'Gemini service not available. Please check API key configuration.',
-                    'status_code': 500
-                }, 500
-            
             # Get JSON data from request
-            data = request.get_json()
-            if not data:
+            stages = StageClock()
+            data = request.get_json(silent=True)
+            stages.mark('parse')
+            if data is None:
                 return {
                     'error': 'No JSON data provided',
                     'status_code': 400
@@ -201,25 +745,214 @@ class CreativeGeneration(Resource):
                     'status_code': 400
                 }, 400
             
+            stages.mark('validation')
+            
+            # Check if service is available
+            service = get_gemini_service()
+            if service is None:
+                return {
+                    'error': 'Gemini service not available. Please check API key configuration.',
+                    'status_code': 500
+                }, 500
+            
             # Generate creative content using Gemini service
-            response = gemini_service.generate_creative_content(content_type, subject)
+            use_cache = request_flag(data, 'use_cache', True)
+            similar = request_flag(data, 'similar', False)
+            options = GeminiService.item_options(data)
+            if request_flag(data, 'stream', False):
+                return sse_response(service.stream_creative_content(content_type, subject, use_cache=use_cache,
+                                                                    **options))
             
-            return response.to_dict()
+            response = service.generate_creative_content(content_type, subject, use_cache=use_cache, similar=similar,
+                                                         **options)
             
+            return response.to_dict()
+        
         except InvalidInputException as e:
             return {
                 'error': str(e),
-                'status_code': 400
-            }, 400
+                'status_code': e.status_code
+            }, e.status_code
         except GenerationException as e:
             return {
                 'error': str(e),
+                'status_code': e.status_code
+            }, e.status_code, error_headers(e)
+        except Exception as e:
+            print(f"Unexpected error in creative generation: {e}")
+            print(traceback.format_exc())
+            return {
+                'error': 'An unexpected error occurred',
                 'status_code': 500
             }, 500
+
+@api.route('/generate/batch')
+class BatchGeneration(Resource):
+    """Batch generation endpoint"""
+    
+    @api.doc('generate_batch')
+    @api.expect(models['batch_request'])
+    @track_request('batch')
+    @marshal_success(models['batch_response'])
+    @api.response(400, 'Invalid input', models['error_response'])
+    @api.response(413, 'Request body or input over its size limit', models['error_response'])
+    @api.response(429, 'Rate limit exceeded', models['error_response'])
+    @api.response(500, 'Generation failed', models['error_response'])
+    @api.response(503, 'Upstream unavailable (circuit open) or overloaded', models['error_response'])
+    @async_handler
+    async def post(self):
+        """Generate text for a list of simple, styled and creative items concurrently"""
+        try:
+            # Get JSON data from request
+            stages = StageClock()
+            data = request.get_json(silent=True)
+            stages.mark('parse')
+            if data is None:
+                return {
+                    'error': 'No JSON data provided',
+                    'status_code': 400
+                }, 400
+            
+            items = data.get('items')
+            if not items or not isinstance(items, list):
+                return {
+                    'error': 'Missing required field: items',
+                    'status_code': 400
+                }, 400
+            
+            if len(items) > Config.BATCH_MAX_ITEMS:
+                return {
+                    'error': f'Too many items. Maximum batch size is {Config.BATCH_MAX_ITEMS}',
+                    'status_code': 400
+                }, 400
+            
+            stages.mark('validation')
+            
+            # Check if service is available
+            service = get_gemini_service()
+            if service is None:
+                return {
+                    'error': 'Gemini service not available. Please check API key configuration.',
+                    'status_code': 500
+                }, 500
+            
+            # Generate all items concurrently using Gemini service
+            use_cache = request_flag(data, 'use_cache', True)
+            outcomes = await service.agenerate_batch(items, max_concurrency=Config.BATCH_MAX_WORKERS,
+                                                            use_cache=use_cache)
+            
+            results = []
+            for index, outcome in enumerate(outcomes):
+                if isinstance(outcome, Exception):
+                    status_code = getattr(outcome, 'status_code', 500)
+                    results.append({'index': index, 'status_code': status_code, 'error': str(outcome)})
+                else:
+                    results.append({'index': index, 'status_code': 200, 'response': outcome.to_dict()})
+            
+            failed = sum(1 for result in results if result['status_code'] != 200)
+            return {
+                'results': results,
+                'succeeded': len(results) - failed,
+                'failed': failed
+            }
+        
+        except InvalidInputException as e:
+            return {
+                'error': str(e),
+                'status_code': e.status_code
+            }, e.status_code
         except Exception as e:
-            print(f"Unexpected error in creative generation: {e}")
+            print(f"Unexpected error in batch generation: {e}")
+            print(traceback.format_exc())
+            return {
+                'error': 'An unexpected error occurred',
+                'status_code': 500
+            }, 500
+
+@api.route('/jobs')
+class JobSubmission(Resource):
+    """Background job submission endpoint"""
+    
+    @api.doc('submit_job')
+    @api.expect(models['job_request'])
+    @track_request('jobs')
+    @api.response(202, 'Job queued', models['job_response'])
+    @api.response(400, 'Invalid input', models['error_response'])
+    @api.response(413, 'Request body or input over its size limit', models['error_response'])
+    @api.response(429, 'Rate limit exceeded', models['error_response'])
+    @api.response(500, 'Service not available', models['error_response'])
+    @api.response(503, 'Job queue full', models['error_response'])
+    def post(self):
+        """Queue a simple, styled or creative generation and return its job id immediately"""
+        try:
+            # Get JSON data from request
+            data = request.get_json(silent=True)
+            if data is None:
+                return {
+                    'error': 'No JSON data provided',
+                    'status_code': 400
+                }, 400
+            
+            kind = GeminiService.item_kind(data)
+            
+            # Check if service is available
+            service = get_gemini_service()
+            if service is None:
+                return {
+                    'error': 'Gemini service not available. Please check API key configuration.',
+                    'status_code': 500
+                }, 500
+            
+            # Reject bad generation parameters now rather than in a failed job
+            service.resolve_settings(content_type=data.get('content_type'), **GeminiService.item_options(data))
+            request_flag(data, 'similar', False)
+            
+            item = {key: value for key, value in data.items() if key != 'use_cache'}
+            job = job_queue.submit(item, kind, use_cache=request_flag(data, 'use_cache', True))
+            return marshal(job, models['job_response']), 202, {'Location': f"{request.path}/{job['job_id']}"}
+        
+        except InvalidInputException as e:
+            return {
+                'error': str(e),
+                'status_code': e.status_code
+            }, e.status_code
+        except QueueFullException as e:
+            return {
+                'error': str(e),
+                'status_code': e.status_code
+            }, e.status_code, error_headers(e)
+        except Exception as e:
+            print(f"Unexpected error in job submission: {e}")
             print(traceback.format_exc())
             return {
                 'error': 'An unexpected error occurred',
                 'status_code': 500
-            }, 500
\ No newline at end of file
+            }, 500
+
+@api.route('/jobs/stats')
+class JobQueueStats(Resource):
+    """Background job queue statistics endpoint"""
+    
+    @api.doc('job_queue_stats')
+    @api.marshal_with(models['job_queue_stats_response'])
+    def get(self):
+        """Get queue depth, worker count and job outcome counters"""
+        return job_queue.stats()
+
+@api.route('/jobs/<string:job_id>')
+class JobStatus(Resource):
+    """Background job status endpoint"""
+    
+    @api.doc('get_job')
+    @track_request('job_status')
+    @marshal_success(models['job_response'])
+    @api.response(404, 'Unknown job or result expired', models['error_response'])
+    def get(self, job_id):
+        """Get a job's status, and its result once it has finished"""
+        job = job_queue.get(job_id)
+        if job is None:
+            return {
+                'error': 'Job not found. Results are kept for a limited time after a job finishes.',
+                'status_code': 404
+            }, 404
+        return job
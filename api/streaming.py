@@ -0,0 +1,51 @@
+"""Server-Sent Events helpers for streaming generation responses"""
+
+import json
+from flask import Response, stream_with_context
+
+def format_sse(data, event=None):
+    """
+    Format one Server-Sent Event
+    
+    Args:
+        data (dict): JSON-serializable event payload
+        event (str): Optional event name
+    
+    Returns:
+        str: Event text terminated by a blank line
+    """
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+def sse_response(text_stream):
+    """
+    Stream a TextStream to the client as text/event-stream
+    
+    Each chunk is sent as a 'chunk' event with {"content": ...}. Once the model
+    finishes, a 'done' event carries the full TextResponse. Upstream failures
+    after the stream has started are reported as an 'error' event.
+    
+    Args:
+        text_stream (TextStream): Stream returned by a GeminiService stream_* method
+    
+    Returns:
+        Response: Streaming Flask response
+    """
+    def events():
+        try:
+            for chunk in text_stream:
+                yield format_sse({'content': chunk}, 'chunk')
+            yield format_sse(text_stream.response.to_dict(), 'done')
+        except Exception as e:
+            yield format_sse({'error': str(e), 'status_code': getattr(e, 'status_code', 500)}, 'error')
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
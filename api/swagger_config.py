@@ -2,27 +2,94 @@
 
 from flask_restx import fields
 
-def configure_swagger_models(api):
-    """Configure Swagger models for request/response documentation"""
+def configure_swagger_models(api, templates, model_tiers=('standard',)):
+    """
+    Configure Swagger models for request/response documentation
+    
+    Args:
+        api: Namespace the models are registered on
+        templates (TemplateRegistry): Source of the allowed styles and content types
+        model_tiers (iterable): Configured model tier names
+    """
+    styles = list(templates.styles)
+    content_types = list(templates.content_types)
+    tiers = list(model_tiers) + ['auto']
+    
+    # Generation parameters shared by every request kind
+    generation_fields = {
+        'max_length': fields.Integer(description='Maximum number of tokens to generate',
+                                    min=1, example=200),
+        'temperature': fields.Float(description='Creativity level (0.0 to 1.0)',
+                                   min=0.0, max=1.0, example=0.7),
+        'model_tier': fields.String(description="Model tier; omit or use 'auto' to let the API choose "
+                                                "(e.g. jokes and facts go to the fastest model)",
+                                   enum=tiers, example='auto'),
+        'n': fields.Integer(description="Number of candidates to generate in one upstream call "
+                                        "('candidate_count' is accepted too); streaming supports 1 only",
+                           min=1, default=1, example=1),
+        'similar': fields.Boolean(description='Accept the cached answer of a near-duplicate prompt (semantic '
+                                              'cache, when enabled); it may answer a slightly different question',
+                                 default=False, example=False)
+    }
     
     # Request models
     simple_request_model = api.model('SimpleRequest', {
         'prompt': fields.String(required=True, description='Text prompt for generation', 
-                               example='What is artificial intelligence?')
+                               example='What is artificial intelligence?'),
+        'use_cache': fields.Boolean(description='Allow a cached response to be returned',
+                                   default=True, example=True),
+        'stream': fields.Boolean(description='Stream the response as text/event-stream chunks',
+                                default=False, example=False),
+        **generation_fields
     })
     
     styled_request_model = api.model('StyledRequest', {
         'topic': fields.String(required=True, description='Topic to write about', 
                               example='Python programming'),
         'style': fields.String(required=True, description='Writing style', 
-                              enum=['formal', 'casual', 'funny'], example='funny')
+                              enum=styles, example=styles[0]),
+        'use_cache': fields.Boolean(description='Allow a cached response to be returned',
+                                   default=True, example=True),
+        'stream': fields.Boolean(description='Stream the response as text/event-stream chunks',
+                                default=False, example=False),
+        **generation_fields
     })
     
     creative_request_model = api.model('CreativeRequest', {
         'content_type': fields.String(required=True, description='Type of creative content',
-                                    enum=['poem', 'story', 'joke', 'fact'], example='poem'),
+                                    enum=content_types, example=content_types[0]),
         'subject': fields.String(required=True, description='Subject for creative content',
-                               example='ocean')
+                               example='ocean'),
+        'use_cache': fields.Boolean(description='Allow a cached response to be returned',
+                                   default=True, example=True),
+        'stream': fields.Boolean(description='Stream the response as text/event-stream chunks',
+                                default=False, example=False),
+        **generation_fields
+    })
+    
+    batch_item_model = api.model('BatchItem', {
+        'type': fields.String(description='Item kind; inferred from the fields when omitted',
+                             enum=['simple', 'styled', 'creative'], example='creative'),
+        'prompt': fields.String(description='Prompt for simple items', example='What is AI?'),
+        'topic': fields.String(description='Topic for styled items', example='Python programming'),
+        'style': fields.String(description='Style for styled items',
+                              enum=styles, example=styles[0]),
+        'content_type': fields.String(description='Content type for creative items',
+                                     enum=content_types, example=content_types[0]),
+        'subject': fields.String(description='Subject for creative items', example='cats'),
+        **generation_fields
+    })
+    
+    batch_request_model = api.model('BatchRequest', {
+        'items': fields.List(fields.Nested(batch_item_model), required=True,
+                            description='Generation requests to run concurrently'),
+        'use_cache': fields.Boolean(description='Allow cached responses to be returned',
+                                   default=True, example=True)
+    })
+    
+    job_request_model = api.clone('JobRequest', batch_item_model, {
+        'use_cache': fields.Boolean(description='Allow a cached response to be returned',
+                                   default=True, example=True)
     })
     
     # Response models
@@ -32,7 +99,60 @@ def configure_swagger_models(api):
         'model_used': fields.String(description='AI model used for generation',
                                    example='gemini-2.0-flash'),
         'timestamp': fields.String(description='Generation timestamp',
-                                  example='2024-01-01 12:00:00')
+                                  example='2024-01-01 12:00:00'),
+        'input_tokens': fields.Integer(description='Estimated tokens of the prompt sent to the model',
+                                      example=12),
+        'truncated': fields.Boolean(description='Whether the input was cut to fit its token budget',
+                                   example=False),
+        'candidates': fields.List(fields.String, description='Every generated candidate; content is the first',
+                                 example=['Artificial Intelligence is...'])
+    })
+    
+    batch_result_model = api.model('BatchResult', {
+        'index': fields.Integer(description='Position of the item in the request', example=0),
+        'status_code': fields.Integer(description='HTTP-style status for this item', example=200),
+        'response': fields.Nested(text_response_model, allow_null=True,
+                                 description='Generated text when the item succeeded'),
+        'error': fields.String(description='Error message when the item failed', example=None)
+    })
+    
+    batch_response_model = api.model('BatchResponse', {
+        'results': fields.List(fields.Nested(batch_result_model), description='Per-item results in request order'),
+        'succeeded': fields.Integer(description='Number of items that succeeded', example=3),
+        'failed': fields.Integer(description='Number of items that failed', example=0)
+    })
+    
+    job_response_model = api.model('JobResponse', {
+        'job_id': fields.String(description='Job id', example='3f2b8c1e9a6d4e7f8b0c1d2e3f4a5b6c'),
+        'kind': fields.String(description='Generation kind', enum=['simple', 'styled', 'creative'],
+                             example='simple'),
+        'status': fields.String(description='Job status', enum=['queued', 'running', 'succeeded', 'failed'],
+                               example='succeeded'),
+        'status_code': fields.Integer(description='HTTP-style status of the finished job', example=200),
+        'response': fields.Nested(text_response_model, allow_null=True,
+                                  description='Generated text when the job succeeded'),
+        'error': fields.String(description='Error message when the job failed', example=None),
+        'submitted_at': fields.String(description='When the job was queued', example='2024-01-01T12:00:00'),
+        'started_at': fields.String(description='When a worker started the job', example='2024-01-01T12:00:01'),
+        'finished_at': fields.String(description='When the job finished', example='2024-01-01T12:00:03')
+    })
+    
+    job_queue_stats_response_model = api.model('JobQueueStatsResponse', {
+        'workers': fields.Integer(description='Jobs executed at the same time', example=4),
+        'max_queue': fields.Integer(description='Jobs that may wait for a worker', example=100),
+        'result_ttl': fields.Float(description='Seconds finished results are kept', example=600),
+        'shared': fields.Boolean(description='Whether jobs are kept in a store every worker process shares',
+                                 example=True),
+        'queued': fields.Integer(description='Jobs waiting for a worker', example=12),
+        'running': fields.Integer(description='Jobs being executed', example=4),
+        'stored': fields.Integer(description='Jobs stored, including finished ones', example=80),
+        'submitted': fields.Integer(description='Jobs accepted', example=500),
+        'rejected': fields.Integer(description='Submissions rejected because the queue was full', example=3),
+        'succeeded': fields.Integer(description='Jobs that succeeded', example=480),
+        'failed': fields.Integer(description='Jobs that failed', example=4),
+        'expired': fields.Integer(description='Finished jobs dropped after their result TTL', example=400),
+        'recovered': fields.Integer(description='Jobs of exited workers put back in the queue', example=0),
+        'avg_duration': fields.Float(description='Average job duration in seconds', example=1.2)
     })
     
     health_response_model = api.model('HealthResponse', {
@@ -43,6 +163,150 @@ def configure_swagger_models(api):
                                   example='2024-01-01T12:00:00Z')
     })
     
+    cache_stats_response_model = api.model('CacheStatsResponse', {
+        'enabled': fields.Boolean(description='Whether the response cache is enabled', example=True),
+        'entries': fields.Integer(description='Number of cached responses', example=42),
+        'bytes': fields.Integer(description='Approximate cache size in bytes', example=18432),
+        'max_entries': fields.Integer(description='Maximum number of cached responses', example=1024),
+        'max_bytes': fields.Integer(description='Cache byte budget', example=16777216),
+        'hits': fields.Integer(description='Cache hits', example=120),
+        'misses': fields.Integer(description='Cache misses', example=40),
+        'store_hits': fields.Integer(description='Hits served from the persistent store', example=12),
+        'store_errors': fields.Integer(description='Persistent store reads and writes that failed '
+                                                   '(served from memory instead)', example=0),
+        'evictions': fields.Integer(description='Entries evicted to stay within budget', example=3),
+        'expirations': fields.Integer(description='Entries dropped after their TTL', example=5),
+        'hit_rate': fields.Float(description='Hits divided by lookups', example=0.75)
+    })
+    
+    response_store_stats_response_model = api.model('ResponseStoreStatsResponse', {
+        'enabled': fields.Boolean(description='Whether the persistent store is enabled', example=True),
+        'entries': fields.Integer(description='Stored responses (null while the database is unreadable)',
+                                  example=5120),
+        'bytes': fields.Integer(description='Size of stored prompts and content (null while unreadable)',
+                                example=4194304),
+        'max_bytes': fields.Integer(description='Byte budget enforced by compaction', example=536870912),
+        'hits': fields.Integer(description='Lookups found on disk (this worker)', example=80),
+        'misses': fields.Integer(description='Lookups not found on disk (this worker)', example=20),
+        'writes': fields.Integer(description='Responses written (this worker)', example=20),
+        'evictions': fields.Integer(description='Entries dropped to stay within budget', example=0),
+        'expirations': fields.Integer(description='Expired entries removed', example=3),
+        'compactions': fields.Integer(description='Compactions run by this worker', example=2),
+        'hit_rate': fields.Float(description='Hits divided by lookups', example=0.8)
+    })
+    
+    cache_warmer_stats_response_model = api.model('CacheWarmerStatsResponse', {
+        'enabled': fields.Boolean(description='Whether cache warming is enabled', example=True),
+        'tracked': fields.Integer(description='Styled and creative items with a popularity score', example=8200),
+        'recorded': fields.Integer(description='Requests counted since startup', example=120000),
+        'top_k': fields.Integer(description='Most popular items kept warm', example=500),
+        'rate': fields.Float(description='Upstream calls per second while warming', example=1.0),
+        'ttl': fields.Float(description='Seconds a warmed answer stays cached', example=86400),
+        'off_peak_hours': fields.String(description='Local hours during which warming runs', example='1-6'),
+        'off_peak': fields.Boolean(description='Whether it is off-peak now', example=False),
+        'leader': fields.Boolean(description='Whether this worker process is the one that warms', example=True),
+        'runs': fields.Integer(description='Warming passes run', example=3),
+        'warmed': fields.Integer(description='Answers generated by the warmer', example=1320),
+        'fresh': fields.Integer(description='Popular items whose cached answer was still fresh', example=180),
+        'failed': fields.Integer(description='Items that could not be generated', example=2),
+        'interrupted': fields.Integer(description='Passes cut short by traffic, errors or the end of the window',
+                                     example=1),
+        'loaded': fields.Integer(description='Answers loaded from snapshots (at startup and from the warming worker)',
+                                example=480),
+        'last_run': fields.String(description='When the last pass finished', example='2024-01-01T03:05:00')
+    })
+    
+    semantic_cache_stats_response_model = api.model('SemanticCacheStatsResponse', {
+        'enabled': fields.Boolean(description='Whether the semantic cache is enabled', example=True),
+        'entries': fields.Integer(description='Number of cached prompts', example=420),
+        'capacity': fields.Integer(description='Maximum number of cached prompts', example=50000),
+        'threshold': fields.Float(description='Minimum cosine similarity for a hit', example=0.9),
+        'hits': fields.Integer(description='Lookups answered from a similar prompt', example=35),
+        'misses': fields.Integer(description='Lookups without a similar enough prompt', example=200),
+        'evictions': fields.Integer(description='Entries replaced because the cache was full', example=0),
+        'hit_rate': fields.Float(description='Hits divided by lookups', example=0.15),
+        'avg_hit_similarity': fields.Float(description='Average similarity of hits', example=0.96),
+        'last_similarity': fields.Float(description='Best similarity found by the last lookup', example=0.82)
+    })
+    
+    coalescing_stats_response_model = api.model('CoalescingStatsResponse', {
+        'enabled': fields.Boolean(description='Whether request coalescing is enabled', example=True),
+        'in_flight': fields.Integer(description='Distinct upstream calls currently running', example=2),
+        'executions': fields.Integer(description='Upstream calls made', example=100),
+        'coalesced': fields.Integer(description='Requests that shared another caller\'s upstream call',
+                                   example=37)
+    })
+    
+    key_stats_model = api.model('KeyStats', {
+        'key_id': fields.String(description='Pool slot name (the key itself is never shown)', example='key-1'),
+        'tier': fields.String(description='Model tier the client belongs to', example='standard'),
+        'model': fields.String(description='Model the client calls', example='gemini-2.0-flash'),
+        'in_flight': fields.Integer(description='Calls currently using this key', example=3),
+        'requests': fields.Integer(description='Calls made with this key', example=1200),
+        'errors': fields.Integer(description='Failed calls', example=4),
+        'quota_errors': fields.Integer(description='429 / quota errors', example=1),
+        'available': fields.Boolean(description='False while the key is cooling down', example=True),
+        'cooldown_remaining': fields.Float(description='Seconds until the key is used again', example=0.0)
+    })
+    
+    key_pool_stats_response_model = api.model('KeyPoolStatsResponse', {
+        'strategy': fields.String(description='Key selection strategy', example='least_loaded'),
+        'keys': fields.List(fields.Nested(key_stats_model), description='Per-key usage')
+    })
+    
+    circuit_stats_model = api.model('CircuitStats', {
+        'state': fields.String(description='Circuit breaker state',
+                              enum=['closed', 'open', 'half_open'], example='closed'),
+        'consecutive_failures': fields.Integer(description='Failures since the last success', example=0),
+        'times_opened': fields.Integer(description='How often the circuit has opened', example=1),
+        'rejected': fields.Integer(description='Calls failed fast while open', example=12)
+    })
+    
+    resilience_stats_response_model = api.model('ResilienceStatsResponse', {
+        'retries': fields.Integer(description='Upstream calls retried after a transient error', example=7),
+        'hedges_sent': fields.Integer(description='Second calls sent for slow requests', example=3),
+        'hedges_won': fields.Integer(description='Hedged calls that answered first', example=2),
+        'latency_p95': fields.Float(description='Recent p95 upstream latency in seconds', example=1.8),
+        'circuit': fields.Nested(circuit_stats_model, description='Circuit breaker state')
+    })
+    
+    concurrency_stats_response_model = api.model('ConcurrencyStatsResponse', {
+        'enabled': fields.Boolean(description='Whether the concurrency limiter is enabled', example=True),
+        'limit': fields.Integer(description='Current limit on concurrent upstream calls', example=24),
+        'min_limit': fields.Integer(description='Lowest the limit may go', example=2),
+        'max_limit': fields.Integer(description='Highest the limit may go', example=200),
+        'in_flight': fields.Integer(description='Upstream calls holding a slot', example=24),
+        'queue_depth': fields.Integer(description='Upstream calls waiting for a slot', example=5),
+        'max_queue': fields.Integer(description='Calls that may wait for a slot', example=50),
+        'queue_timeout': fields.Float(description='Seconds a call may wait before it is shed', example=2.0),
+        'accepted': fields.Integer(description='Calls that got a slot', example=1200),
+        'queued': fields.Integer(description='Calls that had to wait for a slot', example=140),
+        'shed': fields.Integer(description='Calls rejected with a 503', example=9),
+        'shed_queue_full': fields.Integer(description='Calls shed because the queue was full or too slow', example=6),
+        'shed_deadline': fields.Integer(description='Calls shed after waiting queue_timeout seconds', example=3),
+        'increases': fields.Integer(description='Times the limit grew', example=30),
+        'decreases': fields.Integer(description='Times the limit was cut after slow or failed calls', example=4),
+        'latency': fields.Float(description='Recent upstream latency in seconds', example=1.3),
+        'baseline_latency': fields.Float(description='Long-run upstream latency in seconds', example=1.1)
+    })
+    
+    priority_class_stats_model = api.model('PriorityClassStats', {
+        'name': fields.String(description='Priority class', example='interactive'),
+        'waiting': fields.Integer(description='Calls waiting for a slot', example=2),
+        'queued': fields.Integer(description='Calls that had to wait for a slot', example=140),
+        'dispatched': fields.Integer(description='Waiting calls that got a slot', example=135),
+        'dropped': fields.Integer(description='Waiting calls shed after their queue timeout', example=3),
+        'avg_wait': fields.Float(description='Average seconds a call waited for a slot', example=0.08),
+        'wait_p95': fields.Float(description='Recent p95 wait for a slot in seconds', example=0.3),
+        'latency_p95': fields.Float(description='Recent p95 request latency in seconds', example=1.9)
+    })
+    
+    scheduler_stats_response_model = api.model('SchedulerStatsResponse', {
+        'default_class': fields.String(description='Class of calls made without a priority', example='interactive'),
+        'aging': fields.Float(description='Seconds of waiting that promote a call by one class', example=5.0),
+        'classes': fields.List(fields.Nested(priority_class_stats_model), description='Per-class statistics')
+    })
+    
     error_response_model = api.model('ErrorResponse', {
         'error': fields.String(description='Error message',
                               example='Invalid input. Please provide a valid prompt.'),
@@ -53,7 +317,21 @@ def configure_swagger_models(api):
         'simple_request': simple_request_model,
         'styled_request': styled_request_model,
         'creative_request': creative_request_model,
+        'batch_request': batch_request_model,
         'text_response': text_response_model,
+        'batch_response': batch_response_model,
+        'job_request': job_request_model,
+        'job_response': job_response_model,
+        'job_queue_stats_response': job_queue_stats_response_model,
         'health_response': health_response_model,
+        'cache_stats_response': cache_stats_response_model,
+        'response_store_stats_response': response_store_stats_response_model,
+        'cache_warmer_stats_response': cache_warmer_stats_response_model,
+        'semantic_cache_stats_response': semantic_cache_stats_response_model,
+        'coalescing_stats_response': coalescing_stats_response_model,
+        'key_pool_stats_response': key_pool_stats_response_model,
+        'resilience_stats_response': resilience_stats_response_model,
+        'concurrency_stats_response': concurrency_stats_response_model,
+        'scheduler_stats_response': scheduler_stats_response_model,
         'error_response': error_response_model
     }
\ No newline at end of file
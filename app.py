@@ -3,15 +3,33 @@ Main Flask application for Text Generation API
 Provides REST endpoints for LangChain + Gemini integration
 """
 
+import os
+import sys
 from flask import Flask
 from flask_restx import Api
 from util.config import Config
-from api.routes import api as generation_api
+from api.routes import api as generation_api, warmup_service, scheduler
+from services.template_registry import get_template_registry
+from api.rate_limit import (RateLimiter, InMemoryBackend, RedisBackend, batch_item_cost, init_rate_limiting,
+                            parse_limit)
+from api.body_limit import init_body_limit
+from api.priority import init_priority
+from api.profiling import init_request_profiling
+from util.metrics import init_request_metrics
 
-def create_app():
-    """Create and configure Flask application"""
+def create_app(warmup=None):
+    """
+    Create and configure Flask application
+    
+    Args:
+        warmup (bool): Build the Gemini service now instead of on the first request.
+            Defaults to Config.WARMUP_ON_START.
+    """
     app = Flask(__name__)
     
+    # Load and check the prompt templates once, before serving requests
+    get_template_registry()
+    
     # Configure Flask-RESTX API with Swagger documentation
     api = Api(
         app,
@@ -22,9 +40,41 @@ def create_app():
         prefix='/api'
     )
     
+    # Per-route request counts by final status, including requests refused before their handler
+    init_request_metrics(app)
+    
+    # X-Profile requests from admins run under cProfile (no hooks at all without ADMIN_TOKEN)
+    init_request_profiling(app, Config.ADMIN_TOKEN)
+    
+    # Issued API keys; an unknown X-API-Key is treated like no key (the client's IP)
+    known_keys = set(Config.CLIENT_API_KEYS).union(Config.PRIORITY_API_KEYS, Config.CLIENT_WEIGHTS)
+    
+    # Oversized bodies are refused before Flask parses them
+    init_body_limit(app, Config.MAX_REQUEST_BYTES)
+    
+    # Per-client rate limits, checked before the handler runs; batches are charged one token per item
+    # (which reads their body, so the size cap above goes first)
+    if Config.RATE_LIMIT_ENABLED:
+        if Config.RATE_LIMIT_BACKEND == 'redis':
+            backend = RedisBackend(Config.RATE_LIMIT_REDIS_URL)
+        else:
+            backend = InMemoryBackend()
+        limits = {endpoint: parse_limit(value) for endpoint, value in Config.RATE_LIMITS.items()}
+        init_rate_limiting(app, RateLimiter(limits, backend, Config.RATE_LIMIT_TRUST_FORWARDED_FOR, known_keys),
+                           submit_paths={'/api/jobs': 'jobs'}, costs={'batch': batch_item_cost})
+    
+    # Priority class and client of each generation request, used when calls queue for Gemini
+    init_priority(app, scheduler, key_classes=Config.PRIORITY_API_KEYS,
+                  path_classes={'/api/generate/batch': 'batch', '/api/jobs': 'background'},
+                  trust_forwarded_for=Config.RATE_LIMIT_TRUST_FORWARDED_FOR, known_keys=known_keys)
+    
     # Register API namespaces
     api.add_namespace(generation_api)
     
+    # Optionally pay the LangChain import and client setup cost up front
+    if Config.WARMUP_ON_START if warmup is None else warmup:
+        warmup_service()
+    
     # Global error handlers
     @api.errorhandler(Exception)
     def handle_exception(error):
@@ -47,8 +97,24 @@ def create_app():
     
     return app
 
+def run_production():
+    """Replace this process with gunicorn, configured by gunicorn_conf.py"""
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(project_root)
+    os.execvp(sys.executable, [
+        sys.executable, '-m', 'gunicorn',
+        '--config', os.path.join(project_root, 'gunicorn_conf.py'),
+        'wsgi:application'
+    ])
+
 def main():
     """Main function to run the Flask application"""
+    if Config.SERVER_MODE == 'production':
+        print(f"🚀 Starting gunicorn with {Config.SERVER_WORKERS} workers x {Config.SERVER_THREADS} threads "
+              f"on http://{Config.FLASK_HOST}:{Config.FLASK_PORT}")
+        run_production()
+        return
+    
     try:
         # Create Flask app
         app = create_app()
@@ -62,6 +128,9 @@ def main():
         print("   POST /api/generate/styled    - Styled text generation")
         print("   POST /api/generate/creative  - Creative content generation")
         print("\n💡 Tip: Visit /api/docs for interactive API testing!")
+        if Config.FLASK_DEBUG:
+            print("⚠️  Debug mode is on (FLASK_DEBUG=true): development only")
+        print("💡 For production use SERVER_MODE=production (gunicorn, multiple workers)")
         print("\n" + "="*60)
         
         # Run Flask app
@@ -70,7 +139,7 @@ def main():
             port=Config.FLASK_PORT,
             debug=Config.FLASK_DEBUG
         )
-        
+    
     except Exception as e:
         print(f"❌ Failed to start Flask application: {e}")
         print("\n🔧 Troubleshooting:")
@@ -0,0 +1,17 @@
+"""
+ASGI entry point for the Text Generation API
+
+Serve with any ASGI server, for example:
+    uvicorn asgi:application --host 127.0.0.1 --port 5000 --workers 4
+
+Flask is a WSGI app, so every request runs on a thread from a pool of
+SERVER_THREADS threads per worker process (a2wsgi's WSGIMiddleware). Without
+the pool (asgiref's WsgiToAsgi) all requests of a worker would take turns on
+one shared thread.
+"""
+
+from a2wsgi import WSGIMiddleware
+from app import create_app
+from util.config import Config
+
+application = WSGIMiddleware(create_app(), workers=Config.SERVER_THREADS)
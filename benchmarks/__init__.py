@@ -0,0 +1 @@
+"""Offline load-test benchmarks for the generation endpoints (see benchmarks/run.py)"""
@@ -0,0 +1,225 @@
+"""
+Load-test benchmark for the /api/generate/* routes
+
+Serves the app in-process with the fake model backend (no API key, no network),
+drives each route at a fixed concurrency and reports requests per second,
+p50/p95/p99 latency and CPU time per request. Results are compared with a
+stored baseline and the run fails when a route regressed:
+    
+    python -m benchmarks.run
+    python -m benchmarks.run --concurrency 16 --requests 800 --json
+    python -m benchmarks.run --update-baseline
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# One request per route; the cache is bypassed so every request reaches the model
+SCENARIOS = {
+    'simple': ('/api/generate/simple', {'prompt': 'What is artificial intelligence?', 'use_cache': False}),
+    'styled': ('/api/generate/styled', {'topic': 'Python programming', 'style': 'casual', 'use_cache': False}),
+    'creative': ('/api/generate/creative', {'content_type': 'poem', 'subject': 'the ocean', 'use_cache': False})
+}
+
+# Metrics compared with the baseline, and whether a higher value is worse
+COMPARED_METRICS = {'p95_ms': True, 'cpu_ms_per_request': True, 'rps': False}
+
+# Allowed relative regression before a run fails
+DEFAULT_TOLERANCE = 0.25
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+    
+    Args:
+        values (list): Samples
+        percent (float): Percentile, e.g. 95
+    
+    Returns:
+        float: The percentile, or 0.0 for no samples
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * percent / 100)) - 1))]
+
+def create_benchmark_app(latency_ms=20.0, distribution='lognormal', error_rate=0.0):
+    """
+    Build the app with the fake model backend and rate limiting off
+    
+    Args:
+        latency_ms (float): Median fake model latency
+        distribution (str): Fake model latency distribution
+        error_rate (float): Fraction of fake model calls that fail
+    
+    Returns:
+        Flask: The application
+    """
+    from util.config import Config
+    
+    Config.LLM_BACKEND = 'fake'
+    Config.RATE_LIMIT_ENABLED = False
+    Config.FAKE_LLM_LATENCY_MS = latency_ms
+    Config.FAKE_LLM_LATENCY_DISTRIBUTION = distribution
+    Config.FAKE_LLM_ERROR_RATE = error_rate
+    
+    from app import create_app
+    from api import routes
+    
+    routes.gemini_service = None
+    return create_app(warmup=True)
+
+def run_scenario(app, path, payload, concurrency=8, total_requests=200, warmup_requests=5):
+    """
+    Send total_requests POSTs to one route from `concurrency` threads
+    
+    Args:
+        app (Flask): The application
+        path (str): Route path
+        payload (dict): JSON body
+        concurrency (int): Number of client threads
+        total_requests (int): Requests across all threads
+        warmup_requests (int): Untimed requests each thread sends first
+    
+    Returns:
+        dict: rps, latency percentiles in ms, CPU ms per request and error count
+    """
+    latencies = []
+    cpu_times = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(1, total_requests // concurrency)
+    ready = threading.Barrier(concurrency + 1)
+    
+    def worker():
+        client = app.test_client()
+        for _ in range(warmup_requests):
+            client.post(path, json=payload)
+        ready.wait()
+        local_latencies, local_cpu, local_errors = [], [], 0
+        for _ in range(per_thread):
+            cpu_start = time.thread_time()
+            start = time.perf_counter()
+            response = client.post(path, json=payload)
+            local_latencies.append(time.perf_counter() - start)
+            local_cpu.append(time.thread_time() - cpu_start)
+            if response.status_code != 200:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            cpu_times.extend(local_cpu)
+            errors[0] += local_errors
+    
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    # Start the clock once every thread has finished its warm-up requests
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'cpu_ms_per_request': round(sum(cpu_times) / max(1, len(cpu_times)) * 1000, 3)
+    }
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Find metrics that got worse than the baseline by more than the tolerance
+    
+    Args:
+        results (dict): Route name -> metrics from run_scenario()
+        baseline (dict): Same shape, from the baseline file (other keys are ignored)
+        tolerance (float): Allowed relative regression, e.g. 0.25 for 25%
+    
+    Returns:
+        list: Human-readable regression messages (empty when everything is within budget)
+    """
+    regressions = []
+    for route, metrics in results.items():
+        expected = baseline.get(route)
+        if not expected:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            if metric not in expected or not expected[metric]:
+                continue
+            change = (metrics[metric] - expected[metric]) / expected[metric]
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"{route}.{metric}: {metrics[metric]} vs baseline {expected[metric]} "
+                                   f"({change:+.0%})")
+    return regressions
+
+def main():
+    """Run the benchmark, print the report and fail on regressions"""
+    parser = argparse.ArgumentParser(description='Benchmark the generation endpoints with a fake model')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=400, help='Requests per route')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Median fake model latency')
+    parser.add_argument('--distribution', default='lognormal', help='fixed, uniform or lognormal')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of failing model calls')
+    parser.add_argument('--routes', default=','.join(SCENARIOS), help='Comma-separated routes to run')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'Allowed regression (default {DEFAULT_TOLERANCE}, i.e. {DEFAULT_TOLERANCE * 100:.0f}%%)')
+    parser.add_argument('--update-baseline', action='store_true', help='Save these results as the baseline')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+    
+    app = create_benchmark_app(args.latency_ms, args.distribution, args.error_rate)
+    results = {}
+    for route in args.routes.split(','):
+        path, payload = SCENARIOS[route]
+        results[route] = run_scenario(app, path, payload, args.concurrency, args.requests)
+    
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"🏁 Benchmark: concurrency={args.concurrency}, fake latency={args.latency_ms} ms")
+        print(f"   {'route':<10}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cpu ms':>10}{'errors':>8}")
+        for route, result in results.items():
+            print(f"   {route:<10}{result['rps']:>9}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                  f"{result['p99_ms']:>10}{result['cpu_ms_per_request']:>10}{result['errors']:>8}")
+    
+    # Keep stdout machine-readable in --json mode
+    log = sys.stderr if args.json else sys.stdout
+    settings = {'concurrency': args.concurrency, 'requests': args.requests, 'latency_ms': args.latency_ms,
+                'distribution': args.distribution, 'error_rate': args.error_rate}
+    
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(dict(results, settings=settings), f, indent=2)
+            f.write('\n')
+        print(f"\n💾 Baseline saved to {args.baseline}", file=log)
+        return
+    
+    if not os.path.exists(args.baseline):
+        print("\nℹ️  No baseline yet; run with --update-baseline to create one", file=log)
+        return
+    
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print(f"\n⚠️  Baseline was recorded with different settings: {baseline.get('settings')}", file=log)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Regressions against baseline:", file=log)
+        for message in regressions:
+            print(f"   {message}", file=log)
+        sys.exit(1)
+    print("\n✅ Within baseline tolerance", file=log)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""
+Offline bulk generation from a JSONL file
+
+Each input line is one request item, as accepted by /api/generate/batch
+(e.g. {"prompt": ...}, {"topic": ..., "style": ...} or
+{"content_type": ..., "subject": ...}; an optional "id" is copied to the output).
+Results are appended to an output JSONL file as they complete, and progress is
+checkpointed so an interrupted job resumes without regenerating finished items.
+Failures that may succeed later (rate limited, overloaded, circuit open, upstream
+errors) are also copied to <output>.retry.jsonl, and the next run replays that
+file before the rest of the input; the last record for an index is its final
+result:
+    
+    python bulk_generate.py prompts.jsonl -o results.jsonl --concurrency 8 --rate 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from util.config import Config
+from api.rate_limit import InMemoryBackend
+from services.scheduler import scheduled_as
+
+class Checkpoint:
+    """
+    Tracks which input lines are finished
+    
+    Lines below ``low_water`` are all done; ``done`` holds finished lines above
+    it (completions arrive out of order). Only the window of in-flight lines is
+    ever kept in memory, whatever the file size. ``replay`` tracks the lines of
+    the retry file being replayed the same way.
+    """
+    
+    def __init__(self, path, low_water=0, done=None, replay=None):
+        """
+        Initialize the checkpoint
+        
+        Args:
+            path (str): Checkpoint file
+            low_water (int): Every line index below this is done
+            done (iterable): Finished line indexes at or above low_water
+            replay (Checkpoint): Progress through the replayed retry file, or None
+        """
+        self.path = path
+        self.low_water = low_water
+        self.done = set()
+        for index in done or ():
+            self.mark_done(index)
+        self.replay = replay
+    
+    @classmethod
+    def load(cls, path):
+        """Load a checkpoint file, or start a new one if it does not exist"""
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        replay = data.get('replay')
+        if replay is not None:
+            replay = cls(None, replay.get('low_water', 0), replay.get('done', []))
+        return cls(path, data.get('low_water', 0), data.get('done', []), replay)
+    
+    def is_done(self, index):
+        """Check whether a line index is finished"""
+        return index < self.low_water or index in self.done
+    
+    def mark_done(self, index):
+        """Record a finished line index and advance the low-water mark"""
+        if index < self.low_water:
+            return
+        self.done.add(index)
+        while self.low_water in self.done:
+            self.done.remove(self.low_water)
+            self.low_water += 1
+    
+    def save(self):
+        """Write the checkpoint atomically (a crash never leaves a half-written file)"""
+        data = {'low_water': self.low_water, 'done': sorted(self.done)}
+        if self.replay is not None:
+            data['replay'] = {'low_water': self.replay.low_water, 'done': sorted(self.replay.done)}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+def retry_paths(output_path):
+    """
+    Return the files retryable failures are kept in
+    
+    Args:
+        output_path (str): Output JSONL file
+    
+    Returns:
+        tuple: (retry file this run appends to, retry file this run replays)
+    """
+    return output_path + '.retry.jsonl', output_path + '.replay.jsonl'
+
+def is_retryable(record):
+    """
+    Check whether an output record is a failure worth retrying on the next run
+    
+    Args:
+        record (dict): Output record
+    
+    Returns:
+        bool: True for timeouts, 429s and 5xx errors (validation errors and successes are final)
+    """
+    status_code = record.get('status_code', 200)
+    return status_code in (408, 429) or status_code >= 500
+
+def recover_from_output(checkpoint, output_path):
+    """
+    Mark lines written to the output after the last checkpoint save as done
+    
+    Retryable failures are left alone: their copy in the retry file may not have
+    been flushed, so those lines are generated again from the input instead.
+    
+    Args:
+        checkpoint (Checkpoint): Checkpoint to update
+        output_path (str): Output JSONL file
+    
+    Returns:
+        bool: True if the output ends with a partial line (a newline must be written before appending)
+    """
+    if not os.path.exists(output_path):
+        return False
+    
+    partial = False
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                partial = True
+                break
+            try:
+                record = json.loads(line)
+                if not is_retryable(record):
+                    checkpoint.mark_done(record['index'])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+    return partial
+
+def _ends_with_partial_line(path):
+    """Check whether a file ends without a newline (a write cut short by a crash)"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b'\n'
+
+def _input_lines(input_path):
+    """Yield (checkpoint position, line index, line) for every input line"""
+    with open(input_path, encoding='utf-8') as source:
+        for index, line in enumerate(source):
+            yield index, index, line
+
+def _replay_lines(replay_path):
+    """Yield (checkpoint position, line index, line) for every complete entry of a retry file"""
+    with open(replay_path, encoding='utf-8') as source:
+        for position, entry in enumerate(source):
+            try:
+                entry = json.loads(entry)
+                yield position, entry['index'], entry['line']
+            except (ValueError, KeyError, TypeError):
+                continue  # a partial last line: that failure was never checkpointed, the input has it
+
+def _result_record(index, line, service, use_cache):
+    """Generate one input line and build its output record"""
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        return {'index': index, 'status_code': 400, 'error': f'Invalid JSON: {e}'}
+    
+    record = {'index': index}
+    if isinstance(item, dict) and 'id' in item:
+        record['id'] = item['id']
+    try:
+        response = service.generate_item(item, use_cache=use_cache)
+        record.update(status_code=200, response=response.to_dict())
+    except Exception as e:
+        record.update(status_code=getattr(e, 'status_code', 500), error=str(e))
+    return record
+
+class _RetryFile:
+    """Appends retryable lines to the retry file, opening it on the first one"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+    
+    def add(self, index, line):
+        """Save one input line for the next run"""
+        if self._file is None:
+            partial = _ends_with_partial_line(self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if partial:
+                self._file.write('\n')
+        self._file.write(json.dumps({'index': index, 'line': line}) + '\n')
+    
+    def sync(self):
+        """Flush the file to disk (before the checkpoint that marks its lines done is saved)"""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+def run_bulk(service, input_path, output_path, checkpoint_path=None, concurrency=8, rate=0.0, burst=1,
+             use_cache=True, checkpoint_interval=2.0, limit=None):
+    """
+    Generate every line of a JSONL file, resuming from the checkpoint if there is one
+    
+    Args:
+        service (GeminiService): Service used for generation
+        input_path (str): Input JSONL file
+        output_path (str): Output JSONL file (appended to)
+        checkpoint_path (str): Checkpoint file (defaults to output_path + '.checkpoint')
+        concurrency (int): Maximum items generated at the same time
+        rate (float): Maximum items started per second (0 for no limit)
+        burst (int): Items that may start back to back before the rate applies
+        use_cache (bool): Whether cached responses may be used
+        checkpoint_interval (float): Seconds between checkpoint saves
+        limit (int): Stop after this many new items (useful for trial runs)
+    
+    Returns:
+        dict: Counts of succeeded, failed and skipped (already done) items
+    """
+    checkpoint = Checkpoint.load(checkpoint_path or output_path + '.checkpoint')
+    partial_line = recover_from_output(checkpoint, output_path)
+    
+    # Replay the failures the previous run saved for retrying (unless a replay is still unfinished)
+    retry_path, replay_path = retry_paths(output_path)
+    if not os.path.exists(replay_path) and os.path.exists(retry_path):
+        os.replace(retry_path, replay_path)
+        checkpoint.replay = None
+    if not os.path.exists(replay_path):
+        checkpoint.replay = None
+    elif checkpoint.replay is None:
+        checkpoint.replay = Checkpoint(None)
+    
+    lock = threading.Lock()
+    window = threading.BoundedSemaphore(concurrency * 2)  # lines read ahead of the workers
+    bucket = InMemoryBackend()
+    summary = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+    last_save = [time.monotonic()]
+    replay_finished = False
+    
+    with open(output_path, 'a', encoding='utf-8') as output, \
+            _RetryFile(retry_path) as retries:
+        if partial_line:
+            output.write('\n')
+        
+        def save_checkpoint():
+            output.flush()
+            os.fsync(output.fileno())
+            retries.sync()
+            checkpoint.save()
+            last_save[0] = time.monotonic()
+        
+        def finish(progress, position, index, line, record):
+            with lock:
+                if record is not None:
+                    output.write(json.dumps(record) + '\n')
+                    summary['succeeded' if record['status_code'] == 200 else 'failed'] += 1
+                    # Checkpointed like any other line (so the low-water mark keeps moving) but
+                    # kept in the retry file for the next run
+                    if is_retryable(record):
+                        retries.add(index, line)
+                progress.mark_done(position)
+                if time.monotonic() - last_save[0] >= checkpoint_interval:
+                    save_checkpoint()
+        
+        def work(progress, position, index, line):
+            try:
+                # Bulk items wait behind interactive calls and get the long background queue timeout
+                with scheduled_as('background', 'bulk'):
+                    record = _result_record(index, line, service, use_cache)
+                finish(progress, position, index, line, record)
+            finally:
+                window.release()
+        
+        sources = [(checkpoint, _input_lines(input_path))]
+        if checkpoint.replay is not None:
+            sources.insert(0, (checkpoint.replay, _replay_lines(replay_path)))
+        started = 0
+        stopped = False
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for progress, lines in sources:
+                for position, index, line in lines:
+                    if progress.is_done(position):
+                        if progress is checkpoint:
+                            summary['skipped'] += 1
+                        continue
+                    if not line.strip():
+                        finish(progress, position, index, line, None)
+                        continue
+                    if limit is not None and started >= limit:
+                        stopped = True
+                        break
+                    
+                    window.acquire()
+                    while rate > 0:
+                        allowed, retry_after = bucket.consume('bulk', max(1, burst), rate)
+                        if allowed:
+                            break
+                        time.sleep(retry_after)
+                    executor.submit(work, progress, position, index, line)
+                    started += 1
+                if stopped:
+                    break
+                replay_finished = replay_finished or progress is checkpoint.replay
+        finally:
+            executor.shutdown(wait=True)
+            with lock:
+                save_checkpoint()
+    
+    if replay_finished:
+        # Every replayed failure now has a newer record (or a new retry entry)
+        os.remove(replay_path)
+        checkpoint.replay = None
+        checkpoint.save()
+    return summary
+
+def main():
+    """Parse arguments and run the bulk job"""
+    parser = argparse.ArgumentParser(description='Generate text for every line of a JSONL file')
+    parser.add_argument('input', help='Input JSONL file, one request item per line')
+    parser.add_argument('-o', '--output', help='Output JSONL file (default: <input>.results.jsonl)')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: <output>.checkpoint)')
+    parser.add_argument('--concurrency', type=int, default=Config.BATCH_MAX_WORKERS,
+                        help='Items generated at the same time')
+    parser.add_argument('--rate', type=float, default=0.0, help='Maximum items started per second (0 = no limit)')
+    parser.add_argument('--burst', type=int, default=1, help='Items that may start back to back')
+    parser.add_argument('--limit', type=int, help='Stop after this many new items')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the model')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and overwrite the output')
+    args = parser.parse_args()
+    
+    output_path = args.output or os.path.splitext(args.input)[0] + '.results.jsonl'
+    checkpoint_path = args.checkpoint or output_path + '.checkpoint'
+    if args.restart:
+        for path in (output_path, checkpoint_path, *retry_paths(output_path)):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    from api.routes import get_gemini_service
+    service = get_gemini_service()
+    if service is None:
+        print("❌ Gemini service not available. Please check API key configuration.")
+        sys.exit(1)
+    
+    started = time.perf_counter()
+    try:
+        summary = run_bulk(service, args.input, output_path, checkpoint_path, args.concurrency, args.rate,
+                           args.burst, use_cache=not args.no_cache, limit=args.limit)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted; progress is saved, run the same command again to resume")
+        sys.exit(130)
+    
+    print(f"✅ Done in {time.perf_counter() - started:.1f}s: {summary['succeeded']} succeeded, "
+          f"{summary['failed']} failed, {summary['skipped']} already done")
+    if summary['failed']:
+        print("🔁 Failures that may succeed later (429, 5xx) are saved to "
+              f"{retry_paths(output_path)[0]} and retried when you run the same command again")
+    print(f"📄 Results: {output_path}")
+
+if __name__ == '__main__':
+    main()
@@ -19,4 +19,35 @@ class InvalidInputException(Exception):
     
     def __init__(self, message="Invalid input. Please provide a valid prompt."):
         super().__init__(message)
-        self.status_code = 400
\ No newline at end of file
+        self.status_code = 400
+
+class CircuitOpenException(GenerationException):
+    """Raised when the upstream circuit breaker is open and calls fail fast"""
+    
+    def __init__(self, message="Gemini is currently unavailable. Please try again later.", retry_after=None):
+        super().__init__(message)
+        self.status_code = 503
+        self.retry_after = retry_after
+
+class QueueFullException(GenerationException):
+    """Raised when the background job queue has no room for another job"""
+    
+    def __init__(self, message="Too many jobs are waiting. Please try again later.", retry_after=None):
+        super().__init__(message)
+        self.status_code = 503
+        self.retry_after = retry_after
+
+class OverloadedException(GenerationException):
+    """Raised when a call is shed because too many upstream calls are running or waiting"""
+    
+    def __init__(self, message="The server is overloaded. Please try again shortly.", retry_after=None):
+        super().__init__(message)
+        self.status_code = 503
+        self.retry_after = retry_after
+
+class InputTooLargeException(InvalidInputException):
+    """Raised when user input is over its size or token budget"""
+    
+    def __init__(self, message="Input is too large. Please shorten it."):
+        super().__init__(message)
+        self.status_code = 413
@@ -0,0 +1,60 @@
+"""
+Gunicorn settings for production serving
+
+All values come from Config (SERVER_* environment variables):
+    gunicorn -c gunicorn_conf.py wsgi:application
+or simply:
+    SERVER_MODE=production python app.py
+"""
+
+from util.config import Config
+
+bind = f"{Config.FLASK_HOST}:{Config.FLASK_PORT}"
+
+# Prefork workers, each with a thread pool: requests spend most of their time waiting on Gemini
+worker_class = 'gthread'
+workers = Config.SERVER_WORKERS
+threads = Config.SERVER_THREADS
+
+keepalive = Config.SERVER_KEEPALIVE
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+
+# Recycle workers now and then to cap memory growth; jitter keeps them from restarting together
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+
+# Load the app once in the master so workers share its memory copy-on-write
+preload_app = Config.SERVER_PRELOAD
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    """Import the LangChain/Gemini libraries in the master so forked workers start with them loaded"""
+    if not preload_app:
+        return
+    try:
+        import langchain_google_genai  # noqa: F401
+    except ImportError:
+        pass
+
+def post_fork(server, worker):
+    """Reset per-process state and optionally build the Gemini service before taking requests"""
+    from api import routes
+    
+    routes.after_fork()
+    if Config.WARMUP_ON_START:
+        routes.warmup_service()
+        server.log.info("Worker %s: Gemini service ready", worker.pid)
+
+def worker_int(worker):
+    """Log a worker interrupted by SIGINT/SIGQUIT"""
+    worker.log.info("Worker %s interrupted", worker.pid)
+
+def worker_exit(server, worker):
+    """Release background resources once the worker has drained its in-flight requests"""
+    from api import routes
+    
+    routes.shutdown_service()
+    server.log.info("Worker %s drained and exited", worker.pid)
@@ -5,10 +5,12 @@ Used for both internal processing and JSON serialization in the API
 
 from datetime import datetime
 
+from exception.generation_exceptions import InvalidInputException
+
 class TextRequest:
     """Represents a text generation request with user parameters"""
     
-    def __init__(self, prompt, max_length=100, temperature=0.7):
+    def __init__(self, prompt, max_length=100, temperature=0.7, model_tier=None, n=1):
         """
         Initialize a text generation request
         
@@ -16,10 +18,41 @@ class TextRequest:
             prompt (str): The user's text prompt
             max_length (int): Maximum number of tokens to generate
             temperature (float): Creativity level (0.0 to 1.0)
+            model_tier (str): Model tier to use, or None to let the service choose
+            n (int): Number of candidates to generate
         """
         self.prompt = prompt
         self.max_length = max_length
         self.temperature = temperature
+        self.model_tier = model_tier
+        self.n = n
+    
+    def validate(self, max_length_limit=2048, model_tiers=None, max_candidates=8):
+        """
+        Check the generation parameters
+        
+        Args:
+            max_length_limit (int): Largest allowed max_length
+            model_tiers (iterable): Allowed model tiers (None to accept any)
+            max_candidates (int): Largest allowed n
+        
+        Returns:
+            TextRequest: This request, for chaining
+        
+        Raises:
+            InvalidInputException: If a parameter is out of range
+        """
+        if isinstance(self.max_length, bool) or not isinstance(self.max_length, int) \
+                or not 1 <= self.max_length <= max_length_limit:
+            raise InvalidInputException(f"max_length must be an integer between 1 and {max_length_limit}")
+        if isinstance(self.temperature, bool) or not isinstance(self.temperature, (int, float)) \
+                or not 0.0 <= self.temperature <= 1.0:
+            raise InvalidInputException("temperature must be a number between 0.0 and 1.0")
+        if self.model_tier is not None and model_tiers is not None and self.model_tier not in model_tiers:
+            raise InvalidInputException(f"model_tier must be one of: {', '.join(model_tiers)}")
+        if isinstance(self.n, bool) or not isinstance(self.n, int) or not 1 <= self.n <= max_candidates:
+            raise InvalidInputException(f"n must be an integer between 1 and {max_candidates}")
+        return self
     
     def __str__(self):
         """Return a formatted string representation of the request"""
@@ -30,22 +63,30 @@ class TextRequest:
         return {
             'prompt': self.prompt,
             'max_length': self.max_length,
-            'temperature': self.temperature
+            'temperature': self.temperature,
+            'model_tier': self.model_tier,
+            'n': self.n
         }
 
 class TextResponse:
     """Represents a text generation response from the AI model"""
     
-    def __init__(self, content, model_used="gemini-2.0-flash"):
+    def __init__(self, content, model_used="gemini-2.0-flash", input_tokens=None, truncated=False, candidates=None):
         """
         Initialize a text generation response
         
         Args:
-            content (str): The generated text content
+            content (str): The generated text content (the first candidate)
             model_used (str): Name of the AI model used
+            input_tokens (int): Estimated tokens of the prompt sent to the model
+            truncated (bool): Whether the user input was cut to fit its token budget
+            candidates (list): Every generated candidate when more than one was requested
         """
         self.content = content
         self.model_used = model_used
+        self.input_tokens = input_tokens
+        self.truncated = truncated
+        self.candidates = candidates if candidates is not None else [content]
         self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     def __str__(self):
@@ -57,5 +98,46 @@ class TextResponse:
         return {
             'content': self.content,
             'model_used': self.model_used,
-            'timestamp': self.timestamp
-        }
\ No newline at end of file
+            'timestamp': self.timestamp,
+            'input_tokens': self.input_tokens,
+            'truncated': self.truncated,
+            'candidates': self.candidates
+        }
+
+class TextStream:
+    """Represents a streamed text generation response, delivered chunk by chunk"""
+    
+    def __init__(self, chunks, model_used="gemini-2.0-flash", on_complete=None, input_tokens=None, truncated=False):
+        """
+        Initialize a streamed response
+        
+        Args:
+            chunks (iterable): Iterable of generated text chunks
+            model_used (str): Name of the AI model used
+            on_complete (callable): Optional callback receiving the final TextResponse
+            input_tokens (int): Estimated tokens of the prompt sent to the model
+            truncated (bool): Whether the user input was cut to fit its token budget
+        """
+        self.chunks = chunks
+        self.model_used = model_used
+        self.on_complete = on_complete
+        self.input_tokens = input_tokens
+        self.truncated = truncated
+        self.response = None
+    
+    def __iter__(self):
+        """Yield text chunks, then build the complete TextResponse"""
+        parts = []
+        try:
+            for chunk in self.chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            # Stopped early (client disconnected): close the source now rather than when it is collected
+            close = getattr(self.chunks, 'close', None)
+            if close is not None:
+                close()
+        
+        self.response = TextResponse(''.join(parts), self.model_used, self.input_tokens, self.truncated)
+        if self.on_complete is not None:
+            self.on_complete(self.response)
@@ -0,0 +1,409 @@
+"""Learns the most requested styled/creative items and keeps their answers warm in the response cache"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, every process warms on its own
+    fcntl = None
+
+from model.text_generation import TextResponse
+from services.scheduler import scheduled_as
+from exception.generation_exceptions import GenerationException, InvalidInputException
+
+class PopularityTracker:
+    """
+    Exponentially decayed request counts for generation items
+    
+    Every request adds 1 to its item's score, and scores halve every
+    ``half_life`` seconds, so yesterday's trend fades while steady favourites
+    stay on top. Decay costs nothing per request: new requests are simply
+    counted with a weight that doubles every half-life. Only the
+    ``max_tracked`` best scoring items are kept.
+    """
+    
+    # Request fields that decide which cached answer an item maps to
+    FIELDS = ('type', 'topic', 'style', 'content_type', 'subject', 'max_length', 'temperature', 'model_tier', 'n')
+    
+    def __init__(self, max_tracked=20000, half_life=86400):
+        """
+        Initialize the tracker
+        
+        Args:
+            max_tracked (int): Items kept; the lowest scores are dropped when there are twice as many
+            half_life (float): Seconds after which a request counts half
+        """
+        self.max_tracked = max_tracked
+        self.half_life = half_life
+        self._scores = {}  # item key -> score, in units of the weight at self._epoch
+        self._epoch = time.monotonic()
+        self._lock = threading.Lock()
+        self.recorded = 0
+    
+    @classmethod
+    def item_key(cls, item):
+        """Return a hashable key for an item, ignoring unset and unrelated fields"""
+        return tuple((field, item[field]) for field in cls.FIELDS if item.get(field) is not None)
+    
+    def _weight(self, now):
+        """Weight of a request made now (caller holds the lock)"""
+        return 2 ** ((now - self._epoch) / self.half_life)
+    
+    def _add(self, key, score):
+        """Add to an item's score, rescaling and pruning when needed (caller holds the lock)"""
+        now = time.monotonic()
+        weight = self._weight(now)
+        if weight > 2 ** 40:
+            # Keep numbers small: express every score relative to now
+            self._scores = {item: value / weight for item, value in self._scores.items()}
+            self._epoch, weight = now, 1.0
+        self._scores[key] = self._scores.get(key, 0.0) + score * weight
+        if len(self._scores) > 2 * self.max_tracked:
+            kept = sorted(self._scores.items(), key=lambda entry: entry[1], reverse=True)[:self.max_tracked]
+            self._scores = dict(kept)
+    
+    def record(self, item):
+        """
+        Count one request
+        
+        Args:
+            item (dict): Request fields, as accepted by GeminiService.generate_item()
+        """
+        key = self.item_key(item)
+        with self._lock:
+            self._add(key, 1.0)
+            self.recorded += 1
+    
+    def restore(self, item, score):
+        """Add a score saved in a snapshot (see top())"""
+        key = self.item_key(item)
+        with self._lock:
+            self._add(key, score)
+    
+    def top(self, limit):
+        """
+        Return the most requested items
+        
+        Args:
+            limit (int): Number of items
+        
+        Returns:
+            list: (item dict, current score) pairs, highest score first
+        """
+        with self._lock:
+            weight = self._weight(time.monotonic())
+            ranked = sorted(self._scores.items(), key=lambda entry: entry[1], reverse=True)[:limit]
+        return [(dict(key), round(score / weight, 4)) for key, score in ranked]
+    
+    def __len__(self):
+        return len(self._scores)
+
+class CacheWarmer:
+    """
+    Pre-generates and refreshes the answers of the most popular items
+    
+    A background thread wakes every ``interval`` seconds. Inside the off-peak
+    window, and while no upstream call is waiting for a concurrency slot, it
+    walks the ``top_k`` most requested items and regenerates those whose
+    cached answer is missing or expires within ``refresh_ahead`` seconds.
+    Regenerated answers are cached for ``ttl`` seconds (longer than ordinary
+    entries, so what is warmed at night still serves the next day's peak).
+    Upstream calls are spaced to at most ``rate`` per second and run as the
+    background priority class, so real traffic always goes first.
+    
+    After each pass the popular items and their cached answers are written to
+    ``snapshot_path``; load_snapshot() reads them back at startup so a new
+    deploy starts warm.
+    
+    With ``lock_path`` only the worker process holding an exclusive lock on
+    that file warms (and writes the snapshot), so the upstream rate does not
+    grow with the number of workers. The others reload the snapshot whenever
+    it changes so they serve the warmed answers too, and one of them takes
+    over when the warming worker exits.
+    """
+    
+    def __init__(self, popularity, get_service, cache, top_k=500, rate=1.0, max_per_run=1000, ttl=86400,
+                 refresh_ahead=3600, off_peak_hours=None, interval=300, busy=None, snapshot_path=None,
+                 lock_path=None):
+        """
+        Initialize the warmer
+        
+        Args:
+            popularity (PopularityTracker): Request history to learn popular items from
+            get_service (callable): Returns the GeminiService, or None if it is not available
+            cache (ResponseCache): Cache the answers are kept in
+            top_k (int): Number of popular items kept warm
+            rate (float): Upstream calls per second while warming
+            max_per_run (int): Upstream calls per pass
+            ttl (float): Seconds a warmed answer stays cached
+            refresh_ahead (float): Answers expiring within this many seconds are regenerated
+            off_peak_hours (tuple): (start, end) local hours during which warming runs, e.g. (1, 6);
+                None to warm whenever the server is idle
+            interval (float): Seconds between passes of the background thread
+            busy (callable): Returns True while the server has no spare upstream capacity
+            snapshot_path (str): JSON file the snapshot is saved to and loaded from (None to disable)
+            lock_path (str): File locked by the one process that warms (None: this process always warms)
+        """
+        self.popularity = popularity
+        self.get_service = get_service
+        self.cache = cache
+        self.top_k = top_k
+        self.rate = rate
+        self.max_per_run = max_per_run
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.off_peak_hours = off_peak_hours
+        self.interval = interval
+        self.busy = busy
+        self.snapshot_path = snapshot_path
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._snapshot_mtime = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        
+        self.runs = 0
+        self.warmed = 0
+        self.fresh = 0
+        self.failed = 0
+        self.interrupted = 0
+        self.loaded = 0
+        self.last_run = None
+    
+    def _leads(self):
+        """Whether this process warms without having to take the lock first"""
+        return self.lock_path is None or fcntl is None or self._lock_file is not None
+    
+    def is_leader(self):
+        """
+        Check whether this process is the one that warms, taking the lock if it is free
+        
+        Returns:
+            bool: True if this process holds the lock (always True without lock_path or file locks)
+        """
+        if self._leads():
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            # Held until stop() or the process exits; then another worker takes it
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+    
+    def is_off_peak(self, now=None):
+        """
+        Check whether a time falls in the off-peak window
+        
+        Args:
+            now (datetime): Local time to check (defaults to now)
+        
+        Returns:
+            bool: True inside the window (always True without one)
+        """
+        if self.off_peak_hours is None:
+            return True
+        start, end = self.off_peak_hours
+        hour = (now or datetime.now()).hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end  # window past midnight, e.g. (22, 5)
+    
+    def _may_continue(self, background):
+        """Whether a pass may make another upstream call"""
+        if self._stop.is_set():
+            return False
+        if background and not self.is_off_peak():
+            return False
+        return self.busy is None or not self.busy()
+    
+    def run_once(self, background=False):
+        """
+        Run one warming pass
+        
+        Args:
+            background (bool): Stop early when the off-peak window ends (the background thread's passes)
+        
+        Returns:
+            dict: Items warmed, already fresh and failed in this pass, and whether it was cut short
+        """
+        result = {'warmed': 0, 'fresh': 0, 'failed': 0, 'interrupted': False}
+        service = self.get_service()
+        if service is None or self.cache is None:
+            return result
+        
+        next_call = time.monotonic()
+        with self._lock, scheduled_as('background', 'cache-warmer'):
+            for item, _ in self.popularity.top(self.top_k):
+                if result['warmed'] + result['failed'] >= self.max_per_run:
+                    break
+                try:
+                    key, endpoint = service.item_cache_key(item)
+                except (GenerationException, InvalidInputException):
+                    result['failed'] += 1  # e.g. a style that was removed from the templates
+                    continue
+                if self.cache.entry(key)[1] > self.refresh_ahead:
+                    result['fresh'] += 1
+                    continue
+                
+                # Spend the rate budget: wait for this call's turn, stopping early if needed
+                if self._stop.wait(max(0.0, next_call - time.monotonic())) or not self._may_continue(background):
+                    result['interrupted'] = True
+                    break
+                next_call = time.monotonic() + (1 / self.rate if self.rate > 0 else 0.0)
+                try:
+                    response = service.generate_item(item, use_cache=False)
+                except (GenerationException, InvalidInputException) as e:
+                    result['failed'] += 1
+                    if e.status_code in (429, 503):
+                        # Gemini is struggling or the server got busy; try again next pass
+                        result['interrupted'] = True
+                        break
+                    continue
+                self.cache.set(key, response, endpoint, ttl=self.ttl)
+                result['warmed'] += 1
+            
+            self.runs += 1
+            self.warmed += result['warmed']
+            self.fresh += result['fresh']
+            self.failed += result['failed']
+            self.interrupted += int(result['interrupted'])
+            self.last_run = datetime.now().isoformat()
+        return result
+    
+    def save_snapshot(self, path=None):
+        """
+        Write the popular items and their cached answers to a JSON file
+        
+        Entries carry the cache key (as the persistent store does), so loading
+        them does not need the Gemini service.
+        
+        Args:
+            path (str): File to write (defaults to snapshot_path)
+        
+        Returns:
+            int: Number of items written
+        """
+        path = path or self.snapshot_path
+        service = self.get_service()
+        entries = []
+        for item, score in self.popularity.top(self.top_k):
+            entry = {'item': item, 'score': score}
+            if service is not None and self.cache is not None:
+                try:
+                    key, endpoint = service.item_cache_key(item)
+                except (GenerationException, InvalidInputException):
+                    continue
+                response, remaining = self.cache.entry(key)
+                if response is not None:
+                    entry.update(key=list(key), endpoint=endpoint, expires_at=time.time() + remaining,
+                                 response={'content': response.content, 'model_used': response.model_used,
+                                           'timestamp': response.timestamp, 'candidates': response.candidates})
+            entries.append(entry)
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Write a temporary file of our own and rename it, so a crash never leaves half a snapshot
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': datetime.now().isoformat(), 'entries': entries}, f)
+        os.replace(temporary, path)
+        return len(entries)
+    
+    def load_snapshot(self, path=None, restore_popularity=True):
+        """
+        Load a snapshot written by save_snapshot(): restore popularity and cache unexpired answers
+        
+        Args:
+            path (str): File to read (defaults to snapshot_path)
+            restore_popularity (bool): Add the saved scores to the popularity tracker (only once per process)
+        
+        Returns:
+            int: Number of cached answers loaded (0 if the file does not exist)
+        """
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path):
+            return 0
+        mtime = os.path.getmtime(path)
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f).get('entries', [])
+        self._snapshot_mtime = mtime
+        
+        now = time.time()
+        loaded = 0
+        for entry in entries:
+            if restore_popularity:
+                self.popularity.restore(entry['item'], entry.get('score', 1.0))
+            saved = entry.get('response')
+            if saved is None or self.cache is None or entry['expires_at'] <= now:
+                continue
+            response = TextResponse(saved['content'], saved['model_used'], candidates=saved.get('candidates'))
+            response.timestamp = saved['timestamp']
+            self.cache.set(tuple(entry['key']), response, entry['endpoint'], ttl=entry['expires_at'] - now)
+            loaded += 1
+        self.loaded += loaded
+        return loaded
+    
+    def _follow(self):
+        """Load the answers another worker warmed, when its snapshot changed since the last load"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        if self._snapshot_mtime is not None and os.path.getmtime(self.snapshot_path) <= self._snapshot_mtime:
+            return
+        self.load_snapshot(restore_popularity=False)
+    
+    def _loop(self):
+        """Warm every interval seconds inside the off-peak window until stop()"""
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.is_leader():
+                    self._follow()
+                    continue
+                if not self._may_continue(background=True):
+                    continue
+                self.run_once(background=True)
+                if self.snapshot_path:
+                    self.save_snapshot()
+            except Exception as e:
+                print(f"Warning: cache warming failed: {e}")
+    
+    def start(self):
+        """Start the background thread (call again in each forked worker; threads do not survive fork())"""
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='cache-warmer', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background thread after its current call and let another worker take over"""
+        self._stop.set()
+        lock_file, self._lock_file = self._lock_file, None
+        if lock_file is not None:
+            lock_file.close()
+    
+    def stats(self):
+        """Return tracking and warming counters"""
+        return {
+            'tracked': len(self.popularity),
+            'recorded': self.popularity.recorded,
+            'top_k': self.top_k,
+            'rate': self.rate,
+            'ttl': self.ttl,
+            'off_peak_hours': f"{self.off_peak_hours[0]}-{self.off_peak_hours[1]}" if self.off_peak_hours else None,
+            'off_peak': self.is_off_peak(),
+            'leader': self._leads(),
+            'runs': self.runs,
+            'warmed': self.warmed,
+            'fresh': self.fresh,
+            'failed': self.failed,
+            'interrupted': self.interrupted,
+            'loaded': self.loaded,
+            'last_run': self.last_run
+        }
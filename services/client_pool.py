@@ -0,0 +1,144 @@
+"""Pool of Gemini clients, one per API key, with load-aware selection and quota cooldown"""
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+def is_quota_error(error):
+    """
+    Check whether an upstream error means the key hit its rate limit or quota
+    
+    Args:
+        error (Exception): Error raised by the client
+    
+    Returns:
+        bool: True for 429 / resource-exhausted / quota errors
+    """
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'resource exhausted' in message or 'rate limit' in message
+
+class _PooledClient:
+    """A client in the pool together with its usage counters"""
+    
+    def __init__(self, key_id, client):
+        self.key_id = key_id
+        self.client = client
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.ejected_until = 0.0
+    
+    def stats(self, now):
+        """Return the counters for this key"""
+        return {
+            'key_id': self.key_id,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'quota_errors': self.quota_errors,
+            'available': self.ejected_until <= now,
+            'cooldown_remaining': round(max(0.0, self.ejected_until - now), 1)
+        }
+
+class ClientPool:
+    """Hands out clients from a fixed set, skipping keys that recently hit their quota"""
+    
+    STRATEGIES = ('least_loaded', 'round_robin')
+    
+    def __init__(self, clients, strategy='least_loaded', cooldown=60):
+        """
+        Initialize the pool
+        
+        Args:
+            clients (list): (key_id, client) pairs; the clients are reused for every call
+            strategy (str): 'least_loaded' (fewest in-flight calls) or 'round_robin'
+            cooldown (float): Seconds a key stays out of rotation after a quota error
+        """
+        if not clients:
+            raise ValueError("ClientPool needs at least one client")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown pool strategy '{strategy}'. Choose from: {', '.join(self.STRATEGIES)}")
+        
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._entries = [_PooledClient(key_id, client) for key_id, client in clients]
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+    
+    @classmethod
+    def from_api_keys(cls, api_keys, client_factory, strategy='least_loaded', cooldown=60):
+        """
+        Build one client per API key
+        
+        Args:
+            api_keys (list): Gemini API keys
+            client_factory (callable): Function creating a client from an API key
+            strategy (str): Selection strategy
+            cooldown (float): Quota cooldown in seconds
+        
+        Returns:
+            ClientPool: The pool
+        """
+        clients = [(f"key-{index}", client_factory(api_key)) for index, api_key in enumerate(api_keys, 1)]
+        return cls(clients, strategy=strategy, cooldown=cooldown)
+    
+    @property
+    def primary(self):
+        """The first client in the pool"""
+        return self._entries[0].client
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _select(self):
+        """Pick an available entry according to the strategy (caller holds the lock)"""
+        now = time.monotonic()
+        available = [entry for entry in self._entries if entry.ejected_until <= now]
+        if not available:
+            # Every key is cooling down: use the one that comes back first rather than failing
+            return min(self._entries, key=lambda entry: entry.ejected_until)
+        
+        if self.strategy == 'round_robin':
+            return available[next(self._round_robin) % len(available)]
+        return min(available, key=lambda entry: entry.in_flight)
+    
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a client for one upstream call
+        
+        Quota errors raised inside the block put the key into cooldown.
+        
+        Yields:
+            The selected client
+        """
+        with self._lock:
+            entry = self._select()
+            entry.in_flight += 1
+            entry.requests += 1
+        
+        try:
+            yield entry.client
+        except Exception as e:
+            with self._lock:
+                entry.errors += 1
+                if is_quota_error(e):
+                    entry.quota_errors += 1
+                    entry.ejected_until = time.monotonic() + self.cooldown
+            raise
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+    
+    def stats(self):
+        """Return per-key usage counters"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'strategy': self.strategy,
+                'keys': [entry.stats(now) for entry in self._entries]
+            }
@@ -0,0 +1,284 @@
+"""Adaptive limit on concurrent upstream calls, with a bounded wait queue and load shedding"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+from services.resilience import is_transient_error
+from services.scheduler import FairScheduler
+from exception.generation_exceptions import OverloadedException
+
+class _Waiter:
+    """A call waiting for a free slot; woken through an Event (threads) or a Future (asyncio)"""
+    
+    __slots__ = ('event', 'loop', 'future', 'granted')
+    
+    def __init__(self):
+        self.event = None
+        self.loop = None
+        self.future = None
+        self.granted = False
+    
+    def notify(self):
+        """Wake the waiter; returns False if its event loop is gone"""
+        if self.event is not None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        except RuntimeError:
+            return False
+        return True
+
+def _resolve(future):
+    """Wake an asyncio waiter (runs on its event loop)"""
+    if not future.done():
+        future.set_result(None)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits how many upstream calls run at once, adapting the limit with AIMD
+    
+    Each finished call is compared with the long-run average latency. While
+    calls stay fast and the limit is in use, the limit grows by about one per
+    limit's worth of calls (additive increase). When a call takes more than
+    ``latency_tolerance`` times the average, or fails with a timeout, 5xx or
+    429, the limit is multiplied by ``backoff`` (multiplicative decrease), at
+    most once per recent latency so one slow burst does not collapse it.
+    
+    Calls over the limit wait in a queue of at most ``max_queue`` entries per
+    priority class for up to ``queue_timeout`` seconds; a FairScheduler decides
+    who goes next (FIFO unless requests carry a priority). A call is shed with
+    OverloadedException (HTTP 503 with Retry-After) when the queue is full,
+    when the expected wait is already longer than the timeout, or when the
+    timeout passes.
+    """
+    
+    def __init__(self, initial_limit=20, min_limit=2, max_limit=200, max_queue=50, queue_timeout=2.0,
+                 latency_tolerance=2.0, backoff=0.9, scheduler=None):
+        """
+        Initialize the limiter
+        
+        Args:
+            initial_limit (int): Concurrent calls allowed at start
+            min_limit (int): The limit never drops below this
+            max_limit (int): The limit never grows above this
+            max_queue (int): Calls of one priority class that may wait for a slot
+            queue_timeout (float): Seconds a call may wait before it is shed
+            latency_tolerance (float): A call slower than this multiple of the average latency is a congestion signal
+            backoff (float): Factor applied to the limit on congestion
+            scheduler (FairScheduler): Orders waiting calls by priority class and client (defaults to FIFO)
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self._in_flight = 0
+        self._waiters = scheduler if scheduler is not None else FairScheduler()
+        self._latency = None  # recent latency (fast EWMA)
+        self._baseline = None  # long-run latency (slow EWMA)
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        
+        self.accepted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self.increases = 0
+        self.decreases = 0
+    
+    def _slots(self):
+        """Whole number of calls currently allowed (caller holds the lock)"""
+        return int(self.limit)
+    
+    def _expected_wait(self, position):
+        """Estimate the seconds until the call at a queue position gets a slot (caller holds the lock)"""
+        return position * (self._latency or 0.0) / self._slots()
+    
+    def _try_take(self):
+        """Take a slot if one is free and nobody is waiting (caller holds the lock)"""
+        if self._waiters or self._in_flight >= self._slots():
+            return False
+        self._in_flight += 1
+        self.accepted += 1
+        return True
+    
+    def _enqueue(self, waiter):
+        """
+        Add a waiter to the queue, or shed the call (caller holds the lock)
+        
+        Returns:
+            float: Seconds the waiter may wait for a slot
+        """
+        timeout = self._waiters.timeout(self.queue_timeout)
+        expected = self._expected_wait(self._waiters.ahead() + 1)
+        if self._waiters.depth() >= self.max_queue or expected > timeout:
+            self.shed_queue_full += 1
+            raise OverloadedException(retry_after=expected)
+        self._waiters.append(waiter)
+        self.queued += 1
+        return timeout
+    
+    def _give_up(self, waiter):
+        """Handle a waiter whose deadline passed: return normally if it got a slot after all, else shed"""
+        with self._lock:
+            if waiter.granted:
+                return
+            self._waiters.remove(waiter)
+            self.shed_deadline += 1
+            raise OverloadedException(retry_after=self._expected_wait(self._waiters.ahead() + 1))
+    
+    def _grant_waiters(self):
+        """Hand free slots to waiters in arrival order (caller holds the lock)"""
+        while self._waiters and self._in_flight < self._slots():
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            if waiter.notify():
+                self.accepted += 1
+            else:
+                self._in_flight -= 1
+    
+    def acquire(self):
+        """
+        Wait for a slot
+        
+        Raises:
+            OverloadedException: If the call is shed instead
+        """
+        with self._lock:
+            if self._try_take():
+                return
+            waiter = _Waiter()
+            waiter.event = threading.Event()
+            timeout = self._enqueue(waiter)
+        
+        waiter.event.wait(timeout)
+        self._give_up(waiter)
+    
+    async def aacquire(self):
+        """
+        Async version of acquire(); waiting does not block the event loop
+        
+        Raises:
+            OverloadedException: If the call is shed instead
+        """
+        with self._lock:
+            if self._try_take():
+                return
+            waiter = _Waiter()
+            waiter.loop = asyncio.get_running_loop()
+            waiter.future = waiter.loop.create_future()
+            timeout = self._enqueue(waiter)
+        
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._in_flight -= 1
+                    self._grant_waiters()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+        self._give_up(waiter)
+    
+    def release(self, latency=None, overloaded=False):
+        """
+        Give a slot back and adapt the limit
+        
+        Args:
+            latency (float): Seconds the call took, or None to skip the latency check (e.g. streams)
+            overloaded (bool): Whether the call failed in a way that suggests upstream congestion
+        """
+        with self._lock:
+            self._in_flight -= 1
+            self._adjust(latency, overloaded)
+            self._grant_waiters()
+    
+    def _adjust(self, latency, overloaded):
+        """Apply additive increase or multiplicative decrease (caller holds the lock)"""
+        slow = False
+        if latency is not None:
+            if self._baseline is None:
+                self._latency = self._baseline = latency
+            else:
+                slow = latency > self._baseline * self.latency_tolerance
+                self._latency = 0.8 * self._latency + 0.2 * latency
+                self._baseline = 0.95 * self._baseline + 0.05 * latency
+        
+        if overloaded or slow:
+            now = time.monotonic()
+            if now - self._last_decrease >= (self._latency or 0.0):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                self.decreases += 1
+        elif latency is not None and self._in_flight + 1 >= self.limit / 2:
+            # Only grow while the limit is actually in use
+            previous = self._slots()
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if self._slots() > previous:
+                self.increases += 1
+    
+    @contextmanager
+    def slot(self, sample=True):
+        """
+        Hold a slot for the duration of a with block
+        
+        Args:
+            sample (bool): Feed the block's duration to the limit (turn off for streams,
+                whose duration depends on the reader)
+        """
+        self.acquire()
+        start = time.monotonic()
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            overloaded = is_transient_error(e)
+            raise
+        finally:
+            latency = time.monotonic() - start if sample and not overloaded else None
+            self.release(latency, overloaded)
+    
+    @asynccontextmanager
+    async def aslot(self):
+        """Async version of slot()"""
+        await self.aacquire()
+        start = time.monotonic()
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            overloaded = is_transient_error(e)
+            raise
+        finally:
+            self.release(None if overloaded else time.monotonic() - start, overloaded)
+    
+    def stats(self):
+        """Return the current limit, queue depth and shed counters"""
+        with self._lock:
+            return {
+                'limit': self._slots(),
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._waiters),
+                'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'accepted': self.accepted,
+                'queued': self.queued,
+                'shed': self.shed_queue_full + self.shed_deadline,
+                'shed_queue_full': self.shed_queue_full,
+                'shed_deadline': self.shed_deadline,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'latency': round(self._latency, 4) if self._latency is not None else None,
+                'baseline_latency': round(self._baseline, 4) if self._baseline is not None else None
+            }
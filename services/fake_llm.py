@@ -0,0 +1,117 @@
+"""Deterministic stand-in for ChatGoogleGenerativeAI, for offline load tests and benchmarks"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+
+class FakeMessage:
+    """Minimal LangChain-style message with content and token usage"""
+    
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+class FakeUpstreamError(Exception):
+    """Injected upstream failure (message looks like a 503 so it counts as transient)"""
+
+class FakeChatModel:
+    """
+    Chat model with configurable latency, token rate, error rate and streaming
+    
+    Supports the invoke(), ainvoke() and stream() calls GeminiService makes, so
+    it can be plugged in with ``GeminiService(..., client_factory=...)``.
+    """
+    
+    DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+    
+    def __init__(self, latency_ms=50.0, latency_distribution='lognormal', latency_spread=0.5,
+                 tokens_per_second=0.0, error_rate=0.0, reply_tokens=40, seed=0):
+        """
+        Initialize the fake model
+        
+        Args:
+            latency_ms (float): Median time to first token in milliseconds
+            latency_distribution (str): 'fixed', 'uniform' (0.5x to 1.5x) or 'lognormal'
+            latency_spread (float): Sigma of the lognormal distribution
+            tokens_per_second (float): Generation speed after the first token; 0 means instant
+            error_rate (float): Fraction of calls that fail with FakeUpstreamError
+            reply_tokens (int): Number of words in every reply
+            seed (int): Random seed, so the same run produces the same latencies and errors
+        """
+        if latency_distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{latency_distribution}'. "
+                             f"Choose from: {', '.join(self.DISTRIBUTIONS)}")
+        
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_spread = latency_spread
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.reply_tokens = reply_tokens
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config, seed=0):
+        """Build a fake model from the FAKE_LLM_* settings in Config"""
+        return cls(
+            latency_ms=config.FAKE_LLM_LATENCY_MS,
+            latency_distribution=config.FAKE_LLM_LATENCY_DISTRIBUTION,
+            tokens_per_second=config.FAKE_LLM_TOKENS_PER_SECOND,
+            error_rate=config.FAKE_LLM_ERROR_RATE,
+            seed=seed
+        )
+    
+    def _plan(self, generation_config=None):
+        """Draw the latency and outcome of one call (replies are cut to max_output_tokens, if given)"""
+        with self._lock:
+            self.calls += 1
+            draw = self._random.random()
+            if self.latency_distribution == 'fixed':
+                factor = 1.0
+            elif self.latency_distribution == 'uniform':
+                factor = 0.5 + self._random.random()
+            else:
+                factor = math.exp(self._random.gauss(0, self.latency_spread))
+        
+        reply_tokens = self.reply_tokens
+        if generation_config and generation_config.get('max_output_tokens'):
+            reply_tokens = min(reply_tokens, generation_config['max_output_tokens'])
+        words = [f"word{index}" for index in range(reply_tokens)]
+        return self.latency_ms * factor / 1000, draw < self.error_rate, words
+    
+    def _token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+    
+    def _usage(self, prompt, words):
+        return {'input_tokens': len(prompt.split()), 'output_tokens': len(words)}
+    
+    def invoke(self, prompt, generation_config=None, **kwargs):
+        """Return a reply after the simulated latency"""
+        first_token, fail, words = self._plan(generation_config)
+        time.sleep(first_token + self._token_delay() * len(words))
+        if fail:
+            raise FakeUpstreamError("503 Service Unavailable (injected by FakeChatModel)")
+        return FakeMessage(' '.join(words), self._usage(prompt, words))
+    
+    async def ainvoke(self, prompt, generation_config=None, **kwargs):
+        """Async version of invoke()"""
+        first_token, fail, words = self._plan(generation_config)
+        await asyncio.sleep(first_token + self._token_delay() * len(words))
+        if fail:
+            raise FakeUpstreamError("503 Service Unavailable (injected by FakeChatModel)")
+        return FakeMessage(' '.join(words), self._usage(prompt, words))
+    
+    def stream(self, prompt, generation_config=None, **kwargs):
+        """Yield the reply word by word at the configured token rate"""
+        first_token, fail, words = self._plan(generation_config)
+        time.sleep(first_token)
+        if fail:
+            raise FakeUpstreamError("503 Service Unavailable (injected by FakeChatModel)")
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(self._token_delay())
+            yield FakeMessage(word if index == 0 else ' ' + word)
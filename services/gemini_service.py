@@ -1,114 +1,927 @@
 """Service class for integrating with Google's Gemini AI using LangChain"""
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from model.text_generation import TextResponse
+import asyncio
+import contextvars
+import copy
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from model.text_generation import TextRequest, TextResponse, TextStream
+from services.client_pool import ClientPool
+from services.response_cache import ResponseCache
+from services.template_registry import get_template_registry
+from services.resilience import is_transient_error
+from services.token_budget import estimate_tokens
+from util.metrics import stage_timer, record_generation, MODEL_CALLS
 from exception.generation_exceptions import GenerationException, InvalidInputException
 
 class GeminiService:
     """Service class for interacting with Gemini AI through LangChain"""
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None, single_flight=None, templates=None,
+                 pool_strategy='least_loaded', key_cooldown=60, resilience=None, client_factory=None,
+                 semantic_cache=None, model_tiers=None, default_tier='standard', auto_tiers=None,
+                 max_output_tokens=200, temperature=0.7, max_length_limit=2048, input_budget=None,
+                 limiter=None, max_candidates=8, popularity=None):
         """
-        Initialize the Gemini service with API key
+        Initialize the Gemini service with one or more API keys
+        
+        One client per key is built for every model tier up front, so picking a
+        tier per request costs nothing.
         
         Args:
-            api_key (str): Google Gemini API key
+            api_key (str or list): Google Gemini API key, or a list of keys to pool
+            cache (ResponseCache): Optional cache placed in front of the model
+            single_flight (SingleFlight): Optional coalescer for identical in-flight prompts
+            templates (TemplateRegistry): Prompt templates (defaults to the shared registry)
+            pool_strategy (str): How to pick a key: 'least_loaded' or 'round_robin'
+            key_cooldown (float): Seconds a key is skipped after a 429/quota error
+            resilience (ResilientCaller): Optional retry / circuit breaker / hedging wrapper
+            client_factory (callable): Builds a chat model from an API key and model name instead of
+                ChatGoogleGenerativeAI (e.g. FakeChatModel for load tests)
+            semantic_cache (SemanticCache): Optional near-duplicate cache checked after an exact cache miss
+            model_tiers (dict): Tier name -> Gemini model name (defaults to a single 'standard' tier)
+            default_tier (str): Tier used when a request does not choose one
+            auto_tiers (dict): Content type -> tier, for requests that do not choose one (e.g. {'joke': 'fast'})
+            max_output_tokens (int): Default output token limit
+            temperature (float): Default temperature
+            max_length_limit (int): Largest max_length a request may ask for
+            input_budget (InputBudget): Optional per-endpoint limit on the tokens of user input
+            limiter (AdaptiveConcurrencyLimiter): Optional limit on concurrent upstream calls
+            max_candidates (int): Largest number of candidates (n) a request may ask for
+            popularity (PopularityTracker): Optional record of styled and creative requests, for cache warming
         """
+        self.model_tiers = dict(model_tiers or {'standard': "gemini-2.0-flash"})
+        self.default_tier = default_tier
+        self.auto_tiers = dict(auto_tiers or {})
+        self.temperature = temperature
+        self.max_output_tokens = max_output_tokens
+        self.max_length_limit = max_length_limit
+        self.max_candidates = max_candidates
+        self.input_budget = input_budget
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.single_flight = single_flight
+        self.templates = templates or get_template_registry()
+        self.resilience = resilience
+        self.limiter = limiter
+        self.popularity = popularity
+        self._native_candidates = {}  # tier -> False once its model rejected candidate_count
+        
+        for tier in [self.default_tier] + list(self.auto_tiers.values()):
+            if tier not in self.model_tiers:
+                raise GenerationException(f"Unknown model tier '{tier}'. Configured tiers: "
+                                          f"{', '.join(self.model_tiers)}")
+        
         try:
-            # Initialize Gemini with LangChain
-            self.llm = ChatGoogleGenerativeAI(
-                model="gemini-2.0-flash",
-                google_api_key=api_key,
-                temperature=0.7,
-                max_output_tokens=200
-            )
+            if client_factory is None:
+                # Imported here because langchain_google_genai takes about a second to import;
+                # keeping it out of module import lets workers answer health checks right away
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                
+                client_factory = lambda key, model_name: ChatGoogleGenerativeAI(
+                    model=model_name,
+                    google_api_key=key,
+                    temperature=self.temperature,
+                    max_output_tokens=self.max_output_tokens
+                )
+            
+            # Initialize one Gemini client per key and tier with LangChain; clients
+            # are reused for every call so their connections stay open
+            api_keys = [api_key] if isinstance(api_key, str) else list(api_key)
+            self.pools = {
+                tier: ClientPool.from_api_keys(
+                    api_keys,
+                    lambda key, model_name=model_name: client_factory(key, model_name),
+                    strategy=pool_strategy,
+                    cooldown=key_cooldown
+                )
+                for tier, model_name in self.model_tiers.items()
+            }
         except Exception as e:
             raise GenerationException(f"Failed to initialize Gemini: {str(e)}")
     
-    def generate_simple_text(self, prompt):
+    @property
+    def model_name(self):
+        """Model of the default tier"""
+        return self.model_tiers[self.default_tier]
+    
+    @property
+    def pool(self):
+        """Client pool of the default tier"""
+        return self.pools[self.default_tier]
+    
+    @property
+    def llm(self):
+        """The first client in the default tier's pool"""
+        return self.pool.primary
+    
+    @llm.setter
+    def llm(self, client):
+        """Replace every tier's pool with a single client (e.g. a test double)"""
+        self.pools = {
+            tier: ClientPool([('custom', client)], strategy=pool.strategy, cooldown=pool.cooldown)
+            for tier, pool in self.pools.items()
+        }
+    
+    def pool_stats(self):
+        """Return per-key usage counters for every tier"""
+        keys = []
+        for tier, pool in self.pools.items():
+            for key in pool.stats()['keys']:
+                keys.append(dict(key, tier=tier, model=self.model_tiers[tier]))
+        return {'strategy': self.pool.strategy, 'keys': keys}
+    
+    def resolve_settings(self, max_length=None, temperature=None, model_tier=None, content_type=None, n=None):
         """
-        Generate text from a simple prompt
+        Validate per-request generation parameters and pick the model tier
         
         Args:
-            prompt (str): User's text prompt
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature (None for the default)
+            model_tier (str): Tier name, or None / 'auto' to route by content type
+            content_type (str): Creative content type used for automatic routing
+            n (int): Number of candidates (None for 1)
+        
+        Returns:
+            tuple: (tier, model name, temperature, max output tokens, candidates)
+        """
+        request = TextRequest(
+            None,
+            self.max_output_tokens if max_length is None else max_length,
+            self.temperature if temperature is None else temperature,
+            model_tier,
+            1 if n is None else n
+        ).validate(self.max_length_limit, list(self.model_tiers) + ['auto'], self.max_candidates)
+        
+        tier = request.model_tier
+        if tier in (None, 'auto'):
+            tier = self.auto_tiers.get(content_type, self.default_tier)
+        return (tier, self.model_tiers[tier], float(request.temperature), request.max_length, request.n)
+    
+    def _call_options(self, settings):
+        """Per-call generation_config, sent only when the request changes the client defaults"""
+        temperature, max_output_tokens = settings[2], settings[3]
+        if temperature == self.temperature and max_output_tokens == self.max_output_tokens:
+            return {}
+        return {'generation_config': {'temperature': temperature, 'max_output_tokens': max_output_tokens}}
+    
+    def _cache_key(self, prompt, settings):
+        """Build the cache/coalescing key for a formatted prompt with its generation settings"""
+        return ResponseCache.make_key(prompt, *settings[1:])
+    
+    def _semantic_cache_for(self, endpoint, use_cache, settings):
+        """Return the semantic cache if it applies to this call, else None (it holds single answers only)"""
+        if not use_cache or self.semantic_cache is None or not self.semantic_cache.applies_to(endpoint) \
+                or settings[4] > 1:
+            return None
+        return self.semantic_cache
+    
+    def _upstream_slot(self, sample=True):
+        """Return a context manager holding a concurrency limiter slot (a no-op without a limiter)"""
+        return self.limiter.slot(sample) if self.limiter is not None else nullcontext()
+    
+    def _aupstream_slot(self):
+        """Async version of _upstream_slot()"""
+        return self.limiter.aslot() if self.limiter is not None else nullcontext()
+    
+    def _supports_candidates(self, tier, method):
+        """Whether the tier's clients can return several candidates from one call of a method"""
+        return self._native_candidates.get(tier, True) and callable(getattr(self.pools[tier].primary, method, None))
+    
+    def _candidate_config(self, settings):
+        """generation_config asking for settings[4] candidates (merged into the client defaults)"""
+        options = self._call_options(settings)
+        return dict(options.get('generation_config', {}), candidate_count=settings[4])
+    
+    def _native_failed(self, tier, error):
+        """Stop asking a tier for native candidates if it rejected candidate_count; re-raise other errors"""
+        if isinstance(error, GenerationException) or is_transient_error(error):
+            raise error
+        print(f"Warning: model tier '{tier}' rejected candidate_count ({error}); "
+              f"falling back to concurrent calls")
+        self._native_candidates[tier] = False
+    
+    def _candidate_messages(self, result, prompt, endpoint):
+        """Extract the non-empty candidates of an LLMResult and record the call's metrics"""
+        messages = [generation.message for generation in result.generations[0]]
+        contents = [message.content for message in messages if message.content]
+        usage = getattr(messages[0], 'usage_metadata', None) if messages else None
+        record_generation(endpoint, prompt, ''.join(contents), usage)
+        return contents
+    
+    def _call_candidates(self, prompt, endpoint, settings):
+        """
+        Generate settings[4] candidates for one prompt
+        
+        Clients with a native multi-candidate call (ChatGoogleGenerativeAI.generate()
+        with candidate_count) produce them all in one upstream call. Candidates
+        the model did not return (e.g. blocked by safety filters), and every
+        candidate on backends without native support, come from concurrent
+        single calls.
+        
+        Returns:
+            TextResponse: The first candidate as content, with every candidate in candidates
+        """
+        tier, model_name, n = settings[0], settings[1], settings[4]
+        contents = []
+        if self._supports_candidates(tier, 'generate'):
+            # Imported here for the same reason as ChatGoogleGenerativeAI in __init__
+            from langchain_core.messages import HumanMessage
+            
+            config = self._candidate_config(settings)
+            
+            def attempt():
+                with self._upstream_slot(), self.pools[tier].acquire() as client:
+                    return client.generate([[HumanMessage(content=prompt)]], generation_config=config)
+            
+            MODEL_CALLS.inc(tier=tier, model=model_name)
+            try:
+                with stage_timer('upstream'):
+                    result = self.resilience.call(attempt) if self.resilience else attempt()
+                contents = self._candidate_messages(result, prompt, endpoint)[:n]
+            except Exception as e:
+                self._native_failed(tier, e)
+        
+        missing = n - len(contents)
+        if missing > 0:
+            single = settings[:4] + (1,)
+            with ThreadPoolExecutor(max_workers=missing) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, self._call_model, prompt, endpoint, single)
+                           for _ in range(missing)]
+                contents += [future.result().content for future in futures]
+        return TextResponse(contents[0], model_name, candidates=contents)
+    
+    async def _acall_candidates(self, prompt, endpoint, settings):
+        """Async version of _call_candidates() built on agenerate() and concurrent ainvoke() calls"""
+        tier, model_name, n = settings[0], settings[1], settings[4]
+        contents = []
+        if self._supports_candidates(tier, 'agenerate'):
+            from langchain_core.messages import HumanMessage
             
+            config = self._candidate_config(settings)
+            
+            async def attempt():
+                async with self._aupstream_slot():
+                    with self.pools[tier].acquire() as client:
+                        return await client.agenerate([[HumanMessage(content=prompt)]], generation_config=config)
+            
+            MODEL_CALLS.inc(tier=tier, model=model_name)
+            try:
+                with stage_timer('upstream'):
+                    result = await (self.resilience.acall(attempt) if self.resilience else attempt())
+                contents = self._candidate_messages(result, prompt, endpoint)[:n]
+            except Exception as e:
+                self._native_failed(tier, e)
+        
+        missing = n - len(contents)
+        if missing > 0:
+            single = settings[:4] + (1,)
+            responses = await asyncio.gather(*(self._acall_model(prompt, endpoint, single) for _ in range(missing)))
+            contents += [response.content for response in responses]
+        return TextResponse(contents[0], model_name, candidates=contents)
+    
+    def _call_model(self, prompt, endpoint, settings):
+        """Call the model (through the resilience wrapper, if any) and wrap its answer in a TextResponse"""
+        if settings[4] > 1:
+            return self._call_candidates(prompt, endpoint, settings)
+        
+        tier, model_name = settings[0], settings[1]
+        options = self._call_options(settings)
+        
+        def attempt():
+            # Each attempt (retries and hedges included) takes its own limiter slot
+            with self._upstream_slot(), self.pools[tier].acquire() as client:
+                return client.invoke(prompt, **options)
+        
+        MODEL_CALLS.inc(tier=tier, model=model_name)
+        with stage_timer('upstream'):
+            response = self.resilience.call(attempt) if self.resilience else attempt()
+        record_generation(endpoint, prompt, response.content, getattr(response, 'usage_metadata', None))
+        return TextResponse(response.content, model_name)
+    
+    async def _acall_model(self, prompt, endpoint, settings):
+        """Async version of _call_model()"""
+        if settings[4] > 1:
+            return await self._acall_candidates(prompt, endpoint, settings)
+        
+        tier, model_name = settings[0], settings[1]
+        options = self._call_options(settings)
+        
+        async def attempt():
+            async with self._aupstream_slot():
+                with self.pools[tier].acquire() as client:
+                    return await client.ainvoke(prompt, **options)
+        
+        MODEL_CALLS.inc(tier=tier, model=model_name)
+        with stage_timer('upstream'):
+            response = await (self.resilience.acall(attempt) if self.resilience else attempt())
+        record_generation(endpoint, prompt, response.content, getattr(response, 'usage_metadata', None))
+        return TextResponse(response.content, model_name)
+    
+    def _invoke(self, prompt, endpoint, settings, use_cache=True, similar=False):
+        """
+        Send a formatted prompt to the model, serving repeats from the cache
+        (and near-duplicates from the semantic cache, when configured and asked for)
+        
+        Args:
+            prompt (str): Fully formatted prompt
+            endpoint (str): Endpoint name used for the cache TTL (simple, styled, creative)
+            settings (tuple): Settings from resolve_settings()
+            use_cache (bool): Set to False to bypass the cache and request coalescing
+            similar (bool): Accept the semantic cache's answer for a near-duplicate prompt
+        
         Returns:
-            TextResponse: Generated text response
+            TextResponse: Generated or cached text response
         """
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            key = self._cache_key(prompt, settings)
+            with stage_timer('cache_lookup'):
+                cached = cache.get(key)
+            if cached is not None:
+                return cached
+        
+        semantic = self._semantic_cache_for(endpoint, use_cache, settings)
+        # Every answer is stored, but only requests that opted in accept a near-duplicate's answer
+        if semantic is not None and similar:
+            with stage_timer('cache_lookup'):
+                near_duplicate = semantic.get(prompt, settings[1:4])
+            if near_duplicate is not None:
+                return near_duplicate
+        
+        if use_cache and self.single_flight is not None:
+            result = self.single_flight.do(self._cache_key(prompt, settings),
+                                           lambda: self._call_model(prompt, endpoint, settings))
+        else:
+            result = self._call_model(prompt, endpoint, settings)
+        
+        if cache is not None:
+            cache.set(key, result, endpoint)
+        if semantic is not None:
+            semantic.set(prompt, settings[1:4], result)
+        return result
+    
+    async def _ainvoke(self, prompt, endpoint, settings, use_cache=True, similar=False):
+        """
+        Async version of _invoke() built on the model's ainvoke()
+        
+        Args:
+            prompt (str): Fully formatted prompt
+            endpoint (str): Endpoint name used for the cache TTL (simple, styled, creative)
+            settings (tuple): Settings from resolve_settings()
+            use_cache (bool): Set to False to bypass the cache and request coalescing
+            similar (bool): Accept the semantic cache's answer for a near-duplicate prompt
+        
+        Returns:
+            TextResponse: Generated or cached text response
+        """
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            key = self._cache_key(prompt, settings)
+            with stage_timer('cache_lookup'):
+                cached = cache.get(key)
+            if cached is not None:
+                return cached
+        
+        semantic = self._semantic_cache_for(endpoint, use_cache, settings)
+        # Every answer is stored, but only requests that opted in accept a near-duplicate's answer
+        if semantic is not None and similar:
+            with stage_timer('cache_lookup'):
+                near_duplicate = semantic.get(prompt, settings[1:4])
+            if near_duplicate is not None:
+                return near_duplicate
+        
+        if use_cache and self.single_flight is not None:
+            result = await self.single_flight.do_async(self._cache_key(prompt, settings),
+                                                       lambda: self._acall_model(prompt, endpoint, settings))
+        else:
+            result = await self._acall_model(prompt, endpoint, settings)
+        
+        if cache is not None:
+            cache.set(key, result, endpoint)
+        if semantic is not None:
+            semantic.set(prompt, settings[1:4], result)
+        return result
+    
+    def _stream(self, prompt, endpoint, settings, use_cache=True, error_message="Error generating text",
+                truncated=False):
+        """
+        Stream a formatted prompt from the model chunk by chunk
+        
+        Args:
+            prompt (str): Fully formatted prompt
+            endpoint (str): Endpoint name used for the cache TTL
+            settings (tuple): Settings from resolve_settings()
+            use_cache (bool): Set to False to bypass the cache for this call
+            error_message (str): Prefix for GenerationException messages
+            truncated (bool): Whether the user input was cut to fit its token budget
+        
+        Returns:
+            TextStream: Iterable of text chunks; the full response is cached once complete
+        
+        Raises:
+            InvalidInputException: If more than one candidate was requested
+        """
+        if settings[4] > 1:
+            raise InvalidInputException("Streaming returns a single candidate; use n=1 or set stream to false")
+        
+        input_tokens = estimate_tokens(prompt)
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            key = self._cache_key(prompt, settings)
+            with stage_timer('cache_lookup'):
+                cached = cache.get(key)
+            if cached is not None:
+                return TextStream([cached.content], cached.model_used, input_tokens=input_tokens, truncated=truncated)
+        
+        tier, model_name = settings[0], settings[1]
+        options = self._call_options(settings)
+        
+        def chunks():
+            # Streams are not retried or hedged, but still respect the circuit breaker and
+            # hold a limiter slot until the last chunk (their duration is not a latency sample)
+            breaker = self.resilience.breaker if self.resilience else None
+            if breaker is not None:
+                breaker.before_call()
+            MODEL_CALLS.inc(tier=tier, model=model_name)
+            verdict_recorded = False
+            try:
+                try:
+                    with self._upstream_slot(sample=False), self.pools[tier].acquire() as client:
+                        for chunk in client.stream(prompt, **options):
+                            if chunk.content:
+                                yield chunk.content
+                except Exception as e:
+                    if breaker is not None and is_transient_error(e):
+                        breaker.record_failure()
+                        verdict_recorded = True
+                    if isinstance(e, GenerationException):
+                        raise
+                    raise GenerationException(f"{error_message}: {str(e)}")
+                if breaker is not None:
+                    breaker.record_success()
+                    verdict_recorded = True
+            finally:
+                # A client that disconnects closes the generator (GeneratorExit is not an
+                # Exception); without a verdict a half-open trial would block the breaker for good
+                if breaker is not None and not verdict_recorded:
+                    breaker.release()
+        
+        def on_complete(response):
+            record_generation(endpoint, prompt, response.content)
+            if cache is not None:
+                cache.set(key, response, endpoint)
+        
+        return TextStream(chunks(), model_name, on_complete, input_tokens=input_tokens, truncated=truncated)
+    
+    def _record_popular(self, use_cache, item):
+        """Count a styled or creative request towards cache warming (requests that skip the cache do not count)"""
+        if use_cache and self.popularity is not None:
+            self.popularity.record(item)
+    
+    def _fit_input(self, endpoint, text, field):
+        """Apply the input token budget to user text; returns (text, truncated)"""
+        if self.input_budget is None:
+            return text, False
+        return self.input_budget.apply(endpoint, text, field)
+    
+    @staticmethod
+    def _annotate(response, prompt, truncated):
+        """
+        Return a copy of a response carrying this request's input metadata
+        
+        Cached responses are shared between requests, so they are never modified in place.
+        """
+        response = copy.copy(response)
+        response.input_tokens = estimate_tokens(prompt)
+        response.truncated = truncated
+        return response
+    
+    def _build_simple_prompt(self, prompt):
+        """Validate a simple prompt and fit it to the input budget; returns (prompt, truncated)"""
         if not prompt or len(prompt.strip()) == 0:
             raise InvalidInputException("Prompt cannot be empty")
+        return self._fit_input('simple', prompt, 'prompt')
+    
+    def _build_styled_prompt(self, topic, style):
+        """Validate topic and style and format the styled prompt; returns (prompt, truncated)"""
+        if not topic or len(topic.strip()) == 0:
+            raise InvalidInputException("Topic cannot be empty")
+        topic, truncated = self._fit_input('styled', topic, 'topic')
+        
+        with stage_timer('prompt_format'):
+            return self.templates.format_styled(topic, style), truncated
+    
+    def _build_creative_prompt(self, content_type, subject):
+        """Validate content type and subject and format the creative prompt; returns (prompt, truncated)"""
+        if not subject or len(subject.strip()) == 0:
+            raise InvalidInputException("Subject cannot be empty")
+        subject, truncated = self._fit_input('creative', subject, 'subject')
+        
+        with stage_timer('prompt_format'):
+            return self.templates.format_creative(content_type, subject), truncated
+    
+    def generate_simple_text(self, prompt, use_cache=True,
+                             max_length=None, temperature=None, model_tier=None, n=None, similar=False):
+        """
+        Generate text from a simple prompt
+        
+        Args:
+            prompt (str): User's text prompt
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+            similar (bool): Also accept the cached answer of a near-duplicate prompt (semantic cache)
+        
+        Returns:
+            TextResponse: Generated text response
+        """
+        prompt, truncated = self._build_simple_prompt(prompt)
+        settings = self.resolve_settings(max_length, temperature, model_tier, n=n)
         
         try:
             # Call Gemini using LangChain
-            response = self.llm.invoke(prompt)
-            return TextResponse(response.content)
+            response = self._invoke(prompt, 'simple', settings, use_cache, similar)
+            return self._annotate(response, prompt, truncated)
+        except GenerationException:
+            raise
         except Exception as e:
             raise GenerationException(f"Error generating text: {str(e)}")
     
-    def generate_with_template(self, topic, style):
+    def generate_with_template(self, topic, style, use_cache=True,
+                               max_length=None, temperature=None, model_tier=None, n=None, similar=False):
         """
         Generate text using a template with topic and style
         
         Args:
             topic (str): The topic to write about
             style (str): Writing style (formal, casual, funny)
-            
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+            similar (bool): Also accept the cached answer of a near-duplicate prompt (semantic cache)
+        
         Returns:
             TextResponse: Generated text response
         """
-        if not topic or len(topic.strip()) == 0:
-            raise InvalidInputException("Topic cannot be empty")
+        formatted_prompt, truncated = self._build_styled_prompt(topic, style)
+        settings = self.resolve_settings(max_length, temperature, model_tier, n=n)
+        self._record_popular(use_cache, {'type': 'styled', 'topic': topic, 'style': style, 'max_length': max_length,
+                                         'temperature': temperature, 'model_tier': model_tier, 'n': n})
         
-        if style not in ['formal', 'casual', 'funny']:
-            raise InvalidInputException("Style must be 'formal', 'casual', or 'funny'")
+        try:
+            response = self._invoke(formatted_prompt, 'styled', settings, use_cache, similar)
+            return self._annotate(response, formatted_prompt, truncated)
+        except GenerationException:
+            raise
+        except Exception as e:
+            raise GenerationException(f"Error generating styled text: {str(e)}")
+    
+    def generate_creative_content(self, content_type, subject, use_cache=True,
+                                  max_length=None, temperature=None, model_tier=None, n=None, similar=False):
+        """
+        Generate different types of creative content
+        
+        Args:
+            content_type (str): Type of content (poem, story, joke, fact)
+            subject (str): Subject matter for the content
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+            similar (bool): Also accept the cached answer of a near-duplicate prompt (semantic cache)
+        
+        Returns:
+            TextResponse: Generated creative content
+        """
+        prompt, truncated = self._build_creative_prompt(content_type, subject)
+        settings = self.resolve_settings(max_length, temperature, model_tier, content_type, n)
+        self._record_popular(use_cache, {'type': 'creative', 'content_type': content_type, 'subject': subject,
+                                         'max_length': max_length, 'temperature': temperature,
+                                         'model_tier': model_tier, 'n': n})
+        
+        try:
+            response = self._invoke(prompt, 'creative', settings, use_cache, similar)
+            return self._annotate(response, prompt, truncated)
+        except GenerationException:
+            raise
+        except Exception as e:
+            raise GenerationException(f"Error generating creative content: {str(e)}")
+    
+    def stream_simple_text(self, prompt, use_cache=True,
+                           max_length=None, temperature=None, model_tier=None, n=None):
+        """
+        Stream text from a simple prompt
+        
+        Args:
+            prompt (str): User's text prompt
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+        
+        Returns:
+            TextStream: Iterable of generated text chunks
+        """
+        prompt, truncated = self._build_simple_prompt(prompt)
+        settings = self.resolve_settings(max_length, temperature, model_tier, n=n)
+        return self._stream(prompt, 'simple', settings, use_cache, "Error generating text", truncated)
+    
+    def stream_with_template(self, topic, style, use_cache=True,
+                             max_length=None, temperature=None, model_tier=None, n=None):
+        """
+        Stream styled text for a topic
+        
+        Args:
+            topic (str): The topic to write about
+            style (str): Writing style (formal, casual, funny)
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+        
+        Returns:
+            TextStream: Iterable of generated text chunks
+        """
+        formatted_prompt, truncated = self._build_styled_prompt(topic, style)
+        settings = self.resolve_settings(max_length, temperature, model_tier, n=n)
+        self._record_popular(use_cache, {'type': 'styled', 'topic': topic, 'style': style, 'max_length': max_length,
+                                         'temperature': temperature, 'model_tier': model_tier, 'n': n})
+        return self._stream(formatted_prompt, 'styled', settings, use_cache, "Error generating styled text",
+                            truncated)
+    
+    def stream_creative_content(self, content_type, subject, use_cache=True,
+                                max_length=None, temperature=None, model_tier=None, n=None):
+        """
+        Stream creative content
+        
+        Args:
+            content_type (str): Type of content (poem, story, joke, fact)
+            subject (str): Subject matter for the content
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+        
+        Returns:
+            TextStream: Iterable of generated text chunks
+        """
+        prompt, truncated = self._build_creative_prompt(content_type, subject)
+        settings = self.resolve_settings(max_length, temperature, model_tier, content_type, n)
+        self._record_popular(use_cache, {'type': 'creative', 'content_type': content_type, 'subject': subject,
+                                         'max_length': max_length, 'temperature': temperature,
+                                         'model_tier': model_tier, 'n': n})
+        return self._stream(prompt, 'creative', settings, use_cache, "Error generating creative content", truncated)
+    
+    async def agenerate_simple_text(self, prompt, use_cache=True,
+                                    max_length=None, temperature=None, model_tier=None, n=None, similar=False):
+        """
+        Async version of generate_simple_text()
+        
+        Args:
+            prompt (str): User's text prompt
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+            similar (bool): Also accept the cached answer of a near-duplicate prompt (semantic cache)
         
-        # Create a prompt template
-        template = """Write a {style} paragraph about {topic}. 
-        Make it engaging and appropriate for the style requested."""
+        Returns:
+            TextResponse: Generated text response
+        """
+        prompt, truncated = self._build_simple_prompt(prompt)
+        settings = self.resolve_settings(max_length, temperature, model_tier, n=n)
+        
+        try:
+            response = await self._ainvoke(prompt, 'simple', settings, use_cache, similar)
+            return self._annotate(response, prompt, truncated)
+        except GenerationException:
+            raise
+        except Exception as e:
+            raise GenerationException(f"Error generating text: {str(e)}")
+    
+    async def agenerate_with_template(self, topic, style, use_cache=True,
+                                      max_length=None, temperature=None, model_tier=None, n=None, similar=False):
+        """
+        Async version of generate_with_template()
         
-        prompt = PromptTemplate(
-            input_variables=["style", "topic"],
-            template=template
-        )
+        Args:
+            topic (str): The topic to write about
+            style (str): Writing style (formal, casual, funny)
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+            similar (bool): Also accept the cached answer of a near-duplicate prompt (semantic cache)
         
-        # Format the prompt
-        formatted_prompt = prompt.format(style=style, topic=topic)
+        Returns:
+            TextResponse: Generated text response
+        """
+        formatted_prompt, truncated = self._build_styled_prompt(topic, style)
+        settings = self.resolve_settings(max_length, temperature, model_tier, n=n)
+        self._record_popular(use_cache, {'type': 'styled', 'topic': topic, 'style': style, 'max_length': max_length,
+                                         'temperature': temperature, 'model_tier': model_tier, 'n': n})
         
         try:
-            response = self.llm.invoke(formatted_prompt)
-            return TextResponse(response.content)
+            response = await self._ainvoke(formatted_prompt, 'styled', settings, use_cache, similar)
+            return self._annotate(response, formatted_prompt, truncated)
+        except GenerationException:
+            raise
         except Exception as e:
             raise GenerationException(f"Error generating styled text: {str(e)}")
     
-    def generate_creative_content(self, content_type, subject):
+    async def agenerate_creative_content(self, content_type, subject, use_cache=True,
+                                         max_length=None, temperature=None, model_tier=None, n=None, similar=False):
         """
-        Generate different types of creative content
+        Async version of generate_creative_content()
         
         Args:
             content_type (str): Type of content (poem, story, joke, fact)
             subject (str): Subject matter for the content
-            
+            use_cache (bool): Whether a cached response may be returned
+            max_length (int): Output token limit (None for the default)
+            temperature (float): Temperature, 0.0 to 1.0 (None for the default)
+            model_tier (str): Model tier, or None / 'auto' to let the service choose
+            n (int): Number of candidates to generate (None for 1)
+            similar (bool): Also accept the cached answer of a near-duplicate prompt (semantic cache)
+        
         Returns:
             TextResponse: Generated creative content
         """
-        if not subject or len(subject.strip()) == 0:
-            raise InvalidInputException("Subject cannot be empty")
+        prompt, truncated = self._build_creative_prompt(content_type, subject)
+        settings = self.resolve_settings(max_length, temperature, model_tier, content_type, n)
+        self._record_popular(use_cache, {'type': 'creative', 'content_type': content_type, 'subject': subject,
+                                         'max_length': max_length, 'temperature': temperature,
+                                         'model_tier': model_tier, 'n': n})
         
-        templates = {
-            "poem": "Write a short poem about {subject}. Make it creative and emotional.",
-            "story": "Write a very short story about {subject}. Include a beginning, middle, and end.",
-            "joke": "Write a funny joke about {subject}. Make it family-friendly.",
-            "fact": "Write an interesting fun fact about {subject}. Make it educational."
+        try:
+            response = await self._ainvoke(prompt, 'creative', settings, use_cache, similar)
+            return self._annotate(response, prompt, truncated)
+        except GenerationException:
+            raise
+        except Exception as e:
+            raise GenerationException(f"Error generating creative content: {str(e)}")
+    
+    @staticmethod
+    def item_kind(item):
+        """Return the kind of a request item from its 'type' field or the fields present"""
+        if not isinstance(item, dict):
+            raise InvalidInputException("Each item must be a JSON object")
+        
+        kind = item.get('type')
+        if kind is None:
+            if 'prompt' in item:
+                kind = 'simple'
+            elif 'topic' in item or 'style' in item:
+                kind = 'styled'
+            elif 'content_type' in item or 'subject' in item:
+                kind = 'creative'
+        
+        if kind not in ('simple', 'styled', 'creative'):
+            raise InvalidInputException("Item type must be 'simple', 'styled', or 'creative'")
+        return kind
+    
+    @staticmethod
+    def item_options(item):
+        """Return the generation parameters (max_length, temperature, model_tier, n) of a request item"""
+        options = {
+            'max_length': item.get('max_length'),
+            'temperature': item.get('temperature'),
+            'model_tier': item.get('model_tier')
         }
+        # 'candidate_count' is accepted as Gemini's name for n
+        n = item.get('n', item.get('candidate_count'))
+        if n is not None:
+            options['n'] = n
+        return options
+    
+    def item_cache_key(self, item):
+        """
+        Return the cache key and endpoint a request item's answer is cached under
         
-        if content_type not in templates:
-            raise InvalidInputException(f"Invalid content type. Choose from: {', '.join(templates.keys())}")
+        Args:
+            item (dict): Request fields, as accepted by generate_item()
         
-        prompt = templates[content_type].format(subject=subject)
+        Returns:
+            tuple: (cache key, endpoint name)
+        """
+        kind = self.item_kind(item)
+        content_type = None
+        if kind == 'simple':
+            prompt, _ = self._build_simple_prompt(item.get('prompt'))
+        elif kind == 'styled':
+            prompt, _ = self._build_styled_prompt(item.get('topic'), item.get('style'))
+        else:
+            content_type = item.get('content_type')
+            prompt, _ = self._build_creative_prompt(content_type, item.get('subject'))
+        settings = self.resolve_settings(content_type=content_type, **self.item_options(item))
+        return self._cache_key(prompt, settings), kind
+    
+    def generate_item(self, item, use_cache=True):
+        """
+        Generate text for one request item of any kind
         
-        try:
-            response = self.llm.invoke(prompt)
-            return TextResponse(response.content)
-        except Exception as e:
-            raise GenerationException(f"Error generating creative content: {str(e)}")
\ No newline at end of file
+        The kind is taken from item['type'] ('simple', 'styled' or 'creative')
+        or, when missing, inferred from the fields present.
+        
+        Args:
+            item (dict): Request fields, e.g. {'prompt': ...} or {'topic': ..., 'style': ...}
+            use_cache (bool): Whether a cached response may be returned
+        
+        Returns:
+            TextResponse: Generated text response
+        """
+        kind = self.item_kind(item)
+        options = dict(self.item_options(item), similar=item.get('similar') is True)
+        if kind == 'simple':
+            return self.generate_simple_text(item.get('prompt'), use_cache=use_cache, **options)
+        if kind == 'styled':
+            return self.generate_with_template(item.get('topic'), item.get('style'), use_cache=use_cache, **options)
+        return self.generate_creative_content(item.get('content_type'), item.get('subject'), use_cache=use_cache,
+                                              **options)
+    
+    def generate_batch(self, items, max_workers=8, use_cache=True):
+        """
+        Generate text for many items concurrently
+        
+        Items are sent upstream in parallel through a bounded thread pool. A failing
+        item does not affect the others: its exception is returned in its slot.
+        
+        Args:
+            items (list): Request items accepted by generate_item()
+            max_workers (int): Maximum number of concurrent upstream calls
+            use_cache (bool): Whether cached responses may be returned
+        
+        Returns:
+            list: TextResponse or Exception for each item, in input order
+        """
+        def run(item):
+            try:
+                return self.generate_item(item, use_cache=use_cache)
+            except Exception as e:
+                return e
+        
+        if not items:
+            return []
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+            # Each item runs in a copy of the caller's context, so its priority and trace carry over
+            futures = [executor.submit(contextvars.copy_context().run, run, item) for item in items]
+            return [future.result() for future in futures]
+    
+    async def agenerate_item(self, item, use_cache=True):
+        """
+        Async version of generate_item()
+        
+        Args:
+            item (dict): Request fields, e.g. {'prompt': ...} or {'topic': ..., 'style': ...}
+            use_cache (bool): Whether a cached response may be returned
+        
+        Returns:
+            TextResponse: Generated text response
+        """
+        kind = self.item_kind(item)
+        options = dict(self.item_options(item), similar=item.get('similar') is True)
+        if kind == 'simple':
+            return await self.agenerate_simple_text(item.get('prompt'), use_cache=use_cache, **options)
+        if kind == 'styled':
+            return await self.agenerate_with_template(item.get('topic'), item.get('style'), use_cache=use_cache,
+                                                      **options)
+        return await self.agenerate_creative_content(item.get('content_type'), item.get('subject'),
+                                                     use_cache=use_cache, **options)
+    
+    async def agenerate_batch(self, items, max_concurrency=8, use_cache=True):
+        """
+        Generate text for many items concurrently on the event loop
+        
+        Unlike generate_batch(), no thread is held per upstream call, so a single
+        worker can keep many requests in flight.
+        
+        Args:
+            items (list): Request items accepted by generate_item()
+            max_concurrency (int): Maximum number of concurrent upstream calls
+            use_cache (bool): Whether cached responses may be returned
+        
+        Returns:
+            list: TextResponse or Exception for each item, in input order
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def run(item):
+            async with semaphore:
+                try:
+                    return await self.agenerate_item(item, use_cache=use_cache)
+                except Exception as e:
+                    return e
+        
+        return list(await asyncio.gather(*(run(item) for item in items)))
@@ -0,0 +1,236 @@
+"""Background generation jobs: a bounded queue in front of a fixed pool of worker threads"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.job_store import Job, JobStore
+from services.scheduler import scheduled_as
+from exception.generation_exceptions import QueueFullException
+
+class JobQueue:
+    """
+    Runs submitted jobs on a fixed number of worker threads
+    
+    At most ``max_queue`` jobs wait for a worker; further submissions are
+    rejected with QueueFullException instead of piling up. Finished jobs are
+    kept for ``result_ttl`` seconds so clients can fetch the result, then
+    dropped. Jobs run with the priority class and client of the request that
+    submitted them (background outside a request).
+    
+    Jobs are kept in ``store``: in this process by default, or in a
+    PersistentJobStore that every worker process opens. With a shared store
+    any worker can report a job, idle workers take jobs queued elsewhere, and
+    a poller thread picks up jobs left behind by workers that exited.
+    """
+    
+    def __init__(self, execute, max_workers=4, max_queue=100, result_ttl=600, store=None, poll_interval=2.0):
+        """
+        Initialize the job queue
+        
+        Args:
+            execute (callable): Called as execute(item, use_cache) in a worker; returns a TextResponse
+            max_workers (int): Jobs executed at the same time by this process
+            max_queue (int): Jobs that may wait for a worker
+            result_ttl (float): Seconds a finished job's result is kept
+            store (JobStore, PersistentJobStore or callable): Where jobs are kept, or a function creating
+                the store on first use (a new in-process JobStore by default)
+            poll_interval (float): Seconds between checks of a shared store for jobs nobody is running
+        """
+        self.execute = execute
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self._make_store = store if callable(store) else None
+        self._store = None if callable(store) else store if store is not None else JobStore()
+        self._store_lock = threading.Lock()
+        self.poll_interval = poll_interval
+        self._scheduled = 0  # _work() calls submitted to the executor and not finished yet
+        self._avg_duration = None
+        self._executor = None
+        self._poller = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.expired = 0
+        self.recovered = 0
+    
+    @property
+    def store(self):
+        """The job store, created on first use when a factory was given"""
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = self._make_store()
+        return self._store
+    
+    def after_fork(self):
+        """Drop store connections inherited from the parent process (a no-op if it was never opened)"""
+        if self._store is not None and self._store.shared:
+            self._store.after_fork()
+    
+    def _start(self):
+        """Create the worker threads (and the poller of a shared store) on first use"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            # Created on first use so no threads exist before a server forks its workers
+            self._stop = threading.Event()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job-worker')
+            if self.store.shared:
+                self._poller = threading.Thread(target=self._poll, args=(self._stop,), name='job-poller',
+                                                daemon=True)
+                self._poller.start()
+    
+    def _schedule(self, count):
+        """Ask the executor to claim and run up to ``count`` queued jobs"""
+        with self._lock:
+            if self._executor is None:
+                return
+            for _ in range(count):
+                self._scheduled += 1
+                self._executor.submit(self._work)
+    
+    def _purge(self):
+        """Drop finished jobs whose result TTL has passed"""
+        expired = self.store.purge(time.time())
+        if expired:
+            with self._lock:
+                self.expired += expired
+    
+    def submit(self, item, kind, use_cache=True):
+        """
+        Queue a job
+        
+        Args:
+            item (dict): Request fields, as accepted by GeminiService.generate_item()
+            kind (str): simple, styled or creative
+            use_cache (bool): Whether a cached response may be returned
+        
+        Returns:
+            dict: The queued job (see Job.to_dict())
+        
+        Raises:
+            QueueFullException: If max_queue jobs are already waiting
+        """
+        self._start()
+        self._purge()
+        queued = self.store.counts()['queued']
+        with self._lock:
+            if queued >= self.max_queue:
+                self.rejected += 1
+                # Roughly how long until a worker picks up the next waiting job
+                retry_after = (self._avg_duration or 1.0) / self.max_workers
+                raise QueueFullException(retry_after=retry_after)
+            self.submitted += 1
+        
+        job = Job(item, kind, use_cache)
+        snapshot = job.to_dict()
+        self.store.add(job)
+        self._schedule(1)
+        return snapshot
+    
+    def _work(self):
+        """Claim the oldest queued job, from any worker process with a shared store, and run it"""
+        try:
+            job = self.store.claim()
+            if job is not None:
+                self._run(job)
+        except Exception as e:
+            print(f"Warning: background job failed to run: {e}")
+        finally:
+            with self._lock:
+                self._scheduled -= 1
+    
+    def _run(self, job):
+        """Execute one claimed job in a worker thread and record its outcome"""
+        start = time.monotonic()
+        response, error, status_code = None, None, 200
+        try:
+            with scheduled_as(*job.ticket):
+                response = self.execute(job.item, job.use_cache)
+        except Exception as e:
+            error, status_code = str(e), getattr(e, 'status_code', 500)
+        
+        duration = time.monotonic() - start
+        self.store.finish(job, status_code, response.to_dict() if response is not None else None, error,
+                          time.time() + self.result_ttl)
+        with self._lock:
+            if error is None:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            self._avg_duration = duration if self._avg_duration is None else \
+                0.9 * self._avg_duration + 0.1 * duration
+    
+    def _poll(self, stop):
+        """Requeue jobs of exited workers and run jobs no worker has scheduled, until shutdown()"""
+        while not stop.wait(self.poll_interval):
+            try:
+                recovered = self.store.recover()
+                queued = self.store.counts()['queued']
+            except sqlite3.Error as e:
+                print(f"Warning: could not check the job store: {e}")
+                continue
+            with self._lock:
+                self.recovered += recovered
+                idle = self.max_workers - self._scheduled
+            if queued and idle > 0:
+                self._schedule(min(queued, idle))
+    
+    def get(self, job_id):
+        """
+        Look up a job
+        
+        Args:
+            job_id (str): Id returned by submit()
+        
+        Returns:
+            dict: The job (see Job.to_dict()), or None if it is unknown or its result expired
+        """
+        self._start()
+        self._purge()
+        return self.store.get(job_id)
+    
+    def shutdown(self, wait=True):
+        """
+        Stop the workers, cancelling jobs that have not started
+        
+        With a shared store, cancelled jobs stay queued there and another
+        worker process runs them.
+        """
+        self._stop.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if self._store is not None and self._store.shared:
+            self._store.close()
+    
+    def stats(self):
+        """Return queue depth and job counters (queue depth across every worker with a shared store)"""
+        self._start()
+        self._purge()
+        counts = self.store.counts()
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'result_ttl': self.result_ttl,
+                'shared': self.store.shared,
+                'queued': counts['queued'],
+                'running': counts['running'],
+                'stored': counts['stored'],
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'expired': self.expired,
+                'recovered': self.recovered,
+                'avg_duration': round(self._avg_duration, 4) if self._avg_duration is not None else None
+            }
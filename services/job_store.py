@@ -0,0 +1,344 @@
+"""Where background jobs and their results are kept: in this process, or in SQLite shared by every worker"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from services.scheduler import current_ticket
+
+class Job:
+    """One submitted generation request and its outcome"""
+    
+    def __init__(self, item, kind, use_cache=True, ticket=None, job_id=None):
+        """
+        Initialize a queued job
+        
+        Args:
+            item (dict): Request fields, as accepted by GeminiService.generate_item()
+            kind (str): simple, styled or creative
+            use_cache (bool): Whether a cached response may be returned
+            ticket (tuple): (priority class, client id) the job runs as; defaults to the current request's
+            job_id (str): Id of a stored job being restored (a new one is generated by default)
+        """
+        self.job_id = job_id or uuid.uuid4().hex
+        self.item = item
+        self.kind = kind
+        self.use_cache = use_cache
+        self.ticket = ticket or current_ticket() or ('background', None)
+        self.status = 'queued'
+        self.status_code = None
+        self.response = None  # TextResponse.to_dict() once the job succeeded
+        self.error = None
+        self.submitted_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+    
+    def to_dict(self):
+        """Convert the job to a dictionary for the status endpoint"""
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'status': self.status,
+            'status_code': self.status_code,
+            'response': self.response,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class JobStore:
+    """Jobs kept in this process; only the worker that accepted a job can run or report it"""
+    
+    shared = False
+    
+    def __init__(self):
+        self._jobs = {}
+        self._waiting = deque()  # ids of queued jobs, oldest first
+        self._expiry = deque()  # (expires_at, job_id) in the order jobs finished
+        self._running = 0
+        self._lock = threading.Lock()
+    
+    def add(self, job):
+        """Store a new queued job"""
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._waiting.append(job.job_id)
+    
+    def claim(self):
+        """
+        Take the oldest queued job and mark it running
+        
+        Returns:
+            Job: The job to execute, or None if nothing is waiting
+        """
+        with self._lock:
+            while self._waiting:
+                job = self._jobs.get(self._waiting.popleft())
+                if job is not None:
+                    job.status = 'running'
+                    job.started_at = datetime.now().isoformat()
+                    self._running += 1
+                    return job
+        return None
+    
+    def finish(self, job, status_code, response, error, expires_at):
+        """
+        Record a job's outcome
+        
+        Args:
+            job (Job): Job returned by claim()
+            status_code (int): HTTP status of the outcome
+            response (dict): TextResponse.to_dict(), or None on failure
+            error (str): Error message, or None on success
+            expires_at (float): Unix time after which the result is dropped
+        """
+        with self._lock:
+            job.status = 'succeeded' if error is None else 'failed'
+            job.status_code = status_code
+            job.response = response
+            job.error = error
+            job.finished_at = datetime.now().isoformat()
+            job.item = None
+            self._running -= 1
+            self._expiry.append((expires_at, job.job_id))
+    
+    def get(self, job_id):
+        """Return a job as a dictionary (see Job.to_dict()), or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+    
+    def purge(self, now):
+        """
+        Drop finished jobs whose result has expired
+        
+        Args:
+            now (float): Current Unix time
+        
+        Returns:
+            int: Number of jobs dropped
+        """
+        expired = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, job_id = self._expiry.popleft()
+                del self._jobs[job_id]
+                expired += 1
+        return expired
+    
+    def recover(self):
+        """Requeue jobs abandoned by processes that exited (nothing to do within one process)"""
+        return 0
+    
+    def counts(self):
+        """Return the number of queued, running and stored jobs"""
+        with self._lock:
+            return {'queued': len(self._waiting), 'running': self._running, 'stored': len(self._jobs)}
+
+class PersistentJobStore:
+    """
+    Jobs kept in a SQLite file (WAL mode) that every worker process on the host opens
+    
+    A job can be submitted to one worker, run by another and polled through a
+    third. Jobs stay queued in the database when the worker that accepted them
+    exits (recycling, deploys), and recover() puts jobs left running by a dead
+    process back in the queue, so another worker picks them up.
+    """
+    
+    shared = True
+    
+    def __init__(self, path):
+        """
+        Initialize the store, creating the database if needed
+        
+        Args:
+            path (str): SQLite database file
+        """
+        self.path = path
+        self._local = threading.local()
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                status_code INTEGER,
+                item TEXT,
+                use_cache INTEGER NOT NULL,
+                priority TEXT NOT NULL,
+                client TEXT,
+                response TEXT,
+                error TEXT,
+                submitted_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                expires_at REAL,
+                owner INTEGER
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+    
+    def after_fork(self):
+        """Drop connections inherited from the parent process (each worker opens its own)"""
+        self._local = threading.local()
+    
+    def _connection(self):
+        """Return this thread's connection (SQLite connections must not be shared between threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def add(self, job):
+        """Store a new queued job"""
+        priority_class, client = job.ticket
+        self._connection().execute(
+            "INSERT INTO jobs (job_id, kind, status, item, use_cache, priority, client, submitted_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+            (job.job_id, job.kind, json.dumps(job.item), int(job.use_cache), priority_class, client, job.submitted_at)
+        )
+    
+    def claim(self):
+        """
+        Take the oldest queued job and mark it running in this process
+        
+        Returns:
+            Job: The job to execute, or None if nothing is waiting
+        """
+        conn = self._connection()
+        started_at = datetime.now().isoformat()
+        # IMMEDIATE takes the write lock up front, so two workers never claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT seq, job_id, kind, item, use_cache, priority, client, submitted_at FROM jobs "
+                "WHERE status = 'queued' ORDER BY seq LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', started_at = ?, owner = ? WHERE seq = ?",
+                             (started_at, os.getpid(), row[0]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        
+        _, job_id, kind, item, use_cache, priority_class, client, submitted_at = row
+        job = Job(json.loads(item), kind, bool(use_cache), ticket=(priority_class, client), job_id=job_id)
+        job.status = 'running'
+        job.submitted_at = submitted_at
+        job.started_at = started_at
+        return job
+    
+    def finish(self, job, status_code, response, error, expires_at):
+        """
+        Record a job's outcome
+        
+        Args:
+            job (Job): Job returned by claim()
+            status_code (int): HTTP status of the outcome
+            response (dict): TextResponse.to_dict(), or None on failure
+            error (str): Error message, or None on success
+            expires_at (float): Unix time after which the result is dropped
+        """
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, status_code = ?, response = ?, error = ?, finished_at = ?, expires_at = ?, "
+            "item = NULL, owner = NULL WHERE job_id = ?",
+            ('succeeded' if error is None else 'failed', status_code,
+             json.dumps(response) if response is not None else None, error, datetime.now().isoformat(),
+             expires_at, job.job_id)
+        )
+    
+    def get(self, job_id):
+        """Return a job as a dictionary (see Job.to_dict()), or None if it is unknown or expired"""
+        row = self._connection().execute(
+            "SELECT job_id, kind, status, status_code, response, error, submitted_at, started_at, finished_at "
+            "FROM jobs WHERE job_id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (job_id, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'status_code': row[3],
+            'response': json.loads(row[4]) if row[4] else None,
+            'error': row[5],
+            'submitted_at': row[6],
+            'started_at': row[7],
+            'finished_at': row[8]
+        }
+    
+    def purge(self, now):
+        """
+        Drop finished jobs whose result has expired
+        
+        Args:
+            now (float): Current Unix time
+        
+        Returns:
+            int: Number of jobs dropped
+        """
+        return self._connection().execute("DELETE FROM jobs WHERE expires_at <= ?", (now,)).rowcount
+    
+    def recover(self):
+        """
+        Requeue running jobs whose worker process no longer exists
+        
+        Returns:
+            int: Number of jobs requeued
+        """
+        conn = self._connection()
+        owners = [owner for (owner,) in conn.execute(
+            "SELECT DISTINCT owner FROM jobs WHERE status = 'running' AND owner IS NOT NULL")]
+        requeued = 0
+        for owner in owners:
+            if _process_exists(owner):
+                continue
+            requeued += conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL "
+                "WHERE status = 'running' AND owner = ?", (owner,)
+            ).rowcount
+        return requeued
+    
+    def counts(self):
+        """Return the number of queued, running and stored jobs across every worker"""
+        counts = {'queued': 0, 'running': 0, 'stored': 0}
+        for status, count in self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            if status in counts:
+                counts[status] = count
+            counts['stored'] += count
+        return counts
+    
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _process_exists(pid):
+    """Check whether a process is still running on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # it exists, but belongs to another user
+    return True
@@ -0,0 +1,359 @@
+"""Retries, circuit breaking and hedged requests around upstream model calls"""
+
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from services.client_pool import is_quota_error
+from exception.generation_exceptions import CircuitOpenException
+
+_TRANSIENT_ERROR_NAMES = (
+    'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError', 'ResourceExhausted',
+    'TooManyRequests', 'Aborted', 'GatewayTimeout', 'BadGateway', 'Unknown',
+    'TimeoutError', 'ConnectionError', 'ConnectError', 'ReadTimeout', 'RemoteDisconnected'
+)
+
+def is_transient_error(error):
+    """
+    Check whether an upstream error is worth retrying
+    
+    Args:
+        error (Exception): Error raised by the client
+    
+    Returns:
+        bool: True for timeouts, connection problems, 5xx and 429 errors
+    """
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if type(error).__name__ in _TRANSIENT_ERROR_NAMES or is_quota_error(error):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in ('500', '502', '503', '504', 'unavailable', 'timed out', 'deadline'))
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+    
+    def __init__(self, max_attempts=3, base_delay=0.25, max_delay=4.0):
+        """
+        Initialize the retry policy
+        
+        Args:
+            max_attempts (int): Total attempts including the first call
+            base_delay (float): Backoff in seconds before the first retry
+            max_delay (float): Upper bound for a single backoff
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def backoff(self, attempt):
+        """Return a random delay for the given retry number (1 for the first retry)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures, then lets a trial call through"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        """
+        Initialize the circuit breaker
+        
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            recovery_timeout (float): Seconds to stay open before allowing a trial call
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    def before_call(self):
+        """
+        Check that a call may go ahead
+        
+        Raises:
+            CircuitOpenException: If the circuit is open (or a trial call is already running)
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            
+            self.rejected += 1
+            raise CircuitOpenException(retry_after=max(1.0, remaining))
+    
+    def record_success(self):
+        """Close the circuit after a successful call"""
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        """Count a failed call, opening the circuit when the threshold is reached"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+    
+    def release(self):
+        """Forget a trial call that ended without a verdict (e.g. an invalid request)"""
+        with self._lock:
+            self._trial_in_flight = False
+    
+    def stats(self):
+        """Return breaker state and counters"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+class LatencyTracker:
+    """Keeps recent call latencies to estimate a percentile"""
+    
+    def __init__(self, window=200):
+        """
+        Initialize the tracker
+        
+        Args:
+            window (int): Number of most recent samples kept
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds):
+        """Add one latency sample"""
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, percent, min_samples=20):
+        """
+        Return the latency percentile, or None until enough samples are collected
+        
+        Args:
+            percent (float): Percentile, e.g. 95
+            min_samples (int): Samples needed before an estimate is returned
+        """
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class ResilientCaller:
+    """Wraps upstream calls with retries, a circuit breaker and optional hedging"""
+    
+    def __init__(self, retry=None, breaker=None, hedge=False, hedge_percentile=95,
+                 hedge_min_samples=20, hedge_max_workers=32):
+        """
+        Initialize the caller
+        
+        Args:
+            retry (RetryPolicy): Retry policy (defaults to 3 attempts)
+            breaker (CircuitBreaker): Circuit breaker (defaults to 5 failures / 30 s)
+            hedge (bool): Send a second call when the first is slower than the latency percentile
+            hedge_percentile (float): Latency percentile that triggers the hedge
+            hedge_min_samples (int): Calls observed before hedging starts
+            hedge_max_workers (int): Threads available for hedged synchronous calls
+        """
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        
+        self._executor = ThreadPoolExecutor(max_workers=hedge_max_workers) if hedge else None
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+    
+    def shutdown(self):
+        """Stop the hedging threads (used when a worker exits)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+    
+    def _count(self, counter):
+        """Increment one of the retry/hedge counters"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def _hedge_delay(self):
+        """Return how long to wait before hedging, or None when hedging is off or not calibrated yet"""
+        if not self.hedge:
+            return None
+        return self.latency.percentile(self.hedge_percentile, self.hedge_min_samples)
+    
+    def call(self, func):
+        """
+        Call func with retries, circuit breaking and hedging
+        
+        Args:
+            func (callable): Performs one upstream call
+        
+        Returns:
+            The value returned by func
+        """
+        attempt = 1
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self._timed(func)
+            except Exception as e:
+                if not is_transient_error(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retry.max_attempts:
+                    raise
+                self._count('retries')
+                time.sleep(self.retry.backoff(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled or interrupted (e.g. asyncio.CancelledError): no verdict, free a half-open trial
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+    
+    async def acall(self, func):
+        """
+        Async version of call()
+        
+        Args:
+            func (callable): Coroutine function performing one upstream call
+        
+        Returns:
+            The value returned by the coroutine
+        """
+        attempt = 1
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self._atimed(func)
+            except Exception as e:
+                if not is_transient_error(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retry.max_attempts:
+                    raise
+                self._count('retries')
+                await asyncio.sleep(self.retry.backoff(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled or interrupted (e.g. asyncio.CancelledError): no verdict, free a half-open trial
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+    
+    def _timed(self, func):
+        """Run one attempt, hedging it if it is slower than usual"""
+        start = time.monotonic()
+        delay = self._hedge_delay()
+        if delay is None:
+            result = func()
+        else:
+            result = self._hedged(func, delay)
+        self.latency.record(time.monotonic() - start)
+        return result
+    
+    def _hedged(self, func, delay):
+        """Start func, and start it again if it has not finished after delay seconds"""
+        # Each copy runs in the caller's context (priority ticket, trace, stage timers); a
+        # context can only be entered by one thread at a time, so every submit gets its own
+        first = self._executor.submit(contextvars.copy_context().run, func)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        
+        self._count('hedges_sent')
+        second = self._executor.submit(contextvars.copy_context().run, func)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count('hedges_won')
+                    return future.result()
+                error = future.exception()
+        raise error
+    
+    async def _atimed(self, func):
+        """Async version of _timed()"""
+        start = time.monotonic()
+        delay = self._hedge_delay()
+        if delay is None:
+            result = await func()
+        else:
+            result = await self._ahedged(func, delay)
+        self.latency.record(time.monotonic() - start)
+        return result
+    
+    async def _ahedged(self, func, delay):
+        """Async version of _hedged(); the slower call is cancelled"""
+        first = asyncio.ensure_future(func())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        
+        self._count('hedges_sent')
+        second = asyncio.ensure_future(func())
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count('hedges_won')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def stats(self):
+        """Return retry, hedging and circuit breaker counters"""
+        with self._lock:
+            counters = {
+                'retries': self.retries,
+                'hedges_sent': self.hedges_sent,
+                'hedges_won': self.hedges_won
+            }
+        return dict(counters, circuit=self.breaker.stats(),
+                    latency_p95=self.latency.percentile(95, min_samples=1))
@@ -0,0 +1,216 @@
+"""In-memory LRU response cache with TTL and byte budget for generated text"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """Bounded LRU cache that stores TextResponse objects for a limited time"""
+    
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, default_ttl=300, ttls=None, store=None):
+        """
+        Initialize the response cache
+        
+        Args:
+            max_entries (int): Maximum number of cached responses
+            max_bytes (int): Maximum total size of cached prompts and content in bytes
+            default_ttl (float): Time to live in seconds for endpoints without their own TTL
+            ttls (dict): Optional per-endpoint TTLs, e.g. {'simple': 300, 'creative': 3600}
+            store (PersistentResponseStore): Optional shared on-disk store used behind the
+                in-memory entries (written through on set, read on a memory miss). If the store
+                fails (locked, full or corrupt database), the error is counted and the cache
+                carries on in memory only
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.store = store
+        
+        self._entries = OrderedDict()  # key -> (expires_at, size, response)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.store_errors = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(prompt, model, temperature, max_output_tokens, candidates=1):
+        """
+        Build a cache key from the formatted prompt and generation settings
+        
+        Args:
+            prompt (str): Fully formatted prompt sent to the model
+            model (str): Model name
+            temperature (float): Sampling temperature
+            max_output_tokens (int): Output token limit
+            candidates (int): Number of candidates requested
+        
+        Returns:
+            tuple: Hashable cache key (the prompt is always the last element)
+        """
+        if candidates == 1:
+            # Same key as before multiple candidates existed, so stored responses stay valid
+            return (model, temperature, max_output_tokens, prompt)
+        return (model, temperature, max_output_tokens, candidates, prompt)
+    
+    def ttl_for(self, endpoint):
+        """Return the TTL in seconds used for an endpoint"""
+        return self.ttls.get(endpoint, self.default_ttl)
+    
+    def get(self, key):
+        """
+        Look up a cached response
+        
+        Args:
+            key (tuple): Key built with make_key()
+        
+        Returns:
+            TextResponse: Cached response, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, size, response = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+            
+            if self.store is None:
+                self.misses += 1
+                return None
+        
+        # Memory miss: another worker (or an earlier run) may have stored it on disk
+        response, remaining_ttl = self._store_get(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.store_hits += 1
+        self._put(key, response, remaining_ttl)
+        return response
+    
+    def entry(self, key):
+        """
+        Look up a response and its remaining lifetime without touching the hit/miss counters
+        
+        Used by background work (e.g. cache warming) that should not skew the hit rate.
+        An entry found only in the store is copied into memory.
+        
+        Args:
+            key (tuple): Key built with make_key()
+        
+        Returns:
+            tuple: (TextResponse, seconds until it expires), or (None, 0) if it is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[2], entry[0] - time.monotonic()
+        
+        if self.store is None:
+            return None, 0
+        response, remaining_ttl = self._store_get(key)
+        if response is not None:
+            self._put(key, response, remaining_ttl)
+        return response, remaining_ttl
+    
+    def set(self, key, response, endpoint=None, ttl=None):
+        """
+        Store a response, evicting least recently used entries when over budget
+        
+        Args:
+            key (tuple): Key built with make_key()
+            response (TextResponse): Response to cache
+            endpoint (str): Endpoint name used to pick the TTL
+            ttl (float): Seconds to keep the response, overriding the endpoint's TTL
+        """
+        ttl = self.ttl_for(endpoint) if ttl is None else ttl
+        if ttl <= 0:
+            return
+        
+        self._put(key, response, ttl)
+        if self.store is not None:
+            try:
+                self.store.set(key, response, ttl)
+            except sqlite3.Error as e:
+                self._store_failed('write', e)
+    
+    def _store_get(self, key):
+        """Read from the store, treating a store failure as a miss"""
+        try:
+            return self.store.get(key)
+        except sqlite3.Error as e:
+            self._store_failed('read', e)
+            return None, 0
+    
+    def _store_failed(self, operation, error):
+        """Count a store failure; the first one is logged, the count is in stats() and the metrics"""
+        with self._lock:
+            self.store_errors += 1
+            first = self.store_errors == 1
+        if first:
+            print(f"Warning: response store {operation} failed, serving from memory only: {error}")
+    
+    def _put(self, key, response, ttl):
+        """Add an entry to memory, evicting least recently used entries when over budget"""
+        size = self._estimate_size(key, response)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            
+            self._entries[key] = (time.monotonic() + ttl, size, response)
+            self._bytes += size
+            
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        """Remove all cached responses"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        """Return cache counters as a dictionary"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'store_hits': self.store_hits,
+                'store_errors': self.store_errors,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def _estimate_size(key, response):
+        """Approximate memory cost of an entry as the UTF-8 size of its prompt and candidates"""
+        prompt = key[-1]
+        return len(prompt.encode('utf-8')) + sum(len((text or '').encode('utf-8')) for text in response.candidates)
@@ -0,0 +1,274 @@
+"""Persistent response store in SQLite (WAL mode), shared by every worker process on a host"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, every process compacts on its own schedule
+    fcntl = None
+
+from model.text_generation import TextResponse
+
+class PersistentResponseStore:
+    """
+    Disk-backed store of generated responses that survives restarts and deploys
+    
+    Every worker opens the same database file; WAL mode lets them read while one
+    writes. Entries expire after their TTL, the file is kept under a byte
+    budget by dropping the least recently used entries, and a background thread
+    compacts the database. Each process runs that thread, but they take turns
+    through a lock file, so the database is compacted once per interval however
+    many workers share it.
+    """
+    
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, compaction_interval=300):
+        """
+        Initialize the store, creating the database if needed
+        
+        Args:
+            path (str): SQLite database file
+            max_bytes (int): Budget for stored prompts and content in bytes
+            compaction_interval (float): Seconds between background compactions (0 to disable)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compaction_interval = compaction_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.compactions = 0
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key_hash TEXT PRIMARY KEY,
+                cache_key TEXT NOT NULL,
+                content TEXT NOT NULL,
+                model_used TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                candidates TEXT
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+        if 'candidates' not in columns:
+            # Databases written before multiple candidates existed
+            conn.execute("ALTER TABLE responses ADD COLUMN candidates TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+        
+        self._start_compaction()
+    
+    def after_fork(self):
+        """
+        Reset per-process state in a forked worker
+        
+        Connections and threads do not survive fork(): each worker opens its own
+        connections and runs its own compaction thread (see compact_if_due()).
+        """
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._start_compaction()
+    
+    def _start_compaction(self):
+        """Start the background compaction thread, if enabled"""
+        self._thread = None
+        if self.compaction_interval > 0:
+            self._thread = threading.Thread(target=self._compaction_loop, name='response-store-compaction',
+                                            daemon=True)
+            self._thread.start()
+    
+    def _connection(self):
+        """Return this thread's connection (SQLite connections must not be shared between threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # auto_vacuum only takes effect on a new database, before the first table is created
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def _hash(key):
+        """Hash a ResponseCache key into a fixed-size database key"""
+        return hashlib.sha256(json.dumps(list(key)).encode('utf-8')).hexdigest()
+    
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+    
+    def get(self, key):
+        """
+        Look up a stored response
+        
+        Args:
+            key (tuple): Key built with ResponseCache.make_key()
+        
+        Returns:
+            tuple: (TextResponse, seconds until it expires), or (None, 0) on a miss
+        """
+        now = time.time()
+        key_hash = self._hash(key)
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT content, model_used, timestamp, expires_at, candidates FROM responses WHERE key_hash = ?",
+            (key_hash,)
+        ).fetchone()
+        if row is None or row[3] <= now:
+            self._count('misses')
+            return None, 0
+        
+        # Refresh the LRU position at most once a minute to keep hits from turning into writes
+        conn.execute("UPDATE responses SET last_access = ? WHERE key_hash = ? AND last_access < ?",
+                     (now, key_hash, now - 60))
+        self._count('hits')
+        response = TextResponse(row[0], row[1], candidates=json.loads(row[4]) if row[4] else None)
+        response.timestamp = row[2]
+        return response, row[3] - now
+    
+    def set(self, key, response, ttl):
+        """
+        Store a response
+        
+        Args:
+            key (tuple): Key built with ResponseCache.make_key()
+            response (TextResponse): Response to store
+            ttl (float): Seconds the response stays valid
+        """
+        now = time.time()
+        cache_key = json.dumps(list(key))
+        content = response.content or ''
+        # Single-candidate responses keep the column empty; their content is the only candidate
+        candidates = json.dumps(response.candidates) if len(response.candidates) > 1 else None
+        size = len(cache_key.encode('utf-8')) + len(content.encode('utf-8')) + len((candidates or '').encode('utf-8'))
+        self._connection().execute(
+            "INSERT OR REPLACE INTO responses (key_hash, cache_key, content, model_used, timestamp, size, "
+            "expires_at, last_access, candidates) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self._hash(key), cache_key, content, response.model_used, response.timestamp, size, now + ttl, now,
+             candidates)
+        )
+        self._count('writes')
+    
+    def compact(self):
+        """
+        Drop expired entries, enforce the byte budget and give free pages back to the file system
+        
+        Returns:
+            dict: Number of expired and evicted entries removed
+        """
+        conn = self._connection()
+        expired = conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+        
+        evicted = 0
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while total > self.max_bytes:
+            # Evict the least recently used entries, in batches, until back under budget
+            victims = []
+            for key_hash, size in conn.execute("SELECT key_hash, size FROM responses ORDER BY last_access LIMIT 500"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((key_hash,))
+                total -= size
+            if not victims:
+                break
+            conn.executemany("DELETE FROM responses WHERE key_hash = ?", victims)
+            evicted += len(victims)
+        
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA incremental_vacuum")
+        self._count('expirations', expired)
+        self._count('evictions', evicted)
+        self._count('compactions')
+        return {'expired': expired, 'evicted': evicted}
+    
+    def compact_if_due(self):
+        """
+        Compact unless another process sharing the database did so within the last interval
+        
+        ``{path}.compaction`` is locked while compacting and holds the time of the
+        last compaction, so concurrent workers neither compact at the same time
+        nor repeat each other's work.
+        
+        Returns:
+            bool: True if this process compacted
+        """
+        with open(self.path + '.compaction', 'a+', encoding='utf-8') as marker:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(marker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False  # another process is compacting right now
+            marker.seek(0)
+            try:
+                last_compaction = float(marker.read() or 0)
+            except ValueError:
+                last_compaction = 0.0
+            # A little slack, so timer jitter does not make every other turn a no-op
+            if time.time() - last_compaction < self.compaction_interval * 0.9:
+                return False
+            
+            self.compact()
+            marker.seek(0)
+            marker.truncate()
+            marker.write(str(time.time()))
+        return True
+    
+    def _compaction_loop(self):
+        """Run compact_if_due() every compaction_interval seconds until close()"""
+        while not self._stop.wait(self.compaction_interval):
+            try:
+                self.compact_if_due()
+            except (sqlite3.Error, OSError) as e:
+                print(f"Warning: response store compaction failed: {e}")
+    
+    def clear(self):
+        """Remove every stored response"""
+        self._connection().execute("DELETE FROM responses")
+    
+    def close(self):
+        """Stop the compaction thread and close this thread's connection"""
+        self._stop.set()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def stats(self):
+        """Return counters and the current size of the store (size is None while the database is unreadable)"""
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None  # locked or corrupt: report the counters anyway
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'compactions': self.compactions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
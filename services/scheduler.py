@@ -0,0 +1,222 @@
+"""Priority classes and weighted fair queuing for calls waiting on the upstream concurrency limiter"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from services.resilience import LatencyTracker
+from util.metrics import SCHEDULER_QUEUE_WAIT
+
+PRIORITY_CLASSES = ('interactive', 'batch', 'background')
+
+# (priority class, client id) of the request being handled, set by the API layer
+_current_ticket = contextvars.ContextVar('scheduler_ticket', default=None)
+
+def current_ticket():
+    """Return the (priority class, client id) of the current request, or None outside a request"""
+    return _current_ticket.get()
+
+def set_ticket(priority_class, client_id=None):
+    """
+    Make the current context run as a priority class and client
+    
+    Args:
+        priority_class (str): interactive, batch or background
+        client_id (str): Client identity used for fair sharing within the class
+    
+    Returns:
+        Token: Pass to reset_ticket() to restore the previous ticket
+    """
+    return _current_ticket.set((priority_class, client_id))
+
+def reset_ticket(token):
+    """Restore the ticket that was current before set_ticket()"""
+    _current_ticket.reset(token)
+
+@contextmanager
+def scheduled_as(priority_class, client_id=None):
+    """Run a block as a given priority class and client (see set_ticket())"""
+    token = set_ticket(priority_class, client_id)
+    try:
+        yield
+    finally:
+        reset_ticket(token)
+
+class _Entry:
+    """A waiting call with its class, client and virtual finish time"""
+    
+    __slots__ = ('waiter', 'priority_class', 'client', 'tag', 'enqueued_at')
+    
+    def __init__(self, waiter, priority_class, client, tag, enqueued_at):
+        self.waiter = waiter
+        self.priority_class = priority_class
+        self.client = client
+        self.tag = tag
+        self.enqueued_at = enqueued_at
+
+class FairScheduler:
+    """
+    Wait queue of AdaptiveConcurrencyLimiter ordered by priority class and client
+    
+    Classes are served in strict priority order (interactive, batch,
+    background). Inside a class every client has its own FIFO, and clients are
+    served by weighted fair queuing: each call gets a virtual finish time
+    ``max(class virtual time, client's last finish time) + 1 / weight`` and the
+    smallest one goes next, so a client with hundreds of queued calls and a
+    client with one take turns. To prevent starvation, a call counts as one
+    class higher for every ``aging`` seconds it has waited.
+    
+    With no priority set (current_ticket() is None) every call lands in the
+    default class under one client, which is plain FIFO. Methods other than
+    the stats ones are called with the limiter's lock held.
+    """
+    
+    def __init__(self, default_class='interactive', client_weights=None, aging=5.0, queue_timeouts=None):
+        """
+        Initialize the scheduler
+        
+        Args:
+            default_class (str): Class of calls made without a priority
+            client_weights (dict): Client id -> share weight (clients not listed weigh 1)
+            aging (float): Seconds of waiting that promote a call by one class (0 to disable)
+            queue_timeouts (dict): Class -> seconds a call may wait, overriding the limiter's queue_timeout
+        """
+        if default_class not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class '{default_class}'. Choose from: {', '.join(PRIORITY_CLASSES)}")
+        
+        self.default_class = default_class
+        self.client_weights = dict(client_weights or {})
+        self.aging = aging
+        self.queue_timeouts = dict(queue_timeouts or {})
+        self._queues = {priority_class: {} for priority_class in PRIORITY_CLASSES}  # class -> client -> deque
+        self._virtual = dict.fromkeys(PRIORITY_CLASSES, 0.0)
+        self._last_tag = {}  # (class, client) -> virtual finish time of the client's last call
+        self._entries = {}  # waiter -> _Entry
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            priority_class: {'waiting': 0, 'queued': 0, 'dispatched': 0, 'dropped': 0, 'wait_total': 0.0}
+            for priority_class in PRIORITY_CLASSES
+        }
+        self._waits = {priority_class: LatencyTracker() for priority_class in PRIORITY_CLASSES}
+        self._latencies = {priority_class: LatencyTracker() for priority_class in PRIORITY_CLASSES}
+    
+    def _ticket(self):
+        """Return the current call's (class, client), falling back to the default class"""
+        ticket = current_ticket()
+        if ticket is None or ticket[0] not in PRIORITY_CLASSES:
+            return self.default_class, None if ticket is None else ticket[1]
+        return ticket
+    
+    def append(self, waiter):
+        """Queue a waiter as the current call's class and client"""
+        priority_class, client = self._ticket()
+        key = (priority_class, client)
+        start = max(self._virtual[priority_class], self._last_tag.get(key, 0.0))
+        tag = start + 1.0 / self.client_weights.get(client, 1.0)
+        self._last_tag[key] = tag
+        
+        entry = _Entry(waiter, priority_class, client, tag, time.monotonic())
+        self._queues[priority_class].setdefault(client, deque()).append(entry)
+        self._entries[waiter] = entry
+        with self._stats_lock:
+            self._counters[priority_class]['waiting'] += 1
+            self._counters[priority_class]['queued'] += 1
+    
+    def popleft(self):
+        """Remove and return the waiter that should get the next free slot"""
+        now = time.monotonic()
+        best, best_key = None, None
+        for rank, priority_class in enumerate(PRIORITY_CLASSES):
+            for queue in self._queues[priority_class].values():
+                head = queue[0]
+                promoted = int((now - head.enqueued_at) / self.aging) if self.aging else 0
+                key = (rank - promoted, rank, head.tag)
+                if best_key is None or key < best_key:
+                    best, best_key = head, key
+        if best is None:
+            raise IndexError('pop from an empty scheduler')
+        
+        self._virtual[best.priority_class] = max(self._virtual[best.priority_class], best.tag)
+        self._discard(best)
+        wait = now - best.enqueued_at
+        SCHEDULER_QUEUE_WAIT.observe(wait, priority=best.priority_class)
+        self._waits[best.priority_class].record(wait)
+        with self._stats_lock:
+            counters = self._counters[best.priority_class]
+            counters['dispatched'] += 1
+            counters['wait_total'] += wait
+        return best.waiter
+    
+    def remove(self, waiter):
+        """Remove a waiter that gave up (deadline passed or cancelled)"""
+        entry = self._entries[waiter]
+        self._discard(entry)
+        with self._stats_lock:
+            self._counters[entry.priority_class]['dropped'] += 1
+    
+    def _discard(self, entry):
+        """Take an entry out of its client's queue and forget idle clients"""
+        del self._entries[entry.waiter]
+        clients = self._queues[entry.priority_class]
+        queue = clients[entry.client]
+        queue.remove(entry)
+        with self._stats_lock:
+            self._counters[entry.priority_class]['waiting'] -= 1
+        if not queue:
+            # An idle client starts again from the class virtual time, so nothing per client outlives its queue
+            del clients[entry.client]
+            self._last_tag.pop((entry.priority_class, entry.client), None)
+    
+    def depth(self):
+        """Count waiting calls of the current class"""
+        return sum(len(queue) for queue in self._queues[self._ticket()[0]].values())
+    
+    def ahead(self):
+        """Count waiting calls that would be served before a new call of the current class"""
+        rank = PRIORITY_CLASSES.index(self._ticket()[0])
+        return sum(len(queue) for priority_class in PRIORITY_CLASSES[:rank + 1]
+                   for queue in self._queues[priority_class].values())
+    
+    def timeout(self, default):
+        """Return how long the current call may wait for a slot"""
+        return self.queue_timeouts.get(self._ticket()[0], default)
+    
+    def record_latency(self, priority_class, seconds):
+        """
+        Record the total handling time of a request
+        
+        Args:
+            priority_class (str): Class the request ran as
+            seconds (float): Request duration
+        """
+        if priority_class in self._latencies:
+            self._latencies[priority_class].record(seconds)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def stats(self):
+        """Return per-class queue depth, dispatch counters, queue wait and request latency"""
+        classes = {}
+        with self._stats_lock:
+            for priority_class in PRIORITY_CLASSES:
+                counters = self._counters[priority_class]
+                wait_p95 = self._waits[priority_class].percentile(95, min_samples=1)
+                latency_p95 = self._latencies[priority_class].percentile(95, min_samples=1)
+                classes[priority_class] = {
+                    'waiting': counters['waiting'],
+                    'queued': counters['queued'],
+                    'dispatched': counters['dispatched'],
+                    'dropped': counters['dropped'],
+                    'avg_wait': round(counters['wait_total'] / counters['dispatched'], 4)
+                    if counters['dispatched'] else None,
+                    'wait_p95': round(wait_p95, 4) if wait_p95 is not None else None,
+                    'latency_p95': round(latency_p95, 4) if latency_p95 is not None else None
+                }
+        return {
+            'default_class': self.default_class,
+            'aging': self.aging,
+            'classes': classes
+        }
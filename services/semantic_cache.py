@@ -0,0 +1,256 @@
+"""Near-duplicate response cache using hashed n-gram vectors and cosine similarity"""
+
+import hashlib
+import re
+import threading
+import time
+import zlib
+
+from util.metrics import SEMANTIC_SIMILARITY
+
+class HashedNgramEmbedder:
+    """
+    Embeds text as a normalized vector of hashed character n-grams and words
+    
+    Case, punctuation and whitespace are ignored, so prompts that differ only in
+    formatting get the same vector and prompts that differ by a word stay close.
+    """
+    
+    def __init__(self, dim=128, ngram=3):
+        """
+        Initialize the embedder
+        
+        Args:
+            dim (int): Vector size (hash buckets)
+            ngram (int): Character n-gram length
+        """
+        import numpy as np
+        
+        self.np = np
+        self.dim = dim
+        self.ngram = ngram
+    
+    @staticmethod
+    def normalize(text):
+        """Lowercase the text and keep only its words, separated by single spaces"""
+        return ' '.join(re.findall(r'\w+', text.lower()))
+    
+    def embed(self, text):
+        """
+        Embed one text
+        
+        Args:
+            text (str): Text to embed
+        
+        Returns:
+            numpy.ndarray: float32 unit vector of length dim (all zeros for text without words)
+        """
+        np = self.np
+        normalized = self.normalize(text)
+        if not normalized:
+            return np.zeros(self.dim, dtype=np.float32)
+        
+        padded = f" {normalized} "
+        features = [padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)]
+        features.extend(normalized.split())
+        hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features),
+                             dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vector = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SemanticCache:
+    """
+    Returns a cached TextResponse for prompts similar enough to one already answered
+    
+    Prompts that are identical after normalization are found with a dict lookup.
+    Other prompts are compared against every entry with one matrix-vector
+    product over a preallocated matrix (100k entries x 128 floats = 50 MB), so
+    there are no per-entry Python loops. Entries expire after a TTL; when the
+    cache is full the least recently used entry is replaced.
+    """
+    
+    def __init__(self, threshold=0.97, capacity=50000, dim=128, ttl=300, endpoints=('simple',)):
+        """
+        Initialize the semantic cache
+        
+        Args:
+            threshold (float): Minimum cosine similarity for a hit (1.0 means identical after normalization)
+            capacity (int): Maximum number of entries
+            dim (int): Embedding size
+            ttl (float): Seconds an entry stays valid
+            endpoints (tuple): Endpoints the cache is used for
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("The semantic cache needs NumPy: pip install numpy")
+        
+        self.np = np
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.endpoints = tuple(endpoints)
+        self.embedder = HashedNgramEmbedder(dim)
+        
+        # Preallocated storage; unused rows are zero vectors and can never match
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._namespaces = np.full(capacity, -1, dtype=np.int64)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._responses = [None] * capacity
+        self._slot_keys = [None] * capacity
+        self._exact = {}  # (namespace id, normalized prompt) -> slot
+        self._size = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_similarity_total = 0.0
+        self._last_similarity = None
+    
+    def applies_to(self, endpoint):
+        """Check whether the cache is used for an endpoint"""
+        return endpoint in self.endpoints
+    
+    @staticmethod
+    def _namespace_id(namespace):
+        """Hash generation settings (model, temperature, ...) to a 64-bit id; nothing is stored per namespace"""
+        digest = hashlib.blake2b(repr(namespace).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little', signed=True)
+    
+    def _best_match(self, vector, scores, namespace_id, now):
+        """
+        Pick the closest live entry in a namespace scoring at least the threshold (caller holds the lock)
+        
+        Args:
+            vector (numpy.ndarray): Query vector
+            scores (numpy.ndarray): Similarities computed without the lock held
+            namespace_id (int): Namespace the entry must belong to
+            now (float): Current monotonic time
+        
+        Returns:
+            tuple: (slot, similarity); slot is None when nothing qualifies
+        """
+        np = self.np
+        candidates = np.flatnonzero(scores >= self.threshold)
+        if len(candidates) == 0:
+            return None, 0.0
+        # Rows may have been replaced since the scan: score the few candidates again
+        rescored = self._vectors[candidates] @ vector
+        live = (rescored >= self.threshold) & (self._namespaces[candidates] == namespace_id) & \
+            (self._expires[candidates] > now)
+        if not live.any():
+            return None, 0.0
+        best = int(np.argmax(np.where(live, rescored, -1.0)))
+        return int(candidates[best]), float(rescored[best])
+    
+    def get(self, prompt, namespace):
+        """
+        Look up a response for a similar prompt
+        
+        Args:
+            prompt (str): Fully formatted prompt
+            namespace (tuple): Generation settings the response must share (model, temperature, ...)
+        
+        Returns:
+            TextResponse: Cached response, or None on a miss
+        """
+        normalized = self.embedder.normalize(prompt)
+        with self._lock:
+            namespace_id = self._namespace_id(namespace)
+            slot = self._exact.get((namespace_id, normalized))
+            if slot is not None and self._expires[slot] > time.monotonic():
+                return self._record_hit(slot, 1.0)
+            size = self._size
+        
+        # Full scan outside the lock (NumPy releases the GIL), so lookups run in parallel
+        vector = self.embedder.embed(normalized)
+        scores = self._vectors[:size] @ vector
+        best_seen = float(scores.max()) if size else 0.0
+        
+        with self._lock:
+            slot, similarity = self._best_match(vector, scores, namespace_id, time.monotonic())
+            if slot is None:
+                self.misses += 1
+                self._last_similarity = best_seen
+                SEMANTIC_SIMILARITY.observe(max(best_seen, 0.0))
+                return None
+            return self._record_hit(slot, similarity)
+    
+    def _record_hit(self, slot, similarity):
+        """Update counters for a hit and return the cached response (caller holds the lock)"""
+        self._last_used[slot] = time.monotonic()
+        self.hits += 1
+        self._hit_similarity_total += similarity
+        self._last_similarity = similarity
+        SEMANTIC_SIMILARITY.observe(similarity)
+        return self._responses[slot]
+    
+    def set(self, prompt, namespace, response):
+        """
+        Store a response
+        
+        Args:
+            prompt (str): Fully formatted prompt
+            namespace (tuple): Generation settings used for the response
+            response (TextResponse): Response to cache
+        """
+        np = self.np
+        normalized = self.embedder.normalize(prompt)
+        if not normalized:
+            return
+        
+        with self._lock:
+            now = time.monotonic()
+            key = (self._namespace_id(namespace), normalized)
+            # A prompt identical after normalization replaces its old entry
+            slot = self._exact.get(key)
+            if slot is None:
+                if self._size < self.capacity:
+                    slot = self._size
+                    self._size += 1
+                else:
+                    # Reuse an expired slot if there is one, otherwise the least recently used
+                    slot = int(np.argmin(np.where(self._expires <= now, -np.inf, self._last_used)))
+                    del self._exact[self._slot_keys[slot]]
+                    self.evictions += 1
+            
+            self._vectors[slot] = self.embedder.embed(normalized)
+            self._namespaces[slot] = key[0]
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._responses[slot] = response
+            self._slot_keys[slot] = key
+            self._exact[key] = slot
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._vectors[:self._size] = 0
+            self._namespaces[:self._size] = -1
+            self._responses = [None] * self.capacity
+            self._slot_keys = [None] * self.capacity
+            self._exact.clear()
+            self._size = 0
+    
+    def stats(self):
+        """Return hit/miss counters and similarity scores"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': self._size,
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'avg_hit_similarity': round(self._hit_similarity_total / self.hits, 4) if self.hits else None,
+                'last_similarity': None if self._last_similarity is None else round(self._last_similarity, 4)
+            }
+    
+    def __len__(self):
+        return self._size
@@ -0,0 +1,121 @@
+"""Request coalescing so identical in-flight generations share one upstream call"""
+
+import asyncio
+import threading
+
+class _Call:
+    """An upstream call in progress that other callers can wait on"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single execution"""
+    
+    def __init__(self):
+        """Initialize an empty set of in-flight calls and the counters"""
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+        self._async_calls = {}  # (event loop, key) -> asyncio.Future
+        
+        self.executions = 0
+        self.coalesced = 0
+    
+    def do(self, key, func):
+        """
+        Run func once for all concurrent callers that use the same key
+        
+        The first caller (the leader) runs func. Callers arriving while it is
+        running block until it finishes and get the same result, or the same
+        exception raised.
+        
+        Args:
+            key: Hashable key identifying identical calls
+            func (callable): Function performing the call
+        
+        Returns:
+            The value returned by func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    async def do_async(self, key, func):
+        """
+        Async version of do() for coroutine functions
+        
+        Calls are coalesced per event loop, since an asyncio future can only
+        be awaited on the loop that created it.
+        
+        Args:
+            key: Hashable key identifying identical calls
+            func (callable): Coroutine function performing the call
+        
+        Returns:
+            The value returned by the coroutine
+        """
+        loop = asyncio.get_running_loop()
+        loop_key = (loop, key)
+        
+        with self._lock:
+            future = self._async_calls.get(loop_key)
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                self._async_calls[loop_key] = future
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            return await asyncio.shield(future)
+        
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark retrieved so an error nobody waited for is not logged as unhandled
+                future.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._async_calls[loop_key]
+    
+    def stats(self):
+        """Return coalescing counters as a dictionary"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls) + len(self._async_calls),
+                'executions': self.executions,
+                'coalesced': self.coalesced
+            }
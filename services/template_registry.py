@@ -0,0 +1,137 @@
+"""Registry of prompt templates, loaded and checked once at startup"""
+
+import json
+import string
+import threading
+
+from util.config import Config
+from exception.generation_exceptions import InvalidInputException
+
+def _quoted_choices(choices):
+    """Format choices as "'a', 'b', or 'c'" for error messages"""
+    quoted = [f"'{choice}'" for choice in choices]
+    if len(quoted) <= 2:
+        return ' or '.join(quoted)
+    return ', '.join(quoted[:-1]) + ', or ' + quoted[-1]
+
+class TemplateRegistry:
+    """Single source of truth for styled and creative prompt templates"""
+    
+    def __init__(self, styled_template, styles, creative_templates):
+        """
+        Initialize and validate the registry
+        
+        Args:
+            styled_template (str): Template with {style} and {topic} placeholders
+            styles (list): Allowed writing styles
+            creative_templates (dict): Content type -> template with a {subject} placeholder
+        
+        Raises:
+            ValueError: If a template uses unexpected placeholders
+        """
+        self._check_fields('styled', styled_template, {'style', 'topic'})
+        for content_type, template in creative_templates.items():
+            self._check_fields(content_type, template, {'subject'})
+        
+        if not styles:
+            raise ValueError("At least one style must be configured")
+        if not creative_templates:
+            raise ValueError("At least one creative content type must be configured")
+        
+        self.styles = tuple(styles)
+        self.content_types = tuple(creative_templates)
+        
+        # Store the bound str.format methods so a request only does a dict lookup and a format call
+        self._format_styled = styled_template.format
+        self._style_set = frozenset(self.styles)
+        self._format_creative = {
+            content_type: template.format for content_type, template in creative_templates.items()
+        }
+        
+        self._style_error = f"Style must be {_quoted_choices(self.styles)}"
+        self._content_type_error = f"Invalid content type. Choose from: {', '.join(self.content_types)}"
+    
+    @staticmethod
+    def _check_fields(name, template, expected):
+        """Make sure a template only uses the expected placeholders"""
+        fields = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+        if fields != expected:
+            raise ValueError(
+                f"Template '{name}' must use placeholders {sorted(expected)}, found {sorted(fields)}"
+            )
+    
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a registry from a parsed template configuration
+        
+        Args:
+            data (dict): {'styled': {'template': ..., 'styles': [...]}, 'creative': {type: template}}
+        
+        Returns:
+            TemplateRegistry: The compiled registry
+        """
+        styled = data['styled']
+        return cls(styled['template'], styled['styles'], data['creative'])
+    
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load a registry from a JSON template file
+        
+        Args:
+            path (str): Path to the JSON file
+        
+        Returns:
+            TemplateRegistry: The compiled registry
+        """
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+    
+    def format_styled(self, topic, style):
+        """
+        Format the styled prompt
+        
+        Args:
+            topic (str): The topic to write about
+            style (str): One of the configured styles
+        
+        Returns:
+            str: The formatted prompt
+        """
+        if not isinstance(style, str) or style not in self._style_set:
+            raise InvalidInputException(self._style_error)
+        return self._format_styled(style=style, topic=topic)
+    
+    def format_creative(self, content_type, subject):
+        """
+        Format a creative prompt
+        
+        Args:
+            content_type (str): One of the configured content types
+            subject (str): Subject matter for the content
+        
+        Returns:
+            str: The formatted prompt
+        """
+        format_prompt = self._format_creative.get(content_type) if isinstance(content_type, str) else None
+        if format_prompt is None:
+            raise InvalidInputException(self._content_type_error)
+        return format_prompt(subject=subject)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_template_registry():
+    """
+    Return the shared registry, loading Config.PROMPT_TEMPLATES_FILE on first use
+    
+    Returns:
+        TemplateRegistry: The shared registry
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry.from_file(Config.PROMPT_TEMPLATES_FILE)
+    return _registry
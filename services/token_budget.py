@@ -0,0 +1,135 @@
+"""Local input token estimation and per-endpoint input budgets"""
+
+import math
+import threading
+
+from util.metrics import INPUT_BUDGET_EVENTS
+from exception.generation_exceptions import InputTooLargeException
+
+# Gemini averages about 4 characters per token for English text; other scripts
+# (CJK, emoji, ...) are closer to one token per character
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """
+    Estimate how many tokens a text uses, without calling the model
+    
+    Args:
+        text (str): Text to measure
+    
+    Returns:
+        int: Estimated token count (never less than the true count by much for typical prompts)
+    """
+    if not text:
+        return 0
+    if text.isascii():
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    non_ascii = len(text.encode('utf-8', 'surrogatepass')) - len(text)
+    # Each non-ASCII character adds 1-3 extra UTF-8 bytes; count it as a whole token
+    wide = min(len(text), math.ceil(non_ascii / 2))
+    return math.ceil((len(text) - wide) / CHARS_PER_TOKEN) + wide
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cut a text so its estimate fits in max_tokens, at a word boundary when possible
+    
+    The same text and budget always give the same result.
+    
+    Args:
+        text (str): Text to cut
+        max_tokens (int): Token budget
+    
+    Returns:
+        str: The longest prefix that fits
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    
+    # Binary search on the prefix length; estimate_tokens() grows with the prefix
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    
+    prefix = text[:low]
+    # Prefer not to cut a word in half, unless that would drop most of the text
+    boundary = max(prefix.rfind(' '), prefix.rfind('\n'))
+    if boundary > len(prefix) // 2:
+        prefix = prefix[:boundary]
+    return prefix.rstrip()
+
+class InputBudget:
+    """
+    Limits the estimated tokens of user input per endpoint
+    
+    With the 'reject' policy an over-budget input raises InputTooLargeException
+    (HTTP 413); with 'truncate' it is cut to fit.
+    """
+    
+    POLICIES = ('reject', 'truncate')
+    
+    def __init__(self, budgets, policy='reject'):
+        """
+        Initialize the budget
+        
+        Args:
+            budgets (dict): Endpoint name -> maximum input tokens (endpoints not listed are unlimited)
+            policy (str): 'reject' or 'truncate'
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown input budget policy '{policy}'. Choose from: {', '.join(self.POLICIES)}")
+        
+        self.budgets = dict(budgets)
+        self.policy = policy
+        self.rejected = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+    
+    def apply(self, endpoint, text, field='prompt'):
+        """
+        Check user input against the endpoint's budget
+        
+        Args:
+            endpoint (str): simple, styled or creative
+            text (str): User-supplied text (prompt, topic or subject)
+            field (str): Field name used in the error message
+        
+        Returns:
+            tuple: (text to use, whether it was truncated)
+        
+        Raises:
+            InputTooLargeException: If the input is over budget and the policy is 'reject'
+        """
+        budget = self.budgets.get(endpoint)
+        if budget is None:
+            return text, False
+        
+        tokens = estimate_tokens(text)
+        if tokens <= budget:
+            return text, False
+        
+        if self.policy == 'reject':
+            with self._lock:
+                self.rejected += 1
+            INPUT_BUDGET_EVENTS.inc(endpoint=endpoint, action='rejected')
+            raise InputTooLargeException(
+                f"The {field} is too long: about {tokens} tokens, the limit is {budget}. Please shorten it."
+            )
+        
+        with self._lock:
+            self.truncated += 1
+        INPUT_BUDGET_EVENTS.inc(endpoint=endpoint, action='truncated')
+        return truncate_to_tokens(text, budget), True
+    
+    def stats(self):
+        """Return the budgets and how often they were enforced"""
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'budgets': dict(self.budgets),
+                'rejected': self.rejected,
+                'truncated': self.truncated
+            }
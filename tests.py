@@ -4,11 +4,53 @@ Tests all endpoints, error handling, and functionality
 """
 
 import pytest
+import asyncio
 import json
 import os
-from unittest.mock import patch, MagicMock
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock, AsyncMock
 from app import create_app
-from model.text_generation import TextResponse
+from api import routes
+from model.text_generation import TextRequest, TextResponse, TextStream
+from services.gemini_service import GeminiService
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticCache
+from services.response_store import PersistentResponseStore
+from services.single_flight import SingleFlight
+from services.job_queue import JobQueue
+from services.job_store import Job, PersistentJobStore
+from services.token_budget import InputBudget, estimate_tokens, truncate_to_tokens
+from services.client_pool import ClientPool
+from services.resilience import ResilientCaller, RetryPolicy, CircuitBreaker
+from services.concurrency_limiter import AdaptiveConcurrencyLimiter
+from services.scheduler import FairScheduler, current_ticket, scheduled_as
+from services.cache_warmer import PopularityTracker, CacheWarmer
+from services.template_registry import TemplateRegistry, get_template_registry
+from util.startup_report import measure_startup, parse_importtime
+from util import metrics
+from util.config import Config
+from util.profiler import StackSampler, RequestProfiles
+from services.fake_llm import FakeChatModel, FakeMessage
+from benchmarks.run import run_scenario, compare, percentile
+from bulk_generate import Checkpoint, retry_paths, run_bulk
+from api.rate_limit import InMemoryBackend, RateLimiter, batch_item_cost, init_rate_limiting, parse_limit
+from api.body_limit import init_body_limit
+from api.priority import resolve_priority
+from flask import Flask
+from exception.generation_exceptions import (InvalidInputException, GenerationException, CircuitOpenException,
+                                             QueueFullException, InputTooLargeException, OverloadedException)
+
+@pytest.fixture(autouse=True)
+def job_store(tmp_path_factory, monkeypatch):
+    """Keep background jobs in a temporary store, never in the repo's data/ directory"""
+    store = PersistentJobStore(str(tmp_path_factory.mktemp('jobs') / 'jobs.sqlite3'))
+    monkeypatch.setattr(routes.job_queue, '_store', store)
+    yield store
+    routes.job_queue.shutdown()  # stop its threads before the store is swapped back
 
 @pytest.fixture
 def client():
@@ -189,6 +231,18 @@ class TestErrorHandling:
                              content_type='application/json')
         
         assert response.status_code == 400
+    
+    @patch('api.routes.gemini_service')
+    def test_boolean_flags_must_be_booleans(self, mock_service, client):
+        """Test that use_cache and stream reject strings like "false" instead of treating them as true"""
+        simple = client.post('/api/generate/simple', json={'prompt': 'Hi', 'use_cache': 'false'})
+        stream = client.post('/api/generate/simple', json={'prompt': 'Hi', 'stream': 'false'})
+        batch = client.post('/api/generate/batch', json={'items': [{'prompt': 'Hi'}], 'use_cache': '0'})
+        jobs = client.post('/api/jobs', json={'prompt': 'Hi', 'use_cache': 'no'})
+        
+        assert [r.status_code for r in (simple, stream, batch, jobs)] == [400, 400, 400, 400]
+        assert 'use_cache must be true or false' in json.loads(simple.data)['error']
+        mock_service.generate_simple_text.assert_not_called()
 
 class TestModelClasses:
     """Test model classes functionality"""
@@ -202,6 +256,2026 @@ class TestModelClasses:
         assert result['content'] == "Test content"
         assert result['model_used'] == "test-model"
         assert 'timestamp' in result
+    
+    def test_text_request_validation(self):
+        """Test TextRequest parameter checks"""
+        assert TextRequest("Hi", 50, 0.2, 'fast').validate(model_tiers=['fast']).max_length == 50
+        
+        with pytest.raises(InvalidInputException):
+            TextRequest("Hi", max_length=0).validate()
+        with pytest.raises(InvalidInputException):
+            TextRequest("Hi", max_length=5000).validate(max_length_limit=2048)
+        with pytest.raises(InvalidInputException):
+            TextRequest("Hi", temperature=1.5).validate()
+        with pytest.raises(InvalidInputException):
+            TextRequest("Hi", temperature="hot").validate()
+        with pytest.raises(InvalidInputException):
+            TextRequest("Hi", model_tier='huge').validate(model_tiers=['fast', 'standard'])
+
+class TestModelTiers:
+    """Test per-request generation parameters and model tier routing"""
+    
+    TIERS = {'fast': 'gemini-fast', 'standard': 'gemini-standard'}
+    
+    def _service(self, **kwargs):
+        return GeminiService("test-api-key", model_tiers=self.TIERS, auto_tiers={'joke': 'fast'},
+                             client_factory=lambda key, model_name: FakeChatModel(latency_ms=0, reply_tokens=40),
+                             **kwargs)
+    
+    def test_one_client_pool_per_tier(self):
+        """Test that every tier gets its own pre-built clients"""
+        service = self._service()
+        
+        assert set(service.pools) == {'fast', 'standard'}
+        assert service.pools['fast'].primary is not service.pools['standard'].primary
+        assert {key['tier'] for key in service.pool_stats()['keys']} == {'fast', 'standard'}
+    
+    def test_jokes_are_routed_to_the_fast_tier(self):
+        """Test automatic routing and that model_used reports the model that answered"""
+        service = self._service()
+        
+        joke = service.generate_creative_content('joke', 'cats', use_cache=False)
+        poem = service.generate_creative_content('poem', 'cats', use_cache=False)
+        chosen = service.generate_creative_content('joke', 'cats', use_cache=False, model_tier='standard')
+        
+        assert joke.model_used == 'gemini-fast'
+        assert poem.model_used == 'gemini-standard'
+        assert chosen.model_used == 'gemini-standard'
+        assert service.pools['fast'].primary.calls == 1
+    
+    def test_request_parameters_are_sent_per_call(self):
+        """Test that max_length and temperature reach the model as generation_config"""
+        service = self._service()
+        client = MagicMock()
+        client.invoke.return_value = MagicMock(content="Short")
+        service.llm = client
+        
+        service.generate_simple_text("Hi", use_cache=False)
+        service.generate_simple_text("Hi", use_cache=False, max_length=20, temperature=0.1)
+        
+        assert client.invoke.call_args_list[0].kwargs == {}
+        assert client.invoke.call_args_list[1].kwargs == {
+            'generation_config': {'temperature': 0.1, 'max_output_tokens': 20}
+        }
+    
+    def test_settings_are_part_of_the_cache_key(self):
+        """Test that a cached answer is only reused for the same parameters"""
+        service = self._service(cache=ResponseCache())
+        
+        short = service.generate_simple_text("Tell me a story", max_length=5)
+        again = service.generate_simple_text("Tell me a story", max_length=5)
+        default = service.generate_simple_text("Tell me a story")
+        
+        assert len(short.content.split()) == 5
+        assert again.content == short.content
+        assert len(default.content.split()) == 40
+        assert service.pools['standard'].primary.calls == 2
+    
+    @patch('api.routes.gemini_service')
+    def test_routes_pass_generation_parameters(self, mock_service, client):
+        """Test that the endpoints forward max_length, temperature and model_tier"""
+        mock_service.generate_simple_text.return_value = TextResponse("Hi", "gemini-fast")
+        
+        response = client.post('/api/generate/simple',
+                               json={'prompt': 'Hi', 'max_length': 50, 'temperature': 0.2, 'model_tier': 'fast'})
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['model_used'] == "gemini-fast"
+        mock_service.generate_simple_text.assert_called_once_with(
+            'Hi', use_cache=True, similar=False, max_length=50, temperature=0.2, model_tier='fast')
+    
+    def test_invalid_parameters_return_400(self):
+        """Test that out-of-range parameters are rejected by the service"""
+        service = self._service()
+        
+        with pytest.raises(InvalidInputException):
+            service.generate_simple_text("Hi", temperature=2)
+        with pytest.raises(InvalidInputException):
+            service.generate_simple_text("Hi", model_tier='unknown')
+
+class TestResponseCache:
+    """Test the LRU + TTL response cache"""
+    
+    def test_cache_hit_and_miss_counters(self):
+        """Test that lookups are counted as hits and misses"""
+        cache = ResponseCache(max_entries=10)
+        key = cache.make_key("Tell a joke", "gemini-2.0-flash", 0.7, 200)
+        
+        assert cache.get(key) is None
+        cache.set(key, TextResponse("A joke"), 'creative')
+        assert cache.get(key).content == "A joke"
+        
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
+    
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the oldest unused entry is evicted when full"""
+        cache = ResponseCache(max_entries=2)
+        keys = [cache.make_key(f"prompt {i}", "m", 0.7, 200) for i in range(3)]
+        cache.set(keys[0], TextResponse("zero"))
+        cache.set(keys[1], TextResponse("one"))
+        cache.get(keys[0])
+        cache.set(keys[2], TextResponse("two"))
+        
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None
+        assert cache.stats()['evictions'] == 1
+    
+    def test_cache_respects_byte_budget(self):
+        """Test that entries are evicted to stay within the byte budget"""
+        cache = ResponseCache(max_entries=100, max_bytes=50)
+        for i in range(5):
+            cache.set(cache.make_key(f"p{i}", "m", 0.7, 200), TextResponse("x" * 20))
+        
+        assert cache.stats()['bytes'] <= 50
+        assert len(cache) == 2
+    
+    def test_cache_entries_expire(self):
+        """Test that entries past their endpoint TTL are not returned"""
+        cache = ResponseCache(ttls={'simple': 0.01, 'creative': 60})
+        key = cache.make_key("prompt", "m", 0.7, 200)
+        cache.set(key, TextResponse("short lived"), 'simple')
+        time.sleep(0.02)
+        
+        assert cache.get(key) is None
+        assert cache.stats()['expirations'] == 1
+    
+    def test_service_serves_repeats_from_cache(self):
+        """Test that GeminiService only calls the model once for a repeated prompt"""
+        service = GeminiService("test-api-key", cache=ResponseCache())
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Why did the cat...")
+        
+        first = service.generate_creative_content('joke', 'cats')
+        second = service.generate_creative_content('joke', 'cats')
+        
+        assert first.content == second.content == "Why did the cat..."
+        assert service.llm.invoke.call_count == 1
+    
+    def test_service_cache_opt_out(self):
+        """Test that use_cache=False always calls the model"""
+        service = GeminiService("test-api-key", cache=ResponseCache())
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Fresh")
+        
+        service.generate_simple_text("Hello")
+        service.generate_simple_text("Hello", use_cache=False)
+        
+        assert service.llm.invoke.call_count == 2
+    
+    def test_cache_stats_endpoint(self, client):
+        """Test the cache statistics endpoint"""
+        response = client.get('/api/cache/stats')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert 'enabled' in data
+
+class TestStreaming:
+    """Test Server-Sent Events streaming mode"""
+    
+    @patch('api.routes.gemini_service')
+    def test_simple_generation_stream(self, mock_service, client):
+        """Test that stream=true returns chunk events and a final done event"""
+        mock_service.stream_simple_text.return_value = TextStream(["Hello", " world"])
+        
+        response = client.post('/api/generate/simple',
+                             json={'prompt': 'Say hello', 'stream': True})
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert body.count('event: chunk') == 2
+        assert 'event: done' in body
+        assert '"content": "Hello world"' in body
+    
+    @patch('api.routes.gemini_service')
+    def test_stream_reports_upstream_error_event(self, mock_service, client):
+        """Test that failures after streaming starts become an error event"""
+        def failing_chunks():
+            yield "Once upon"
+            raise RuntimeError("connection reset")
+        mock_service.stream_creative_content.return_value = TextStream(failing_chunks())
+        
+        response = client.post('/api/generate/creative',
+                             json={'content_type': 'story', 'subject': 'dragons', 'stream': True})
+        
+        body = response.get_data(as_text=True)
+        assert 'event: chunk' in body
+        assert 'event: error' in body
+        assert 'connection reset' in body
+    
+    def test_service_stream_fills_cache(self):
+        """Test that a completed stream is cached for later blocking calls"""
+        service = GeminiService("test-api-key", cache=ResponseCache())
+        service.llm = MagicMock()
+        service.llm.stream.return_value = iter([MagicMock(content="Roses "), MagicMock(content="are red")])
+        
+        stream = service.stream_creative_content('poem', 'flowers')
+        assert list(stream) == ["Roses ", "are red"]
+        assert stream.response.content == "Roses are red"
+        
+        cached = service.generate_creative_content('poem', 'flowers')
+        assert cached.content == "Roses are red"
+        service.llm.invoke.assert_not_called()
+
+class TestBatchGeneration:
+    """Test batch generation endpoint"""
+    
+    @patch('api.routes.gemini_service')
+    def test_batch_generation_mixed_results(self, mock_service, client):
+        """Test that per-item errors are reported without failing the batch"""
+        mock_service.agenerate_batch = AsyncMock(return_value=[
+            TextResponse("Simple answer"),
+            InvalidInputException("Style must be 'formal', 'casual', or 'funny'")
+        ])
+        
+        response = client.post('/api/generate/batch',
+                             json={'items': [{'prompt': 'Hi'}, {'topic': 'cats', 'style': 'weird'}]})
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['succeeded'] == 1
+        assert data['failed'] == 1
+        assert data['results'][0]['response']['content'] == "Simple answer"
+        assert data['results'][1]['status_code'] == 400
+    
+    def test_batch_generation_missing_items(self, client):
+        """Test batch generation without items"""
+        response = client.post('/api/generate/batch', json={})
+        
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert 'Missing required field: items' in data['error']
+    
+    def test_service_batch_preserves_order(self):
+        """Test that GeminiService.generate_batch dispatches every item kind in order"""
+        service = GeminiService("test-api-key")
+        service.llm = MagicMock()
+        service.llm.invoke.side_effect = lambda prompt: MagicMock(content=prompt)
+        
+        results = service.generate_batch([
+            {'prompt': 'first'},
+            {'type': 'styled', 'topic': 'tea', 'style': 'formal'},
+            {'content_type': 'joke', 'subject': 'dogs'},
+            {'subject': ''}
+        ])
+        
+        assert results[0].content == 'first'
+        assert 'formal paragraph about tea' in results[1].content
+        assert 'joke about dogs' in results[2].content
+        assert isinstance(results[3], InvalidInputException)
+    
+    def test_service_async_batch_preserves_order(self):
+        """Test that agenerate_batch runs items through ainvoke and keeps order"""
+        service = GeminiService("test-api-key")
+        service.llm = MagicMock()
+        
+        async def fake_ainvoke(prompt):
+            await asyncio.sleep(0.01 if prompt == 'slow' else 0)
+            return MagicMock(content=prompt)
+        service.llm.ainvoke.side_effect = fake_ainvoke
+        
+        results = asyncio.run(service.agenerate_batch([{'prompt': 'slow'}, {'prompt': 'fast'}, {'prompt': ' '}]))
+        
+        assert [r.content for r in results[:2]] == ['slow', 'fast']
+        assert isinstance(results[2], InvalidInputException)
+        service.llm.invoke.assert_not_called()
+
+class TestSingleFlight:
+    """Test coalescing of identical in-flight requests"""
+    
+    def test_concurrent_duplicates_share_one_call(self):
+        """Test that concurrent identical prompts make a single upstream call"""
+        service = GeminiService("test-api-key", single_flight=SingleFlight())
+        service.llm = MagicMock()
+        release = threading.Event()
+        
+        def slow_invoke(prompt):
+            release.wait(timeout=5)
+            return MagicMock(content="Shared answer")
+        service.llm.invoke.side_effect = slow_invoke
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.generate_simple_text("Hot prompt")))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while service.single_flight.stats()['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert service.llm.invoke.call_count == 1
+        assert [r.content for r in results] == ["Shared answer"] * 5
+        assert service.single_flight.stats() == {'in_flight': 0, 'executions': 1, 'coalesced': 4}
+    
+    def test_errors_propagate_to_every_waiter(self):
+        """Test that the leader's exception is raised in all waiting callers"""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+        
+        def failing_call():
+            started.set()
+            release.wait(timeout=5)
+            raise RuntimeError("upstream down")
+        
+        def caller():
+            try:
+                flight.do('key', failing_call)
+            except RuntimeError as e:
+                errors.append(str(e))
+        
+        leader = threading.Thread(target=caller)
+        leader.start()
+        started.wait(timeout=5)
+        waiter = threading.Thread(target=caller)
+        waiter.start()
+        while flight.stats()['coalesced'] < 1:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        waiter.join()
+        
+        assert errors == ["upstream down", "upstream down"]
+    
+    def test_async_duplicates_share_one_call(self):
+        """Test coalescing in the async serving path"""
+        service = GeminiService("test-api-key", single_flight=SingleFlight())
+        service.llm = MagicMock()
+        
+        async def fake_ainvoke(prompt):
+            await asyncio.sleep(0.01)
+            return MagicMock(content="Async answer")
+        service.llm.ainvoke.side_effect = fake_ainvoke
+        
+        async def run():
+            return await asyncio.gather(*(service.agenerate_creative_content('joke', 'cats') for _ in range(3)))
+        
+        results = asyncio.run(run())
+        
+        assert service.llm.ainvoke.call_count == 1
+        assert all(r.content == "Async answer" for r in results)
+        assert service.single_flight.stats()['coalesced'] == 2
+
+class TestTemplateRegistry:
+    """Test the prompt template registry"""
+    
+    def test_default_registry_matches_builtin_choices(self):
+        """Test that the shipped template file defines the documented styles and content types"""
+        registry = get_template_registry()
+        assert registry.styles == ('formal', 'casual', 'funny')
+        assert registry.content_types == ('poem', 'story', 'joke', 'fact')
+    
+    def test_invalid_choices_raise_invalid_input(self):
+        """Test that unknown styles and content types keep their error messages"""
+        registry = get_template_registry()
+        with pytest.raises(InvalidInputException, match="Style must be 'formal', 'casual', or 'funny'"):
+            registry.format_styled('cats', 'angry')
+        with pytest.raises(InvalidInputException, match="Choose from: poem, story, joke, fact"):
+            registry.format_creative('limerick', 'cats')
+    
+    def test_custom_templates(self):
+        """Test that a registry built from config data formats prompts"""
+        registry = TemplateRegistry.from_dict({
+            'styled': {'template': 'Be {style} about {topic}', 'styles': ['terse']},
+            'creative': {'haiku': 'Haiku on {subject}'}
+        })
+        assert registry.format_styled('rain', 'terse') == 'Be terse about rain'
+        assert registry.format_creative('haiku', 'rain') == 'Haiku on rain'
+    
+    def test_template_with_wrong_placeholder_is_rejected(self):
+        """Test that templates are checked when the registry is built"""
+        with pytest.raises(ValueError):
+            TemplateRegistry.from_dict({
+                'styled': {'template': 'About {subject}', 'styles': ['formal']},
+                'creative': {'poem': 'Poem on {subject}'}
+            })
+    
+    def test_swagger_enums_come_from_registry(self, client):
+        """Test that the documented enums are derived from the registry"""
+        spec = json.loads(client.get('/api/swagger.json').data)
+        styled = spec['definitions']['StyledRequest']['properties']['style']
+        creative = spec['definitions']['CreativeRequest']['properties']['content_type']
+        assert styled['enum'] == list(get_template_registry().styles)
+        assert creative['enum'] == list(get_template_registry().content_types)
+
+class TestLazyStartup:
+    """Test lazy service construction and the startup report"""
+    
+    def test_app_import_does_not_load_langchain(self):
+        """Test that importing and creating the app defers LangChain imports"""
+        report = measure_startup(top=5)
+        assert report['health_status'] == 200
+        assert report['langchain_imported'] is False
+    
+    def test_service_is_created_once_on_first_use(self):
+        """Test that get_gemini_service builds the service lazily and reuses it"""
+        with patch('api.routes.gemini_service', None), \
+             patch('api.routes.GeminiService') as service_class, \
+             patch('api.routes.Config.get_api_key', return_value='test-api-key'):
+            first = routes.get_gemini_service()
+            second = routes.get_gemini_service()
+        
+        assert first is second
+        service_class.assert_called_once()
+    
+    def test_parse_importtime(self):
+        """Test parsing of -X importtime output"""
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        450 |   flask.json\n")
+        assert parse_importtime(stderr) == [('flask.json', 120, 450)]
+
+class TestClientPool:
+    """Test the multi-key client pool"""
+    
+    def test_round_robin_rotates_clients(self):
+        """Test that round-robin selection cycles through all keys"""
+        pool = ClientPool([('key-1', 'a'), ('key-2', 'b')], strategy='round_robin')
+        used = []
+        for _ in range(4):
+            with pool.acquire() as client:
+                used.append(client)
+        
+        assert used == ['a', 'b', 'a', 'b']
+    
+    def test_least_loaded_avoids_busy_client(self):
+        """Test that least-loaded selection skips a key with calls in flight"""
+        pool = ClientPool([('key-1', 'a'), ('key-2', 'b')])
+        with pool.acquire() as first:
+            with pool.acquire() as second:
+                assert {first, second} == {'a', 'b'}
+    
+    def test_quota_error_ejects_key_until_cooldown(self):
+        """Test that a 429 takes a key out of rotation and it returns after the cooldown"""
+        pool = ClientPool([('key-1', 'a'), ('key-2', 'b')], strategy='round_robin', cooldown=0.05)
+        with pytest.raises(RuntimeError):
+            with pool.acquire():
+                raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+        
+        used = set()
+        for _ in range(4):
+            with pool.acquire() as client:
+                used.add(client)
+        assert used == {'b'}
+        
+        stats = {key['key_id']: key for key in pool.stats()['keys']}
+        assert stats['key-1']['quota_errors'] == 1
+        assert stats['key-1']['available'] is False
+        
+        time.sleep(0.06)
+        assert pool.stats()['keys'][0]['available'] is True
+    
+    def test_service_builds_one_client_per_key(self):
+        """Test that GeminiService pools a list of API keys"""
+        service = GeminiService(["test-key-one", "test-key-two", "test-key-three"])
+        assert len(service.pool) == 3
+        assert [key['key_id'] for key in service.pool.stats()['keys']] == ['key-1', 'key-2', 'key-3']
+    
+    def test_key_pool_stats_endpoint(self, client):
+        """Test the key pool statistics endpoint"""
+        response = client.get('/api/keys/stats')
+        assert response.status_code == 200
+        assert 'keys' in json.loads(response.data)
+
+class TestRateLimiting:
+    """Test per-client token-bucket rate limiting"""
+    
+    def test_bucket_allows_burst_then_limits(self):
+        """Test that a bucket allows its burst and reports when to retry"""
+        backend = InMemoryBackend()
+        results = [backend.consume('client', 2, 1.0) for _ in range(3)]
+        
+        assert [allowed for allowed, _ in results] == [True, True, False]
+        assert 0 < results[2][1] <= 1.0
+    
+    def test_bucket_refills_over_time(self):
+        """Test that tokens come back at the refill rate"""
+        backend = InMemoryBackend()
+        backend.consume('client', 1, 100.0)
+        assert backend.consume('client', 1, 100.0)[0] is False
+        time.sleep(0.02)
+        assert backend.consume('client', 1, 100.0)[0] is True
+    
+    def test_parse_limit(self):
+        """Test parsing of burst:per_second limits"""
+        assert parse_limit('60:1') == (60.0, 1.0)
+        with pytest.raises(ValueError):
+            parse_limit('10:0')
+    
+    def _limited_client(self, limits, known_keys=None):
+        app = Flask(__name__)
+        init_rate_limiting(app, RateLimiter(limits, known_keys=known_keys))
+        
+        @app.route('/api/generate/simple', methods=['POST'])
+        def simple():
+            return {'content': 'ok'}
+        
+        @app.route('/api/health')
+        def health():
+            return {'status': 'healthy'}
+        
+        return app.test_client()
+    
+    def test_over_limit_request_gets_429_with_retry_after(self):
+        """Test that the middleware answers 429 with Retry-After"""
+        client = self._limited_client({'simple': (1, 0.5)})
+        assert client.post('/api/generate/simple').status_code == 200
+        
+        response = client.post('/api/generate/simple')
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '2'
+        assert json.loads(response.data)['status_code'] == 429
+    
+    def test_limits_are_per_client_and_per_endpoint(self):
+        """Test that API keys get separate buckets and other routes are not limited"""
+        client = self._limited_client({'simple': (1, 0.01)}, known_keys={'alice', 'bob'})
+        assert client.post('/api/generate/simple', headers={'X-API-Key': 'alice'}).status_code == 200
+        assert client.post('/api/generate/simple', headers={'X-API-Key': 'bob'}).status_code == 200
+        assert client.post('/api/generate/simple', headers={'X-API-Key': 'alice'}).status_code == 429
+        assert client.get('/api/health').status_code == 200
+    
+    def test_batches_are_charged_per_item(self):
+        """Test that a batch takes one token per item from its bucket"""
+        app = Flask(__name__)
+        init_rate_limiting(app, RateLimiter({'batch': (10, 0.01)}), costs={'batch': batch_item_cost})
+        
+        @app.route('/api/generate/batch', methods=['POST'])
+        def batch():
+            return {'results': []}
+        
+        client = app.test_client()
+        assert client.post('/api/generate/batch', json={'items': [{'prompt': 'Hi'}] * 8}).status_code == 200
+        assert client.post('/api/generate/batch', json={'items': [{'prompt': 'Hi'}] * 3}).status_code == 429
+        assert client.post('/api/generate/batch', json={'items': [{'prompt': 'Hi'}] * 2}).status_code == 200
+    
+    def test_unknown_api_keys_share_the_ip_bucket(self):
+        """Test that random API keys do not get fresh buckets"""
+        client = self._limited_client({'simple': (1, 0.01)}, known_keys={'alice'})
+        assert client.post('/api/generate/simple', headers={'X-API-Key': 'random-1'}).status_code == 200
+        assert client.post('/api/generate/simple', headers={'X-API-Key': 'random-2'}).status_code == 429
+        assert client.post('/api/generate/simple').status_code == 429
+        assert client.post('/api/generate/simple', headers={'X-API-Key': 'alice'}).status_code == 200
+
+class TestResilience:
+    """Test retries, circuit breaking and hedging around upstream calls"""
+    
+    def _service(self, **caller_options):
+        caller_options.setdefault('retry', RetryPolicy(max_attempts=3, base_delay=0))
+        service = GeminiService("test-api-key", resilience=ResilientCaller(**caller_options))
+        service.llm = MagicMock()
+        return service
+    
+    def test_transient_errors_are_retried(self):
+        """Test that a 503 is retried and the next attempt's answer is returned"""
+        service = self._service()
+        service.llm.invoke.side_effect = [RuntimeError("503 Service Unavailable"), MagicMock(content="Recovered")]
+        
+        assert service.generate_simple_text("Hello").content == "Recovered"
+        assert service.resilience.retries == 1
+    
+    def test_permanent_errors_are_not_retried(self):
+        """Test that non-transient errors fail immediately"""
+        service = self._service()
+        service.llm.invoke.side_effect = ValueError("400 API key not valid")
+        
+        with pytest.raises(GenerationException):
+            service.generate_simple_text("Hello")
+        assert service.llm.invoke.call_count == 1
+    
+    def test_circuit_opens_and_fails_fast(self):
+        """Test that repeated failures open the circuit and later calls skip the model"""
+        service = self._service(retry=RetryPolicy(max_attempts=1),
+                                breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=60))
+        service.llm.invoke.side_effect = TimeoutError("deadline exceeded")
+        
+        for _ in range(2):
+            with pytest.raises(GenerationException):
+                service.generate_simple_text("Hello")
+        with pytest.raises(CircuitOpenException) as error:
+            service.generate_simple_text("Hello")
+        
+        assert service.llm.invoke.call_count == 2
+        assert error.value.status_code == 503
+        assert service.resilience.breaker.stats()['state'] == 'open'
+    
+    def test_circuit_half_open_trial_closes_it(self):
+        """Test that a successful trial call after the recovery timeout closes the circuit"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01)
+        breaker.record_failure()
+        with pytest.raises(CircuitOpenException):
+            breaker.before_call()
+        
+        time.sleep(0.02)
+        breaker.before_call()
+        breaker.record_success()
+        assert breaker.stats()['state'] == 'closed'
+    
+    def test_stream_closed_during_a_trial_frees_the_breaker(self):
+        """Test that a half-open trial stream closed early does not keep the circuit blocked"""
+        service = self._service(breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=0.01))
+        service.resilience.breaker.record_failure()
+        time.sleep(0.02)
+        service.llm.stream.return_value = iter([MagicMock(content="Roses "), MagicMock(content="are red")])
+        
+        chunks = iter(service.stream_simple_text("Hello", use_cache=False))
+        assert next(chunks) == "Roses "
+        chunks.close()  # the client disconnected
+        
+        service.llm.invoke.return_value = MagicMock(content="Admitted")
+        assert service.generate_simple_text("Hello", use_cache=False).content == "Admitted"
+        assert service.resilience.breaker.stats()['state'] == 'closed'
+    
+    def test_cancelled_async_call_frees_the_breaker(self):
+        """Test that a cancelled trial call leaves the half-open circuit ready for the next one"""
+        caller = ResilientCaller(breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=0.01))
+        caller.breaker.record_failure()
+        time.sleep(0.02)
+        
+        async def cancelled():
+            raise asyncio.CancelledError()
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(caller.acall(cancelled))
+        
+        caller.breaker.before_call()  # admitted as the next trial
+    
+    def test_hedged_request_returns_faster_call(self):
+        """Test that a slow call is hedged and the second call's answer wins"""
+        caller = ResilientCaller(hedge=True, hedge_min_samples=1)
+        caller.latency.record(0.01)
+        calls = []
+        
+        def call():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "slow"
+            return "fast"
+        
+        assert caller.call(call) == "fast"
+        assert caller.hedges_sent == 1
+        assert caller.hedges_won == 1
+    
+    def test_hedged_calls_keep_the_request_context(self):
+        """Test that both hedged calls run with the caller's priority ticket"""
+        caller = ResilientCaller(hedge=True, hedge_min_samples=1)
+        caller.latency.record(0.01)
+        tickets = []
+        
+        def call():
+            tickets.append(current_ticket())
+            if len(tickets) == 1:
+                time.sleep(0.2)
+            return "ok"
+        
+        with scheduled_as('batch', 'client-a'):
+            assert caller.call(call) == "ok"
+        assert tickets == [('batch', 'client-a')] * 2
+    
+    @patch('api.routes.gemini_service')
+    def test_open_circuit_returns_503_with_retry_after(self, mock_service, client):
+        """Test the HTTP response while the circuit is open"""
+        mock_service.generate_simple_text.side_effect = CircuitOpenException(retry_after=12.5)
+        
+        response = client.post('/api/generate/simple', json={'prompt': 'Hello'})
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '13'
+        assert json.loads(response.data)['status_code'] == 503
+
+class TestMetrics:
+    """Test the Prometheus metrics endpoint and stage timings"""
+    
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test histogram exposition format"""
+        histogram = metrics.Histogram('test_seconds', 'Test', ('stage',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage='parse')
+        histogram.observe(0.5, stage='parse')
+        histogram.observe(5, stage='parse')
+        
+        lines = histogram.render()
+        
+        assert 'test_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{stage="parse",le="1.0"} 2' in lines
+        assert 'test_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+        assert 'test_seconds_count{stage="parse"} 3' in lines
+    
+    @patch('api.routes.gemini_service')
+    def test_metrics_endpoint_reports_requests_and_stages(self, mock_service, client):
+        """Test that a generation request shows up in /api/metrics"""
+        mock_service.generate_simple_text.return_value = TextResponse("Hi there")
+        client.post('/api/generate/simple', json={'prompt': 'Hello'})
+        client.post('/api/generate/simple', json={})
+        
+        response = client.get('/api/metrics')
+        body = response.data.decode('utf-8')
+        
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        assert 'http_requests_total{route="simple",method="POST",status="200"}' in body
+        assert 'http_requests_total{route="simple",method="POST",status="400"}' in body
+        assert 'http_requests_in_flight{route="simple"} 0' in body
+        for stage in ('parse', 'validation', 'serialization'):
+            assert f'generation_stage_seconds_count{{route="simple",stage="{stage}"}}' in body
+        assert 'upstream_retries_total' in body
+    
+    def test_requests_refused_before_the_handler_are_counted(self, client):
+        """Test that a 413 from the body limit shows up in the route's request counts"""
+        client.post('/api/generate/styled', data='x' * (Config.MAX_REQUEST_BYTES + 1),
+                    content_type='application/json')
+        
+        body = client.get('/api/metrics').data.decode('utf-8')
+        assert 'http_requests_total{route="styled",method="POST",status="413"}' in body
+    
+    def test_service_records_upstream_stage_and_tokens(self):
+        """Test upstream timing and token counters recorded by the service"""
+        service = GeminiService("test-api-key")
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Generated",
+                                                    usage_metadata={'input_tokens': 3, 'output_tokens': 7})
+        before = metrics.COMPLETION_TOKENS._values.get(('styled',), 0)
+        
+        service.generate_with_template("Python", "formal", use_cache=False)
+        body = metrics.registry.render()
+        
+        assert metrics.COMPLETION_TOKENS._values[('styled',)] == before + 7
+        assert 'generation_stage_seconds_count{route="none",stage="upstream"}' in body
+        assert 'generation_stage_seconds_count{route="none",stage="prompt_format"}' in body
+
+class TestResponseStore:
+    """Test the persistent SQLite response store"""
+    
+    KEY = ResponseCache.make_key("What is AI?", "gemini-2.0-flash", 0.7, 200)
+    
+    def _store(self, tmp_path, **options):
+        return PersistentResponseStore(str(tmp_path / 'responses.sqlite3'), compaction_interval=0, **options)
+    
+    def test_responses_survive_a_restart(self, tmp_path):
+        """Test that a new store on the same file returns the saved response"""
+        response = TextResponse("AI is...")
+        first = self._store(tmp_path)
+        first.set(self.KEY, response, ttl=60)
+        first.close()
+        
+        stored, remaining = self._store(tmp_path).get(self.KEY)
+        
+        assert stored.content == "AI is..."
+        assert stored.timestamp == response.timestamp
+        assert 0 < remaining <= 60
+    
+    def test_expired_responses_are_misses_and_compacted(self, tmp_path):
+        """Test TTL handling and removal of expired rows"""
+        store = self._store(tmp_path)
+        store.set(self.KEY, TextResponse("AI is..."), ttl=-1)
+        
+        assert store.get(self.KEY) == (None, 0)
+        assert store.compact() == {'expired': 1, 'evicted': 0}
+        assert store.stats()['entries'] == 0
+    
+    def test_compaction_evicts_least_recently_used_over_budget(self, tmp_path):
+        """Test the byte budget"""
+        store = self._store(tmp_path, max_bytes=200)
+        for index in range(5):
+            store.set(("model", 0.7, 200, f"prompt {index}"), TextResponse("x" * 50), ttl=60)
+            time.sleep(0.01)
+        
+        store.compact()
+        
+        assert store.stats()['bytes'] <= 200
+        assert store.get(("model", 0.7, 200, "prompt 0"))[0] is None
+        assert store.get(("model", 0.7, 200, "prompt 4"))[0] is not None
+    
+    def test_memory_cache_reads_through_to_shared_store(self, tmp_path):
+        """Test that a second worker's cache is served from the first worker's writes"""
+        worker_one = ResponseCache(store=self._store(tmp_path))
+        worker_two = ResponseCache(store=self._store(tmp_path))
+        worker_one.set(self.KEY, TextResponse("AI is..."), 'simple')
+        
+        assert worker_two.get(self.KEY).content == "AI is..."
+        assert worker_two.get(self.KEY).content == "AI is..."
+        stats = worker_two.stats()
+        assert stats['store_hits'] == 1 and stats['hits'] == 2 and len(worker_two) == 1
+    
+    def test_store_failures_fall_back_to_memory(self):
+        """Test that SQLite errors are counted instead of failing the request"""
+        store = MagicMock()
+        store.get.side_effect = sqlite3.OperationalError("database is locked")
+        store.set.side_effect = sqlite3.OperationalError("database or disk is full")
+        cache = ResponseCache(store=store)
+        
+        assert cache.get(self.KEY) is None
+        cache.set(self.KEY, TextResponse("AI is..."), 'simple')
+        
+        assert cache.get(self.KEY).content == "AI is..."
+        assert cache.stats()['store_errors'] == 2
+    
+    def test_unreadable_store_still_reports_stats(self, tmp_path):
+        """Test that stats degrade instead of failing when the database cannot be read"""
+        store = self._store(tmp_path)
+        store._local.conn = MagicMock()
+        store._local.conn.execute.side_effect = sqlite3.OperationalError("database is locked")
+        
+        stats = store.stats()
+        
+        assert stats['entries'] is None and stats['bytes'] is None and stats['hits'] == 0
+        assert 'path' not in stats
+    
+    def test_workers_take_turns_compacting(self, tmp_path):
+        """Test that only one process sharing the database compacts per interval"""
+        worker_one = PersistentResponseStore(str(tmp_path / 'responses.sqlite3'), compaction_interval=3600)
+        worker_two = PersistentResponseStore(str(tmp_path / 'responses.sqlite3'), compaction_interval=3600)
+        
+        assert worker_one.compact_if_due() is True
+        assert worker_two.compact_if_due() is False
+        assert worker_one.compact_if_due() is False
+        assert worker_one.stats()['compactions'] == 1 and worker_two.stats()['compactions'] == 0
+        worker_one.close()
+        worker_two.close()
+
+class TestSemanticCache:
+    """Test the near-duplicate semantic cache"""
+    
+    SETTINGS = ('gemini-2.0-flash', 0.7, 200)
+    
+    def test_formatting_differences_hit(self):
+        """Test that case, punctuation and whitespace differences are exact hits"""
+        cache = SemanticCache(capacity=10)
+        response = TextResponse("AI is...")
+        cache.set("What is AI?", self.SETTINGS, response)
+        
+        assert cache.get("  what IS   ai ", self.SETTINGS) is response
+        assert cache.stats()['avg_hit_similarity'] == 1.0
+    
+    def test_near_duplicate_hits_and_different_prompt_misses(self):
+        """Test the similarity threshold"""
+        cache = SemanticCache(threshold=0.85, capacity=10)
+        cache.set("Explain Python decorators", self.SETTINGS, TextResponse("Decorators wrap functions"))
+        
+        assert cache.get("Explain python decorators please", self.SETTINGS).content == "Decorators wrap functions"
+        assert cache.get("Explain Python generators", self.SETTINGS) is None
+        stats = cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 1
+        assert 0.85 <= stats['avg_hit_similarity'] < 1.0
+    
+    def test_settings_are_kept_apart(self):
+        """Test that a response is only reused for the same generation settings"""
+        cache = SemanticCache(capacity=10)
+        cache.set("What is AI?", self.SETTINGS, TextResponse("AI is..."))
+        
+        assert cache.get("What is AI?", ('gemini-2.0-flash', 0.2, 200)) is None
+        assert cache.get("What is AI?", ('gemini-2.0-flash', 0.7, 200)).content == "AI is..."
+    
+    def test_namespace_ids_are_hashed_not_stored(self):
+        """Test that client-chosen settings do not grow a per-namespace table"""
+        cache = SemanticCache(capacity=10)
+        for temperature in range(1000):
+            cache.get("What is AI?", ('gemini-2.0-flash', temperature / 1000, 200))
+        
+        assert not any(isinstance(value, dict) and len(value) >= 1000 for value in vars(cache).values())
+        assert SemanticCache._namespace_id(self.SETTINGS) == SemanticCache._namespace_id(tuple(self.SETTINGS))
+        assert SemanticCache._namespace_id(self.SETTINGS) != SemanticCache._namespace_id(('gemini-2.0-flash', 0.2, 200))
+    
+    def test_full_cache_evicts_least_recently_used(self):
+        """Test capacity-bounded eviction"""
+        cache = SemanticCache(capacity=2)
+        cache.set("first prompt about cats", self.SETTINGS, TextResponse("1"))
+        cache.set("second prompt about dogs", self.SETTINGS, TextResponse("2"))
+        cache.get("first prompt about cats", self.SETTINGS)
+        cache.set("third prompt about birds", self.SETTINGS, TextResponse("3"))
+        
+        assert len(cache) == 2
+        assert cache.stats()['evictions'] == 1
+        assert cache.get("second prompt about dogs", self.SETTINGS) is None
+        assert cache.get("first prompt about cats", self.SETTINGS).content == "1"
+    
+    def test_entries_expire(self):
+        """Test that entries stop matching after their TTL"""
+        cache = SemanticCache(capacity=10, ttl=0.05)
+        cache.set("What is AI?", self.SETTINGS, TextResponse("AI is..."))
+        time.sleep(0.1)
+        
+        assert cache.get("What is AI?", self.SETTINGS) is None
+    
+    def test_default_threshold_rejects_small_meaning_changes(self):
+        """Test that a negation in a long prompt is not answered from the cache by default"""
+        cache = SemanticCache(capacity=10)
+        cache.set("Check whether the word racecar is a palindrome and explain the reasoning step by step",
+                  self.SETTINGS, TextResponse("It is"))
+        
+        assert cache.get("Check whether the word racecar is not a palindrome and explain the reasoning step by step",
+                         self.SETTINGS) is None
+        assert cache.stats()['last_similarity'] > 0.95
+    
+    def test_service_uses_semantic_cache_for_simple_prompts_only(self):
+        """Test that the service serves near-duplicate simple prompts without calling the model"""
+        service = GeminiService("test-api-key", semantic_cache=SemanticCache(capacity=10))
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Generated")
+        
+        service.generate_simple_text("What is AI?", similar=True)
+        service.generate_simple_text("what is AI", similar=True)
+        service.generate_with_template("Python", "formal", similar=True)
+        service.generate_with_template("python", "formal", similar=True)
+        
+        assert service.llm.invoke.call_count == 3
+    
+    def test_near_duplicates_are_only_served_when_asked_for(self):
+        """Test that requests without similar=True never get a near-duplicate's answer"""
+        service = GeminiService("test-api-key", semantic_cache=SemanticCache(capacity=10))
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Generated")
+        
+        service.generate_simple_text("What is AI?")
+        service.generate_simple_text("what is AI")
+        assert service.llm.invoke.call_count == 2
+        
+        service.generate_simple_text("WHAT is AI", similar=True)
+        assert service.llm.invoke.call_count == 2
+    
+    def test_semantic_cache_stats_endpoint(self, client):
+        """Test the semantic cache stats endpoint"""
+        response = client.get('/api/cache/semantic/stats')
+        
+        assert response.status_code == 200
+        assert 'enabled' in json.loads(response.data)
+
+class TestFakeModelBenchmark:
+    """Test the fake model backend and the benchmark helpers"""
+    
+    def test_fake_model_is_deterministic(self):
+        """Test that the same seed gives the same latencies and failures"""
+        first = FakeChatModel(latency_ms=10, error_rate=0.3, seed=7)
+        second = FakeChatModel(latency_ms=10, error_rate=0.3, seed=7)
+        
+        assert [first._plan()[:2] for _ in range(20)] == [second._plan()[:2] for _ in range(20)]
+    
+    def test_fake_model_streams_and_reports_usage(self):
+        """Test invoke, stream and token usage"""
+        model = FakeChatModel(latency_ms=0, reply_tokens=5)
+        
+        response = model.invoke("two words")
+        streamed = ''.join(chunk.content for chunk in model.stream("two words"))
+        
+        assert streamed == response.content
+        assert response.usage_metadata == {'input_tokens': 2, 'output_tokens': 5}
+    
+    def test_fake_model_injected_errors_are_retried(self):
+        """Test that injected failures look transient to the resilience layer"""
+        model = FakeChatModel(latency_ms=0, error_rate=1.0)
+        service = GeminiService("test-api-key", client_factory=lambda key, model_name: model,
+                                resilience=ResilientCaller(retry=RetryPolicy(max_attempts=2, base_delay=0)))
+        
+        with pytest.raises(GenerationException):
+            service.generate_simple_text("Hello")
+        assert model.calls == 2
+    
+    def test_run_scenario_reports_latency_percentiles(self):
+        """Test a small benchmark run against the fake backend"""
+        service = GeminiService("test-api-key", client_factory=lambda key, model_name: FakeChatModel(latency_ms=1))
+        app = create_app()
+        
+        with patch('api.routes.gemini_service', service):
+            result = run_scenario(app, '/api/generate/simple', {'prompt': 'Hi', 'use_cache': False},
+                                  concurrency=2, total_requests=10, warmup_requests=1)
+        
+        assert result['requests'] == 10
+        assert result['errors'] == 0
+        assert 0 < result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+    
+    def test_compare_flags_regressions_only(self):
+        """Test baseline comparison in both directions"""
+        baseline = {'simple': {'p95_ms': 10.0, 'cpu_ms_per_request': 1.0, 'rps': 100.0}}
+        
+        assert compare({'simple': {'p95_ms': 5.0, 'cpu_ms_per_request': 1.1, 'rps': 150.0}}, baseline) == []
+        regressions = compare({'simple': {'p95_ms': 20.0, 'cpu_ms_per_request': 1.0, 'rps': 50.0}}, baseline)
+        assert [message.split(':')[0] for message in regressions] == ['simple.p95_ms', 'simple.rps']
+        assert percentile([1, 2, 3, 4], 50) == 2
+
+class TestBulkGeneration:
+    """Test the offline JSONL bulk runner"""
+    
+    def _service(self):
+        service = MagicMock()
+        service.generate_item.side_effect = lambda item, use_cache=True: TextResponse(f"Answer to {item['prompt']}")
+        return service
+    
+    def _write_input(self, tmp_path, count):
+        input_path = tmp_path / 'input.jsonl'
+        input_path.write_text(''.join(json.dumps({'id': f'q{i}', 'prompt': f'Question {i}'}) + '\n'
+                                      for i in range(count)))
+        return str(input_path)
+    
+    def test_checkpoint_low_water_mark(self):
+        """Test that out-of-order completions advance the low-water mark"""
+        checkpoint = Checkpoint('unused', done=[0, 2, 3])
+        
+        assert checkpoint.low_water == 1 and checkpoint.done == {2, 3}
+        checkpoint.mark_done(1)
+        assert checkpoint.low_water == 4 and checkpoint.done == set()
+        assert checkpoint.is_done(3) and not checkpoint.is_done(4)
+    
+    def test_bulk_run_writes_every_result(self, tmp_path):
+        """Test that every line produces one output record with its id"""
+        input_path = self._write_input(tmp_path, 20)
+        output_path = str(tmp_path / 'output.jsonl')
+        
+        summary = run_bulk(self._service(), input_path, output_path, concurrency=4)
+        records = [json.loads(line) for line in open(output_path)]
+        
+        assert summary == {'succeeded': 20, 'failed': 0, 'skipped': 0}
+        assert sorted(record['index'] for record in records) == list(range(20))
+        assert all(record['response']['content'] == f"Answer to Question {record['index']}" for record in records)
+        assert records[0]['id'] == f"q{records[0]['index']}"
+    
+    def test_bulk_run_resumes_without_repeating_work(self, tmp_path):
+        """Test that a second run only generates the items the first one did not finish"""
+        input_path = self._write_input(tmp_path, 10)
+        output_path = str(tmp_path / 'output.jsonl')
+        service = self._service()
+        
+        run_bulk(service, input_path, output_path, concurrency=2, limit=4)
+        summary = run_bulk(service, input_path, output_path, concurrency=2)
+        indexes = [json.loads(line)['index'] for line in open(output_path)]
+        
+        assert summary['skipped'] == 4
+        assert service.generate_item.call_count == 10
+        assert sorted(indexes) == list(range(10))
+    
+    def test_bulk_run_recovers_results_written_after_last_checkpoint(self, tmp_path):
+        """Test that results in the output but not in the checkpoint are not regenerated"""
+        input_path = self._write_input(tmp_path, 3)
+        output_path = tmp_path / 'output.jsonl'
+        output_path.write_text('{"index": 0, "status_code": 200}\n{"index": 2, "status_code": 200}\n{"ind')
+        service = self._service()
+        
+        summary = run_bulk(service, input_path, str(output_path))
+        
+        assert summary['skipped'] == 2
+        assert [call.args[0]['prompt'] for call in service.generate_item.call_args_list] == ['Question 1']
+        assert json.loads(output_path.read_text().splitlines()[-1])['index'] == 1
+    
+    def test_transient_failures_are_retried_on_resume(self, tmp_path):
+        """Test that 429/503 failures are replayed by the next run, while validation errors are final"""
+        input_path = self._write_input(tmp_path, 3)
+        output_path = str(tmp_path / 'output.jsonl')
+        service = self._service()
+        service.generate_item.side_effect = [
+            TextResponse("Answer"), OverloadedException(),
+            InvalidInputException("Prompt too long")
+        ]
+        
+        assert run_bulk(service, input_path, output_path, concurrency=1)['failed'] == 2
+        service.generate_item.side_effect = lambda item, use_cache=True: TextResponse("Retried")
+        summary = run_bulk(service, input_path, output_path, concurrency=1)
+        records = [json.loads(line) for line in open(output_path)]
+        
+        assert summary == {'succeeded': 1, 'failed': 0, 'skipped': 3}
+        assert [(record['index'], record['status_code']) for record in records] == [
+            (0, 200), (1, 503), (2, 400), (1, 200)]
+        assert records[-1]['id'] == 'q1'
+        assert not any(os.path.exists(path) for path in retry_paths(output_path))
+    
+    def test_transient_failures_do_not_hold_back_the_checkpoint(self, tmp_path):
+        """Test that the low-water mark moves past rate-limited lines so the checkpoint stays small"""
+        input_path = self._write_input(tmp_path, 50)
+        output_path = str(tmp_path / 'output.jsonl')
+        service = self._service()
+        def generate(item, use_cache=True):
+            if int(item['prompt'].split()[1]) % 2 == 0:
+                raise OverloadedException()
+            return TextResponse("Answer")
+        service.generate_item.side_effect = generate
+        
+        run_bulk(service, input_path, output_path, concurrency=4)
+        checkpoint = Checkpoint.load(output_path + '.checkpoint')
+        retries = [json.loads(line)['index'] for line in open(retry_paths(output_path)[0])]
+        
+        assert (checkpoint.low_water, checkpoint.done) == (50, set())
+        assert sorted(retries) == list(range(0, 50, 2))
+    
+    def test_invalid_lines_are_reported_not_fatal(self, tmp_path):
+        """Test that malformed lines become error records"""
+        input_path = tmp_path / 'input.jsonl'
+        input_path.write_text('not json\n\n{"prompt": "Hi"}\n')
+        output_path = str(tmp_path / 'output.jsonl')
+        
+        summary = run_bulk(self._service(), str(input_path), output_path)
+        
+        assert summary == {'succeeded': 1, 'failed': 1, 'skipped': 0}
+        assert json.loads(open(output_path).readline())['status_code'] == 400
+
+class TestProductionServer:
+    """Test the production (gunicorn) serving setup"""
+    
+    def test_debug_mode_is_off_by_default(self):
+        """Test that the debugger and reloader are opt-in"""
+        from util.config import Config
+        
+        if 'FLASK_DEBUG' not in os.environ:
+            assert Config.FLASK_DEBUG is False
+        assert Config.SERVER_MODE in ('development', 'production')
+    
+    def test_gunicorn_config_comes_from_settings(self):
+        """Test the gunicorn settings module"""
+        import gunicorn_conf
+        from util.config import Config
+        
+        assert gunicorn_conf.worker_class == 'gthread'
+        assert gunicorn_conf.workers == Config.SERVER_WORKERS
+        assert gunicorn_conf.threads == Config.SERVER_THREADS
+        assert gunicorn_conf.max_requests == Config.SERVER_MAX_REQUESTS
+        assert gunicorn_conf.preload_app == Config.SERVER_PRELOAD
+        assert callable(gunicorn_conf.post_fork) and callable(gunicorn_conf.worker_exit)
+    
+    def test_store_reopens_connections_after_fork(self, tmp_path):
+        """Test that a forked worker does not reuse the master's SQLite connection"""
+        store = PersistentResponseStore(str(tmp_path / 'responses.sqlite3'), compaction_interval=0)
+        master_connection = store._connection()
+        
+        store.after_fork()
+        
+        assert store._connection() is not master_connection
+        store.set(TestResponseStore.KEY, TextResponse("AI is..."), ttl=60)
+        assert store.get(TestResponseStore.KEY)[0].content == "AI is..."
+
+class TestJobQueue:
+    """Test background jobs and the /api/jobs endpoints"""
+    
+    def _wait_for(self, queue, job_id, status):
+        for _ in range(200):
+            job = queue.get(job_id)
+            if job['status'] == status:
+                return job
+            time.sleep(0.01)
+        raise AssertionError(f"Job {job_id} never reached status {status}")
+    
+    def test_job_runs_and_result_expires_after_ttl(self):
+        """Test that a finished job keeps its result for result_ttl seconds"""
+        queue = JobQueue(lambda item, use_cache: TextResponse(f"Answer to {item['prompt']}"),
+                         max_workers=2, result_ttl=0.2)
+        
+        job = queue.submit({'prompt': 'Hi'}, 'simple')
+        assert job['status'] == 'queued' and len(job['job_id']) == 32
+        
+        finished = self._wait_for(queue, job['job_id'], 'succeeded')
+        assert finished['status_code'] == 200
+        assert finished['response']['content'] == "Answer to Hi"
+        
+        time.sleep(0.25)
+        assert queue.get(job['job_id']) is None
+        assert queue.stats()['expired'] == 1
+        queue.shutdown()
+    
+    def test_failed_job_reports_error_and_status_code(self):
+        """Test that a generation error is recorded on the job"""
+        def execute(item, use_cache):
+            raise InvalidInputException("Prompt cannot be empty")
+        queue = JobQueue(execute, max_workers=1)
+        
+        job = queue.submit({'prompt': ''}, 'simple')
+        failed = self._wait_for(queue, job['job_id'], 'failed')
+        
+        assert failed['status_code'] == 400
+        assert failed['error'] == "Prompt cannot be empty"
+        assert failed['response'] is None
+        queue.shutdown()
+    
+    def test_full_queue_rejects_new_jobs(self):
+        """Test that submissions beyond max_queue waiting jobs are rejected"""
+        started = threading.Event()
+        release = threading.Event()
+        def execute(item, use_cache):
+            started.set()
+            release.wait(5)
+            return TextResponse("done")
+        queue = JobQueue(execute, max_workers=1, max_queue=1)
+        
+        running = queue.submit({'prompt': 'one'}, 'simple')
+        assert started.wait(5)
+        queue.submit({'prompt': 'two'}, 'simple')
+        with pytest.raises(QueueFullException) as error:
+            queue.submit({'prompt': 'three'}, 'simple')
+        
+        assert error.value.status_code == 503
+        assert error.value.retry_after > 0
+        stats = queue.stats()
+        assert (stats['queued'], stats['running'], stats['rejected']) == (1, 1, 1)
+        
+        release.set()
+        self._wait_for(queue, running['job_id'], 'succeeded')
+        queue.shutdown()
+    
+    def test_workers_share_jobs_through_the_store(self, tmp_path):
+        """Test that a job accepted by one worker is run by another and can be polled through any"""
+        path = str(tmp_path / 'jobs.sqlite3')
+        # A worker accepted this job and exited before running it
+        accepted = Job({'prompt': 'Hi'}, 'simple', ticket=('interactive', 'client-1'))
+        PersistentJobStore(path).add(accepted)
+        
+        tickets = []
+        def execute(item, use_cache):
+            tickets.append(current_ticket())
+            return TextResponse(f"Answer to {item['prompt']}")
+        other = JobQueue(execute, max_workers=1, store=PersistentJobStore(path), poll_interval=0.01)
+        
+        finished = self._wait_for(other, accepted.job_id, 'succeeded')
+        assert finished['response']['content'] == "Answer to Hi"
+        assert tickets == [('interactive', 'client-1')]
+        assert PersistentJobStore(path).get(accepted.job_id)['status'] == 'succeeded'
+        assert other.stats()['shared'] is True
+        other.shutdown()
+    
+    def test_store_is_opened_on_first_use(self, tmp_path):
+        """Test that a store factory is only called when the queue is used"""
+        path = tmp_path / 'jobs.sqlite3'
+        queue = JobQueue(lambda item, use_cache: TextResponse("done"), store=lambda: PersistentJobStore(str(path)))
+        
+        assert not path.exists()
+        assert queue.stats()['shared'] is True and path.exists()
+        queue.shutdown()
+    
+    def test_jobs_of_a_dead_worker_are_requeued(self, tmp_path):
+        """Test that a job left running by an exited process is queued again"""
+        store = PersistentJobStore(str(tmp_path / 'jobs.sqlite3'))
+        store.add(Job({'prompt': 'Hi'}, 'simple'))
+        with patch('services.job_store.os.getpid', return_value=2 ** 22 + 1):
+            claimed = store.claim()
+        assert store.counts()['running'] == 1
+        
+        with patch('services.job_store.os.kill', side_effect=ProcessLookupError):
+            assert store.recover() == 1
+        
+        assert store.counts() == {'queued': 1, 'running': 0, 'stored': 1}
+        assert store.claim().job_id == claimed.job_id
+    
+    def test_shutdown_leaves_waiting_jobs_in_a_shared_store(self, tmp_path):
+        """Test that jobs not started before shutdown stay queued for other workers"""
+        started = threading.Event()
+        release = threading.Event()
+        def execute(item, use_cache):
+            started.set()
+            release.wait(5)
+            return TextResponse("done")
+        store = PersistentJobStore(str(tmp_path / 'jobs.sqlite3'))
+        queue = JobQueue(execute, max_workers=1, store=store)
+        
+        queue.submit({'prompt': 'one'}, 'simple')
+        assert started.wait(5)
+        waiting = queue.submit({'prompt': 'two'}, 'simple')
+        queue.shutdown(wait=False)
+        release.set()
+        
+        assert store.get(waiting['job_id'])['status'] == 'queued'
+    
+    @patch('api.routes.gemini_service')
+    def test_submit_and_poll_job(self, mock_service, client):
+        """Test POST /api/jobs followed by GET on the returned location"""
+        mock_service.generate_item.return_value = TextResponse("Background answer")
+        
+        response = client.post('/api/jobs', json={'topic': 'cats', 'style': 'funny', 'use_cache': False})
+        
+        assert response.status_code == 202
+        data = json.loads(response.data)
+        assert data['kind'] == 'styled'
+        assert response.headers['Location'] == f"/api/jobs/{data['job_id']}"
+        
+        for _ in range(200):
+            status = json.loads(client.get(response.headers['Location']).data)
+            if status['status'] == 'succeeded':
+                break
+            time.sleep(0.01)
+        assert status['response']['content'] == "Background answer"
+        mock_service.generate_item.assert_called_once_with({'topic': 'cats', 'style': 'funny'}, use_cache=False)
+    
+    def test_submit_job_with_unknown_kind(self, client):
+        """Test that an item of no known kind is rejected up front"""
+        response = client.post('/api/jobs', json={'question': 'Hi'})
+        
+        assert response.status_code == 400
+    
+    @patch('api.routes.gemini_service')
+    def test_full_queue_returns_503_with_retry_after(self, mock_service, client):
+        """Test the HTTP response when the job queue is full"""
+        with patch.object(routes.job_queue, 'submit', side_effect=QueueFullException(retry_after=2.5)):
+            response = client.post('/api/jobs', json={'prompt': 'Hi'})
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '3'
+    
+    def test_unknown_job_returns_404(self, client):
+        """Test polling a job id that does not exist"""
+        response = client.get('/api/jobs/does-not-exist')
+        
+        assert response.status_code == 404
+        assert json.loads(response.data)['status_code'] == 404
+
+class TestInputLimits:
+    """Test the request body cap, token estimation and input budgets"""
+    
+    def test_estimate_tokens(self):
+        """Test the local token estimate for ASCII and wide characters"""
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("abcd" * 10) == 10
+        assert estimate_tokens("abcde") == 2
+        assert estimate_tokens("你好世界") == 4
+    
+    def test_truncation_is_deterministic_and_fits(self):
+        """Test that truncation cuts at a word boundary within the budget"""
+        text = "The quick brown fox jumps over the lazy dog. " * 50
+        
+        first = truncate_to_tokens(text, 20)
+        
+        assert first == truncate_to_tokens(text, 20)
+        assert estimate_tokens(first) <= 20
+        assert text.startswith(first)
+        assert text[len(first)] == ' '
+        assert truncate_to_tokens("short", 20) == "short"
+    
+    def test_budget_rejects_or_truncates(self):
+        """Test both over-budget policies"""
+        long_prompt = "word " * 100
+        
+        with pytest.raises(InputTooLargeException) as error:
+            InputBudget({'simple': 10}, policy='reject').apply('simple', long_prompt)
+        assert error.value.status_code == 413
+        
+        budget = InputBudget({'simple': 10}, policy='truncate')
+        text, truncated = budget.apply('simple', long_prompt)
+        assert truncated and estimate_tokens(text) <= 10
+        assert budget.apply('styled', long_prompt) == (long_prompt, False)
+        assert budget.stats()['truncated'] == 1
+    
+    def test_service_truncates_and_reports_input_tokens(self):
+        """Test that the model gets the truncated prompt and the response says so"""
+        service = GeminiService("test-api-key", input_budget=InputBudget({'simple': 10}, policy='truncate'))
+        service.llm = MagicMock()
+        service.llm.invoke.side_effect = lambda prompt: MagicMock(content=f"Echo {len(prompt)}")
+        
+        response = service.generate_simple_text("word " * 100, use_cache=False)
+        short = service.generate_simple_text("Hi there", use_cache=False)
+        
+        sent = service.llm.invoke.call_args_list[0].args[0]
+        assert estimate_tokens(sent) <= 10
+        assert response.truncated is True and response.input_tokens == estimate_tokens(sent)
+        assert short.truncated is False and short.to_dict()['input_tokens'] == 2
+    
+    def test_cached_response_is_not_modified_by_other_requests(self):
+        """Test that input metadata is added to a copy of the cached response"""
+        service = GeminiService("test-api-key", cache=ResponseCache())
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Answer")
+        
+        first = service.generate_simple_text("Hello")
+        second = service.generate_simple_text("Hello")
+        
+        assert first is not second
+        assert first.input_tokens == second.input_tokens == 2
+        assert service.llm.invoke.call_count == 1
+    
+    def test_oversized_body_is_rejected_before_parsing(self):
+        """Test the 413 response for a body over the byte limit"""
+        app = Flask(__name__)
+        init_body_limit(app, 100)
+        parsed = []
+        
+        @app.route('/echo', methods=['POST'])
+        def echo():
+            parsed.append(True)
+            return {'ok': True}
+        
+        test_client = app.test_client()
+        assert test_client.post('/echo', json={'prompt': 'Hi'}).status_code == 200
+        
+        response = test_client.post('/echo', json={'prompt': 'x' * 500})
+        assert response.status_code == 413
+        assert json.loads(response.data)['status_code'] == 413
+        assert len(parsed) == 1
+    
+    @patch('api.routes.gemini_service')
+    def test_over_budget_prompt_returns_413(self, mock_service, client):
+        """Test the HTTP response when the input is over its token budget"""
+        mock_service.generate_simple_text.side_effect = InputTooLargeException("The prompt is too long")
+        
+        response = client.post('/api/generate/simple', json={'prompt': 'Hello'})
+        
+        assert response.status_code == 413
+        assert json.loads(response.data)['error'] == "The prompt is too long"
+
+class TestRequestTracing:
+    """Test Server-Timing, request IDs and the debug timing field"""
+    
+    @patch('api.routes.gemini_service')
+    def test_server_timing_and_request_id_headers(self, mock_service, client):
+        """Test that generate responses carry their phase breakdown"""
+        mock_service.generate_simple_text.return_value = TextResponse("Hello")
+        
+        response = client.post('/api/generate/simple', json={'prompt': 'Hi'})
+        
+        assert response.status_code == 200
+        assert len(response.headers['X-Request-ID']) == 32
+        phases = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+        assert phases[:2] == ['parse', 'validation']
+        assert 'serialization' in phases and phases[-1] == 'total'
+        assert 'debug' not in json.loads(response.data)
+    
+    @patch('api.routes.gemini_service')
+    def test_request_id_is_echoed_and_debug_field_on_request(self, mock_service, client):
+        """Test X-Request-ID reuse, rejection of unsafe ids and the debug field"""
+        mock_service.generate_simple_text.return_value = TextResponse("Hello")
+        
+        response = client.post('/api/generate/simple', json={'prompt': 'Hi'},
+                               headers={'X-Request-ID': 'req-42', 'X-Debug-Timing': 'true'})
+        unsafe = client.post('/api/generate/simple', json={'prompt': 'Hi'},
+                             headers={'X-Request-ID': 'bad id <script>'})
+        
+        assert response.headers['X-Request-ID'] == 'req-42'
+        debug = json.loads(response.data)['debug']
+        assert debug['request_id'] == 'req-42'
+        assert set(debug['phases_ms']) >= {'parse', 'validation', 'serialization'}
+        assert unsafe.headers['X-Request-ID'] != 'bad id <script>'
+    
+    @patch('api.routes.gemini_service')
+    def test_sampling_can_turn_server_timing_off(self, mock_service, client):
+        """Test TRACE_SAMPLE_RATE=0 keeps the request id but drops Server-Timing"""
+        mock_service.generate_simple_text.return_value = TextResponse("Hello")
+        
+        with patch.object(Config, 'TRACE_SAMPLE_RATE', 0.0):
+            response = client.post('/api/generate/simple', json={'prompt': 'Hi'})
+        
+        assert 'Server-Timing' not in response.headers
+        assert 'X-Request-ID' in response.headers
+    
+    def test_service_phases_are_added_to_the_trace(self):
+        """Test that cache lookup, template formatting and upstream time reach the trace"""
+        service = GeminiService("test-api-key", cache=ResponseCache())
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Meow")
+        trace = metrics.RequestTrace('test')
+        
+        token = metrics._current_trace.set(trace)
+        try:
+            service.generate_creative_content('joke', 'cats')
+        finally:
+            metrics._current_trace.reset(token)
+        
+        assert set(trace.phases) == {'prompt_format', 'cache_lookup', 'upstream'}
+        assert trace.server_timing().startswith('prompt_format;dur=')
+
+class TestConcurrencyLimiter:
+    """Test the adaptive upstream concurrency limiter and load shedding"""
+    
+    def test_waiting_call_gets_the_released_slot(self):
+        """Test that a call over the limit waits and runs once a slot frees up"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, queue_timeout=1.0)
+        limiter.acquire()
+        acquired = threading.Event()
+        
+        def waiter():
+            limiter.acquire()
+            acquired.set()
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        assert not acquired.is_set() and limiter.stats()['queue_depth'] == 1
+        
+        limiter.release()
+        thread.join(1)
+        assert acquired.is_set()
+        assert limiter.stats()['in_flight'] == 1 and limiter.stats()['queued'] == 1
+    
+    def test_full_queue_and_deadline_shed_with_503(self):
+        """Test that calls are shed when the queue is full or their wait passes the deadline"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_queue=0, queue_timeout=0.05)
+        limiter.acquire()
+        with pytest.raises(OverloadedException) as error:
+            limiter.acquire()
+        assert error.value.status_code == 503
+        
+        limiter.max_queue = 1
+        start = time.monotonic()
+        with pytest.raises(OverloadedException):
+            limiter.acquire()
+        assert time.monotonic() - start >= 0.05
+        
+        stats = limiter.stats()
+        assert (stats['shed_queue_full'], stats['shed_deadline'], stats['shed']) == (1, 1, 2)
+        assert stats['queue_depth'] == 0
+    
+    def test_expected_wait_over_deadline_is_shed_immediately(self):
+        """Test that a call is rejected up front when the queue would take too long to drain"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1, queue_timeout=0.5)
+        limiter.acquire()
+        limiter.release(latency=2.0)
+        limiter.acquire()
+        
+        start = time.monotonic()
+        with pytest.raises(OverloadedException) as error:
+            limiter.acquire()
+        assert time.monotonic() - start < 0.1
+        assert error.value.retry_after == pytest.approx(2.0)
+    
+    def test_limit_grows_when_fast_and_shrinks_when_slow(self):
+        """Test additive increase on fast calls and multiplicative decrease on slow ones"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, min_limit=1, backoff=0.5)
+        for _ in range(20):
+            for _ in range(4):
+                limiter.acquire()
+            for _ in range(4):
+                limiter.release(latency=0.01)
+        grown = limiter.stats()['limit']
+        assert grown > 4
+        
+        limiter.acquire()
+        limiter.release(latency=1.0)
+        assert limiter.stats()['limit'] == int(grown * 0.5)
+        assert limiter.stats()['decreases'] == 1
+    
+    def test_transient_errors_shrink_the_limit(self):
+        """Test that a timeout inside a slot counts as congestion and the slot is released"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, backoff=0.5)
+        with pytest.raises(TimeoutError):
+            with limiter.slot():
+                raise TimeoutError("deadline exceeded")
+        
+        assert limiter.stats()['limit'] == 5
+        assert limiter.stats()['in_flight'] == 0
+    
+    def test_async_waiter_gets_the_released_slot(self):
+        """Test that an asyncio caller waits without blocking the event loop"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, queue_timeout=1.0)
+        
+        async def scenario():
+            order = []
+            
+            async def call(name):
+                async with limiter.aslot():
+                    order.append(name)
+                    await asyncio.sleep(0.02)
+            await asyncio.gather(call('first'), call('second'))
+            return order
+        
+        assert asyncio.run(scenario()) == ['first', 'second']
+        assert limiter.stats()['in_flight'] == 0
+    
+    def test_service_calls_go_through_the_limiter(self):
+        """Test that GeminiService holds a slot for each upstream call and sheds when overloaded"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1, max_queue=0)
+        service = GeminiService("test-api-key", limiter=limiter)
+        service.llm = MagicMock()
+        service.llm.invoke.return_value = MagicMock(content="Hello")
+        
+        assert service.generate_simple_text("Hi").content == "Hello"
+        assert limiter.stats()['accepted'] == 1
+        
+        limiter.acquire()
+        with pytest.raises(OverloadedException):
+            service.generate_simple_text("Hi again")
+        assert service.llm.invoke.call_count == 1
+    
+    @patch('api.routes.gemini_service')
+    def test_overloaded_returns_503_with_retry_after(self, mock_service, client):
+        """Test the HTTP response for a shed request and the stats endpoint"""
+        mock_service.generate_simple_text.side_effect = OverloadedException(retry_after=1.5)
+        
+        response = client.post('/api/generate/simple', json={'prompt': 'Hello'})
+        stats = client.get('/api/concurrency/stats')
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '2'
+        assert stats.status_code == 200
+        assert {'limit', 'queue_depth', 'shed'} <= set(json.loads(stats.data))
+
+class TestPriorityScheduler:
+    """Test priority classes, fair sharing between clients and starvation protection"""
+    
+    def _queue(self, scheduler, priority_class, client, name):
+        with scheduled_as(priority_class, client):
+            scheduler.append(name)
+    
+    def _drain(self, scheduler):
+        return [scheduler.popleft() for _ in range(len(scheduler))]
+    
+    def test_higher_classes_go_first(self):
+        """Test that interactive calls are served before batch and background ones"""
+        scheduler = FairScheduler()
+        self._queue(scheduler, 'background', 'a', 'bg')
+        self._queue(scheduler, 'batch', 'a', 'batch')
+        self._queue(scheduler, 'interactive', 'b', 'ui')
+        
+        assert self._drain(scheduler) == ['ui', 'batch', 'bg']
+    
+    def test_clients_take_turns_within_a_class(self):
+        """Test weighted fair queuing: a client with a backlog does not block another client"""
+        scheduler = FairScheduler(client_weights={'big': 2})
+        for index in range(4):
+            self._queue(scheduler, 'batch', 'bulk', f'bulk-{index}')
+        self._queue(scheduler, 'batch', 'small', 'small-0')
+        self._queue(scheduler, 'batch', 'small', 'small-1')
+        
+        assert self._drain(scheduler) == ['bulk-0', 'small-0', 'bulk-1', 'small-1', 'bulk-2', 'bulk-3']
+        
+        for index in range(4):
+            self._queue(scheduler, 'batch', 'big', f'big-{index}')
+            self._queue(scheduler, 'batch', 'small', f'small-{index}')
+        assert self._drain(scheduler)[:3] == ['big-0', 'big-1', 'small-0']
+    
+    def test_long_waits_are_promoted(self):
+        """Test that a background call that waited long enough overtakes newer batch calls"""
+        scheduler = FairScheduler(aging=0.05)
+        self._queue(scheduler, 'background', 'a', 'old')
+        time.sleep(0.12)
+        self._queue(scheduler, 'batch', 'b', 'new')
+        
+        assert self._drain(scheduler) == ['old', 'new']
+    
+    def test_removed_waiters_are_counted_as_dropped(self):
+        """Test that a waiter that gives up leaves the queue"""
+        scheduler = FairScheduler()
+        self._queue(scheduler, 'batch', 'a', 'first')
+        self._queue(scheduler, 'batch', 'a', 'second')
+        scheduler.remove('first')
+        
+        assert self._drain(scheduler) == ['second']
+        stats = scheduler.stats()['classes']['batch']
+        assert (stats['queued'], stats['dispatched'], stats['dropped'], stats['waiting']) == (2, 1, 1, 0)
+    
+    def test_header_can_only_lower_the_priority(self):
+        """Test X-Priority against the API key and endpoint defaults"""
+        assert resolve_priority('background', None, 'interactive') == 'background'
+        assert resolve_priority('interactive', None, 'batch') == 'batch'
+        assert resolve_priority('interactive', 'batch', 'interactive') == 'batch'
+        assert resolve_priority(None, 'interactive', 'batch') == 'interactive'
+        assert resolve_priority('urgent', None, 'interactive') == 'interactive'
+    
+    def test_limiter_hands_free_slots_to_interactive_first(self):
+        """Test the scheduler inside the concurrency limiter"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1, queue_timeout=1.0)
+        limiter.acquire()
+        order = []
+        
+        def call(priority_class, name):
+            with scheduled_as(priority_class, name):
+                limiter.acquire()
+            order.append(name)
+            limiter.release()
+        threads = [threading.Thread(target=call, args=('batch', 'batch'))]
+        threads[0].start()
+        time.sleep(0.05)
+        threads.append(threading.Thread(target=call, args=('interactive', 'ui')))
+        threads[1].start()
+        time.sleep(0.05)
+        
+        limiter.release()
+        for thread in threads:
+            thread.join(1)
+        assert order == ['ui', 'batch']
+    
+    def test_sync_batch_items_keep_the_priority(self):
+        """Test that generate_batch() worker threads run as the caller's priority class"""
+        service = GeminiService("test-api-key")
+        seen = []
+        service.generate_item = lambda item, use_cache=True: seen.append(current_ticket())
+        
+        with scheduled_as('batch', 'client-1'):
+            service.generate_batch([{'prompt': 'a'}, {'prompt': 'b'}], max_workers=2)
+        
+        assert seen == [('batch', 'client-1')] * 2
+    
+    @patch('api.routes.gemini_service')
+    def test_requests_run_as_their_priority_class(self, mock_service, client):
+        """Test that the X-Priority header reaches the service and per-class latency is recorded"""
+        seen = []
+        
+        def generate(*args, **kwargs):
+            seen.append(current_ticket())
+            return TextResponse("Hello")
+        mock_service.generate_simple_text.side_effect = generate
+        
+        response = client.post('/api/generate/simple', json={'prompt': 'Hi'}, headers={'X-Priority': 'batch'})
+        stats = json.loads(client.get('/api/scheduler/stats').data)
+        
+        assert response.status_code == 200
+        assert seen[0][0] == 'batch' and seen[0][1].startswith('ip:')
+        assert current_ticket() is None
+        batch = next(entry for entry in stats['classes'] if entry['name'] == 'batch')
+        assert batch['latency_p95'] is not None
+
+class TestProfiling:
+    """Test the admin sampling profiler and per-request profiling"""
+    
+    def test_sampler_records_busy_threads_and_skips_idle_ones(self):
+        """Test that collapsed stacks contain a busy function but not a thread parked on an Event"""
+        stop = threading.Event()
+        
+        def busy_loop_for_profiler():
+            while not stop.is_set():
+                sum(range(1000))
+        busy = threading.Thread(target=busy_loop_for_profiler, name='busy-1')
+        idle = threading.Thread(target=stop.wait, name='idle-1')
+        busy.start()
+        idle.start()
+        try:
+            sampler = StackSampler(interval=0.005).run(0.2)
+        finally:
+            stop.set()
+            busy.join()
+            idle.join()
+        
+        collapsed = sampler.collapsed()
+        assert sampler.samples > 5
+        assert 'busy;' in collapsed and 'busy_loop_for_profiler' in collapsed
+        assert not any(line.startswith('idle;') for line in collapsed.splitlines())
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in collapsed.splitlines())
+    
+    def test_request_profiles_keep_the_most_recent(self):
+        """Test the bounded per-request profile store and its formats"""
+        profiles = RequestProfiles(max_entries=2)
+        ids = []
+        for _ in range(3):
+            profiler = profiles.start()
+            sum(range(100))
+            ids.append(profiles.finish(profiler))
+        
+        assert profiles.get(ids[0]) is None
+        content, mimetype = profiles.get(ids[2])
+        assert mimetype == 'text/plain' and 'cumulative' in content
+        assert profiles.get(ids[2], 'prof')[1] == 'application/octet-stream'
+        with pytest.raises(ValueError):
+            profiles.get(ids[2], 'svg')
+    
+    def test_admin_endpoints_need_the_token(self, client):
+        """Test that profiling is hidden without ADMIN_TOKEN and refused with a wrong token"""
+        assert client.post('/api/admin/profile?seconds=0.1').status_code == 404
+        
+        with patch.object(Config, 'ADMIN_TOKEN', 'secret'):
+            wrong = client.post('/api/admin/profile?seconds=0.1', headers={'X-Admin-Token': 'guess'})
+            too_long = client.post('/api/admin/profile?seconds=1000', headers={'X-Admin-Token': 'secret'})
+            response = client.post('/api/admin/profile?seconds=0.1&interval=0.01', headers={'X-Admin-Token': 'secret'})
+        
+        assert wrong.status_code == 403
+        assert too_long.status_code == 400
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert int(response.headers['X-Profile-Samples']) > 0
+    
+    @patch('api.routes.gemini_service')
+    def test_profile_header_profiles_one_request(self, mock_service):
+        """Test X-Profile: true with an admin token, and that it is ignored without one"""
+        mock_service.generate_simple_text.return_value = TextResponse("Hello")
+        with patch.object(Config, 'ADMIN_TOKEN', 'secret'):
+            client = create_app().test_client()
+            profiled = client.post('/api/generate/simple', json={'prompt': 'Hi'},
+                                   headers={'X-Profile': 'true', 'X-Admin-Token': 'secret'})
+            anonymous = client.post('/api/generate/simple', json={'prompt': 'Hi'}, headers={'X-Profile': 'true'})
+            profile = client.get(f"/api/admin/profile/{profiled.headers['X-Profile-ID']}",
+                                 headers={'X-Admin-Token': 'secret'})
+        
+        assert profiled.status_code == 200
+        assert 'X-Profile-ID' not in anonymous.headers
+        assert profile.status_code == 200
+        assert 'dispatch_request' in profile.data.decode()
+
+class TestMultipleCandidates:
+    """Test n / candidate_count: native multi-candidate calls and the concurrent fallback"""
+    
+    class NativeModel(FakeChatModel):
+        """Fake model that also answers generate()/agenerate() with several candidates"""
+        
+        def __init__(self, returned=None, error=None, **kwargs):
+            super().__init__(latency_ms=0, **kwargs)
+            self.returned = returned
+            self.error = error
+            self.configs = []
+        
+        def _result(self, generation_config):
+            self.configs.append(generation_config)
+            if self.error is not None:
+                raise self.error
+            count = generation_config['candidate_count'] if self.returned is None else self.returned
+            messages = [FakeMessage(f"candidate {index}") for index in range(count)]
+            return SimpleNamespace(generations=[[SimpleNamespace(message=message) for message in messages]])
+        
+        def generate(self, messages, generation_config=None, **kwargs):
+            return self._result(generation_config)
+        
+        async def agenerate(self, messages, generation_config=None, **kwargs):
+            return self._result(generation_config)
+    
+    def _service(self, model, **kwargs):
+        return GeminiService("test-api-key", client_factory=lambda key, model_name: model, **kwargs)
+    
+    def test_native_candidates_use_one_upstream_call(self):
+        """Test that a model with native support returns every candidate from a single call"""
+        model = self.NativeModel()
+        service = self._service(model)
+        
+        response = service.generate_simple_text("Hi", n=3, temperature=0.9)
+        
+        assert response.candidates == ['candidate 0', 'candidate 1', 'candidate 2']
+        assert response.content == 'candidate 0'
+        assert model.configs == [{'temperature': 0.9, 'max_output_tokens': 200, 'candidate_count': 3}]
+        assert model.calls == 0
+    
+    def test_fallback_makes_concurrent_calls(self):
+        """Test that backends without generate() get one call per candidate, sync and async"""
+        model = FakeChatModel(latency_ms=0, reply_tokens=3)
+        service = self._service(model)
+        
+        response = service.generate_creative_content('poem', 'cats', use_cache=False, n=3)
+        async_response = asyncio.run(service.agenerate_simple_text("Hi", use_cache=False, n=2))
+        
+        assert len(response.candidates) == 3
+        assert len(async_response.candidates) == 2
+        assert model.calls == 5
+    
+    def test_missing_candidates_are_topped_up(self):
+        """Test that candidates the model did not return come from extra single calls"""
+        model = self.NativeModel(returned=1)
+        service = self._service(model)
+        
+        response = asyncio.run(service.agenerate_simple_text("Hi", n=3))
+        
+        assert response.candidates[0] == 'candidate 0'
+        assert len(response.candidates) == 3
+        assert model.calls == 2
+    
+    def test_rejected_candidate_count_falls_back(self, capsys):
+        """Test that a tier whose model rejects candidate_count is not asked natively again"""
+        model = self.NativeModel(error=ValueError("candidate_count is not supported by this model"))
+        service = self._service(model)
+        
+        first = service.generate_simple_text("Hi", use_cache=False, n=2)
+        second = service.generate_simple_text("Hi", use_cache=False, n=2)
+        
+        assert len(first.candidates) == len(second.candidates) == 2
+        assert len(model.configs) == 1
+        assert model.calls == 4
+        assert 'falling back to concurrent calls' in capsys.readouterr().out
+    
+    def test_candidates_are_validated(self):
+        """Test the range check on n and that streams only take one candidate"""
+        service = self._service(self.NativeModel(), max_candidates=4)
+        
+        for n in (0, 5, '2', True):
+            with pytest.raises(InvalidInputException):
+                service.generate_simple_text("Hi", n=n)
+        with pytest.raises(InvalidInputException):
+            service.stream_simple_text("Hi", n=2)
+        assert GeminiService.item_options({'candidate_count': 2})['n'] == 2
+        assert 'n' not in GeminiService.item_options({'prompt': 'Hi'})
+    
+    def test_candidates_are_cached_per_n(self, tmp_path):
+        """Test that n is part of the cache key and that stored candidates survive a restart"""
+        store = PersistentResponseStore(str(tmp_path / 'responses.sqlite3'), compaction_interval=0)
+        model = self.NativeModel()
+        service = self._service(model, cache=ResponseCache(store=store))
+        
+        several = service.generate_simple_text("Hi", n=2)
+        service.generate_simple_text("Hi", n=2)
+        single = service.generate_simple_text("Hi")
+        restored, _ = store.get(ResponseCache.make_key("Hi", service.model_name, 0.7, 200, 2))
+        
+        assert several.candidates == ['candidate 0', 'candidate 1']
+        assert single.candidates == [single.content]
+        assert len(model.configs) == 1
+        assert model.calls == 1
+        assert restored.candidates == several.candidates
+    
+    @patch('api.routes.gemini_service')
+    def test_routes_return_candidates(self, mock_service, client):
+        """Test that n reaches the service and candidates are returned next to content"""
+        mock_service.generate_with_template.return_value = TextResponse("One", candidates=["One", "Two"])
+        
+        response = client.post('/api/generate/styled', json={'topic': 'AI', 'style': 'formal', 'n': 2})
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert data['content'] == "One"
+        assert data['candidates'] == ["One", "Two"]
+        mock_service.generate_with_template.assert_called_once_with(
+            'AI', 'formal', use_cache=True, similar=False, max_length=None, temperature=None, model_tier=None, n=2)
+
+class TestCacheWarmer:
+    """Test popularity tracking, off-peak warming and snapshots"""
+    
+    def _service(self, popularity=None, cache=None):
+        model = FakeChatModel(latency_ms=0, reply_tokens=5)
+        return GeminiService("test-api-key", cache=cache or ResponseCache(), popularity=popularity,
+                             client_factory=lambda key, model_name: model), model
+    
+    def _warmer(self, service, **options):
+        return CacheWarmer(service.popularity, lambda: service, service.cache, rate=0, **options)
+    
+    def test_popular_items_decay(self):
+        """Test that recent requests outweigh older ones and unset fields are ignored"""
+        tracker = PopularityTracker(half_life=0.05)
+        for _ in range(3):
+            tracker.record({'type': 'creative', 'content_type': 'poem', 'subject': 'cats', 'n': None})
+        time.sleep(0.25)
+        for _ in range(2):
+            tracker.record({'type': 'styled', 'topic': 'AI', 'style': 'formal'})
+        
+        (first, first_score), (second, second_score) = tracker.top(2)
+        
+        assert first == {'type': 'styled', 'topic': 'AI', 'style': 'formal'}
+        assert second == {'type': 'creative', 'content_type': 'poem', 'subject': 'cats'}
+        assert first_score > 1.9 and second_score < 0.5
+    
+    def test_service_records_cacheable_styled_and_creative_requests(self):
+        """Test that only styled/creative requests allowed to use the cache are counted"""
+        service, _ = self._service(PopularityTracker())
+        
+        service.generate_creative_content('poem', 'cats', temperature=0.5)
+        service.generate_creative_content('poem', 'cats', temperature=0.5)
+        service.generate_with_template('AI', 'formal', use_cache=False)
+        service.generate_simple_text('Hi')
+        
+        assert service.popularity.top(5) == [
+            ({'type': 'creative', 'content_type': 'poem', 'subject': 'cats', 'temperature': 0.5}, 2.0)
+        ]
+    
+    def test_warming_fills_the_cache_ahead_of_requests(self):
+        """Test that a pass warms missing answers, skips fresh ones, and requests then hit the cache"""
+        service, model = self._service(PopularityTracker())
+        service.popularity.record({'type': 'creative', 'content_type': 'joke', 'subject': 'dogs'})
+        service.popularity.record({'type': 'styled', 'topic': 'AI', 'style': 'formal'})
+        service.generate_with_template('AI', 'formal')
+        warmer = self._warmer(service, ttl=7200, refresh_ahead=60)
+        
+        first = warmer.run_once()
+        second = warmer.run_once()
+        service.generate_creative_content('joke', 'dogs')
+        key, _ = service.item_cache_key({'type': 'creative', 'content_type': 'joke', 'subject': 'dogs'})
+        
+        assert first == {'warmed': 1, 'fresh': 1, 'failed': 0, 'interrupted': False}
+        assert second['warmed'] == 0 and second['fresh'] == 2
+        assert model.calls == 2
+        assert service.cache.entry(key)[1] > 3600
+        assert service.popularity.top(1)[0][1] == 2.0
+    
+    def test_warming_respects_budget_and_load(self):
+        """Test max_per_run, the busy signal and the off-peak window"""
+        service, model = self._service(PopularityTracker())
+        for subject in ('cats', 'dogs', 'owls'):
+            service.popularity.record({'type': 'creative', 'content_type': 'poem', 'subject': subject})
+        
+        limited = self._warmer(service, max_per_run=1).run_once()
+        busy = self._warmer(service, busy=lambda: True).run_once()
+        night = self._warmer(service, off_peak_hours=(22, 5))
+        
+        assert limited['warmed'] == 1
+        assert busy == {'warmed': 0, 'fresh': 1, 'failed': 0, 'interrupted': True}
+        assert model.calls == 1
+        assert night.is_off_peak(datetime(2024, 1, 1, 23)) and night.is_off_peak(datetime(2024, 1, 1, 4))
+        assert not night.is_off_peak(datetime(2024, 1, 1, 12))
+    
+    def test_snapshot_restores_popularity_and_answers(self, tmp_path):
+        """Test that a new process starts warm from a snapshot without calling the model"""
+        path = str(tmp_path / 'snapshot.json')
+        service, _ = self._service(PopularityTracker())
+        warmed = service.generate_creative_content('poem', 'cats', n=2)
+        assert self._warmer(service).save_snapshot(path) == 1
+        
+        restarted, model = self._service(PopularityTracker())
+        loaded = self._warmer(restarted).load_snapshot(path)
+        response = restarted.generate_creative_content('poem', 'cats', n=2)
+        
+        assert loaded == 1
+        assert model.calls == 0
+        assert response.candidates == warmed.candidates
+        assert restarted.popularity.top(1)[0][0]['subject'] == 'cats'
+    
+    def test_one_worker_warms_and_the_others_follow(self, tmp_path):
+        """Test that only the lock holder warms and the other workers load its snapshot"""
+        path, lock_path = str(tmp_path / 'snapshot.json'), str(tmp_path / 'warmer.lock')
+        service, _ = self._service(PopularityTracker())
+        service.generate_creative_content('poem', 'cats')
+        leader = self._warmer(service, snapshot_path=path, lock_path=lock_path)
+        other, model = self._service(PopularityTracker())
+        follower = self._warmer(other, snapshot_path=path, lock_path=lock_path)
+        
+        assert leader.is_leader() and not follower.is_leader()
+        leader.save_snapshot()
+        follower._follow()
+        
+        assert sorted(os.listdir(tmp_path)) == ['snapshot.json', 'warmer.lock']  # no temporary file left
+        assert other.generate_creative_content('poem', 'cats').content and model.calls == 0
+        assert len(other.popularity) == 1  # the follower's own request, not the leader's scores
+        
+        leader.stop()
+        assert follower.is_leader() and follower.stats()['leader']
+        follower.stop()
+    
+    def test_stats_endpoint_reports_disabled(self, client):
+        """Test the warmer stats endpoint when warming is off"""
+        response = client.get('/api/cache/warmer/stats')
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['enabled'] is False
 
 class TestFileStructure:
     """Test that all required files exist"""
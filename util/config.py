@@ -3,18 +3,220 @@
 import os
 from exception.generation_exceptions import APIKeyException
 
+def _env_bool(name, default):
+    """Read a boolean flag from the environment"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
 class Config:
     """Configuration class for managing API keys and default settings"""
     
-    # Default settings
-    DEFAULT_MAX_LENGTH = 100
-    DEFAULT_TEMPERATURE = 0.7
-    DEFAULT_MODEL = "gemini-2.0-flash"
+    # Default settings (requests override them with max_length and temperature; the model comes
+    # from MODEL_TIERS below)
+    DEFAULT_MAX_LENGTH = int(os.getenv('DEFAULT_MAX_LENGTH', '200'))
+    DEFAULT_TEMPERATURE = float(os.getenv('DEFAULT_TEMPERATURE', '0.7'))
+    
+    # Flask settings (debug mode turns on the reloader and debugger; never use it in production)
+    FLASK_DEBUG = _env_bool('FLASK_DEBUG', False)
+    FLASK_HOST = os.getenv('FLASK_HOST', '127.0.0.1')
+    FLASK_PORT = int(os.getenv('FLASK_PORT', '5000'))
+    
+    # Server mode: 'development' (Flask's built-in server) or 'production' (gunicorn, see gunicorn_conf.py)
+    SERVER_MODE = os.getenv('SERVER_MODE', 'development')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(2 * (os.cpu_count() or 1) + 1)))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # per worker; requests mostly wait on Gemini
+    SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', '5'))
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', '120'))
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '60'))
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', '2000'))  # recycle workers after this many
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', '200'))
+    SERVER_PRELOAD = _env_bool('SERVER_PRELOAD', True)
+    
+    # Build the Gemini service in create_app() instead of on the first generation request
+    WARMUP_ON_START = _env_bool('WARMUP_ON_START', False)
+    
+    # Prompt templates (styles and creative content types are defined here)
+    PROMPT_TEMPLATES_FILE = os.getenv(
+        'PROMPT_TEMPLATES_FILE',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt_templates.json')
+    )
+    
+    # Response cache settings
+    CACHE_ENABLED = _env_bool('CACHE_ENABLED', True)
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+    CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TTL', '300'))
+    CACHE_TTLS = {
+        'simple': int(os.getenv('CACHE_TTL_SIMPLE', '300')),
+        'styled': int(os.getenv('CACHE_TTL_STYLED', '3600')),
+        'creative': int(os.getenv('CACHE_TTL_CREATIVE', '3600'))
+    }
+    
+    # Persistent response store shared by all workers on the host (SQLite, survives restarts)
+    CACHE_STORE_ENABLED = _env_bool('CACHE_STORE_ENABLED', False)
+    CACHE_STORE_PATH = os.getenv(
+        'CACHE_STORE_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'responses.sqlite3')
+    )
+    CACHE_STORE_MAX_BYTES = int(os.getenv('CACHE_STORE_MAX_BYTES', str(512 * 1024 * 1024)))
+    CACHE_STORE_COMPACTION_SECONDS = float(os.getenv('CACHE_STORE_COMPACTION_SECONDS', '300'))
+    
+    # Cache warming: learn the most requested styled/creative items and regenerate their answers in the
+    # off-peak window (CACHE_WARM_OFF_PEAK_HOURS, local 'start-end'; empty means whenever idle), at most
+    # CACHE_WARM_RATE upstream calls per second. Keep CACHE_WARM_TOP_K below CACHE_MAX_ENTRIES.
+    CACHE_WARM_ENABLED = _env_bool('CACHE_WARM_ENABLED', False)
+    CACHE_WARM_TOP_K = int(os.getenv('CACHE_WARM_TOP_K', '500'))
+    CACHE_WARM_TRACKED = int(os.getenv('CACHE_WARM_TRACKED', '20000'))
+    CACHE_WARM_HALF_LIFE = float(os.getenv('CACHE_WARM_HALF_LIFE', '86400'))
+    CACHE_WARM_RATE = float(os.getenv('CACHE_WARM_RATE', '1'))
+    CACHE_WARM_MAX_PER_RUN = int(os.getenv('CACHE_WARM_MAX_PER_RUN', '1000'))
+    CACHE_WARM_TTL = float(os.getenv('CACHE_WARM_TTL', '86400'))
+    CACHE_WARM_REFRESH_AHEAD = float(os.getenv('CACHE_WARM_REFRESH_AHEAD', '3600'))
+    CACHE_WARM_OFF_PEAK_HOURS = tuple(
+        int(hour) for hour in os.getenv('CACHE_WARM_OFF_PEAK_HOURS', '1-6').split('-') if hour
+    ) or None
+    CACHE_WARM_INTERVAL = float(os.getenv('CACHE_WARM_INTERVAL', '300'))
+    # Popular items and their answers are saved here after each pass and loaded at startup ('' to disable)
+    CACHE_WARM_SNAPSHOT_PATH = os.getenv(
+        'CACHE_WARM_SNAPSHOT_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'cache_warm_snapshot.json')
+    )
+    # Only the worker holding a lock on this file warms; the others load its snapshot ('' to warm in every worker)
+    CACHE_WARM_LOCK_PATH = os.getenv(
+        'CACHE_WARM_LOCK_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'cache_warmer.lock')
+    )
+    
+    # Semantic cache: also serve prompts that are near-duplicates of cached ones (off by default; needs NumPy)
+    SEMANTIC_CACHE_ENABLED = _env_bool('SEMANTIC_CACHE_ENABLED', False)
+    # Character n-gram similarity cannot tell "French" from "American Revolution", "five" from "ten"
+    # or "is" from "is not" in a long prompt (such pairs score up to about 0.96), so a hit needs 0.97
+    # and requests opt in with "similar": true. A lower threshold gives more hits and more wrong answers
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.97'))
+    SEMANTIC_CACHE_CAPACITY = int(os.getenv('SEMANTIC_CACHE_CAPACITY', '50000'))
+    SEMANTIC_CACHE_DIM = int(os.getenv('SEMANTIC_CACHE_DIM', '128'))
+    SEMANTIC_CACHE_ENDPOINTS = os.getenv('SEMANTIC_CACHE_ENDPOINTS', 'simple').split(',')
+    
+    # Coalesce identical in-flight requests into one upstream call
+    COALESCE_ENABLED = _env_bool('COALESCE_ENABLED', True)
+    
+    # API key pool settings (GEMINI_API_KEYS holds a comma-separated list of keys)
+    KEY_POOL_STRATEGY = os.getenv('KEY_POOL_STRATEGY', 'least_loaded')
+    KEY_COOLDOWN_SECONDS = float(os.getenv('KEY_COOLDOWN_SECONDS', '60'))
+    
+    # Rate limiting per client (X-API-Key header or IP), as 'burst:requests_per_second'
+    RATE_LIMIT_ENABLED = _env_bool('RATE_LIMIT_ENABLED', True)
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # 'memory' or 'redis'
+    RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    RATE_LIMIT_TRUST_FORWARDED_FOR = _env_bool('RATE_LIMIT_TRUST_FORWARDED_FOR', False)
+    # API keys issued to clients (comma-separated; keys in PRIORITY_API_KEYS and CLIENT_WEIGHTS
+    # count too). Any other X-API-Key is ignored, so random keys cannot dodge the IP's limits
+    CLIENT_API_KEYS = {key for key in os.getenv('CLIENT_API_KEYS', '').split(',') if key}
+    RATE_LIMITS = {
+        'simple': os.getenv('RATE_LIMIT_SIMPLE', '60:1'),
+        'styled': os.getenv('RATE_LIMIT_STYLED', '30:0.5'),
+        'creative': os.getenv('RATE_LIMIT_CREATIVE', '30:0.5'),
+        # Charged per item, so batching gets no more throughput than /simple (keep the burst >= BATCH_MAX_ITEMS)
+        'batch': os.getenv('RATE_LIMIT_BATCH', '60:1'),
+        'jobs': os.getenv('RATE_LIMIT_JOBS', '30:0.5')
+    }
+    
+    # Upstream resilience: retries with jittered backoff, circuit breaker and hedged requests
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '3'))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.25'))
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '4'))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+    CIRCUIT_RECOVERY_SECONDS = float(os.getenv('CIRCUIT_RECOVERY_SECONDS', '30'))
+    HEDGE_ENABLED = _env_bool('HEDGE_ENABLED', False)
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    
+    # Adaptive (AIMD) limit on concurrent upstream calls; calls over the limit wait up to
+    # CONCURRENCY_QUEUE_TIMEOUT seconds in a queue of CONCURRENCY_MAX_QUEUE, then get a 503
+    CONCURRENCY_LIMIT_ENABLED = _env_bool('CONCURRENCY_LIMIT_ENABLED', True)
+    CONCURRENCY_INITIAL_LIMIT = int(os.getenv('CONCURRENCY_INITIAL_LIMIT', '20'))
+    CONCURRENCY_MIN_LIMIT = int(os.getenv('CONCURRENCY_MIN_LIMIT', '2'))
+    CONCURRENCY_MAX_LIMIT = int(os.getenv('CONCURRENCY_MAX_LIMIT', '200'))
+    CONCURRENCY_MAX_QUEUE = int(os.getenv('CONCURRENCY_MAX_QUEUE', '50'))
+    CONCURRENCY_QUEUE_TIMEOUT = float(os.getenv('CONCURRENCY_QUEUE_TIMEOUT', '2'))
+    CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv('CONCURRENCY_LATENCY_TOLERANCE', '2'))
+    CONCURRENCY_BACKOFF = float(os.getenv('CONCURRENCY_BACKOFF', '0.9'))
+    
+    # Priority classes for calls waiting on the limiter: interactive > batch > background.
+    # PRIORITY_API_KEYS ('key:class,...') caps a key's class; X-Priority can only lower it.
+    # Within a class clients share slots fairly (CLIENT_WEIGHTS 'key:weight,...' gives some
+    # keys a bigger share); a call is promoted one class per SCHEDULER_AGING_SECONDS waited
+    PRIORITY_API_KEYS = dict(
+        pair.rsplit(':', 1) for pair in os.getenv('PRIORITY_API_KEYS', '').split(',') if pair
+    )
+    CLIENT_WEIGHTS = {
+        key: float(weight)
+        for key, weight in (pair.rsplit(':', 1) for pair in os.getenv('CLIENT_WEIGHTS', '').split(',') if pair)
+    }
+    SCHEDULER_AGING_SECONDS = float(os.getenv('SCHEDULER_AGING_SECONDS', '5'))
+    SCHEDULER_QUEUE_TIMEOUTS = {
+        'batch': float(os.getenv('SCHEDULER_QUEUE_TIMEOUT_BATCH', '30')),
+        'background': float(os.getenv('SCHEDULER_QUEUE_TIMEOUT_BACKGROUND', '120'))
+    }
+    
+    # Batch generation settings
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+    BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '8'))
+    
+    # Model tiers: requests choose one with "model_tier"; without it the service routes
+    # MODEL_AUTO_TIERS content types (e.g. jokes) to a tier and everything else to DEFAULT_MODEL_TIER
+    MODEL_TIERS = {
+        'fast': os.getenv('MODEL_TIER_FAST', 'gemini-2.0-flash-lite'),
+        'standard': os.getenv('MODEL_TIER_STANDARD', 'gemini-2.0-flash'),
+        'advanced': os.getenv('MODEL_TIER_ADVANCED', 'gemini-2.5-flash')
+    }
+    DEFAULT_MODEL_TIER = os.getenv('DEFAULT_MODEL_TIER', 'standard')
+    MODEL_AUTO_TIERS = dict(
+        pair.split(':') for pair in os.getenv('MODEL_AUTO_TIERS', 'joke:fast,fact:fast').split(',') if pair
+    )
+    MAX_LENGTH_LIMIT = int(os.getenv('MAX_LENGTH_LIMIT', '2048'))
+    # Largest "n" (candidates per request); they come from one upstream call when the model supports it
+    MAX_CANDIDATES = int(os.getenv('MAX_CANDIDATES', '8'))
+    
+    # Input size limits: request bodies over MAX_REQUEST_BYTES get 413 before JSON parsing, and
+    # user text over its endpoint's estimated token budget is rejected (413) or truncated
+    MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', str(1024 * 1024)))
+    INPUT_TOKEN_BUDGETS = {
+        'simple': int(os.getenv('INPUT_TOKEN_BUDGET_SIMPLE', '4000')),
+        'styled': int(os.getenv('INPUT_TOKEN_BUDGET_STYLED', '500')),
+        'creative': int(os.getenv('INPUT_TOKEN_BUDGET_CREATIVE', '500'))
+    }
+    INPUT_BUDGET_POLICY = os.getenv('INPUT_BUDGET_POLICY', 'reject')  # 'reject' or 'truncate'
+    
+    # Per-request tracing: share of requests that get a Server-Timing header (requests sent with
+    # X-Debug-Timing: true are always traced), and the duration above which a trace is logged
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+    TRACE_SLOW_REQUEST_SECONDS = float(os.getenv('TRACE_SLOW_REQUEST_SECONDS', '10'))
+    
+    # Admin endpoints (profiling) need this token in X-Admin-Token; empty disables them
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+    ADMIN_PROFILE_MAX_SECONDS = float(os.getenv('ADMIN_PROFILE_MAX_SECONDS', '60'))
     
-    # Flask settings
-    FLASK_DEBUG = True
-    FLASK_HOST = '127.0.0.1'
-    FLASK_PORT = 5000
+    # Background job settings (POST /api/jobs)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+    JOB_MAX_QUEUE = int(os.getenv('JOB_MAX_QUEUE', '100'))
+    JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '600'))
+    # Jobs are kept in SQLite so every gunicorn worker can run and report them; disable to keep
+    # them in the memory of the worker that accepted them (only sensible with one worker)
+    JOB_STORE_ENABLED = _env_bool('JOB_STORE_ENABLED', True)
+    JOB_STORE_PATH = os.getenv(
+        'JOB_STORE_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'jobs.sqlite3')
+    )
+    
+    # Model backend: 'gemini', or 'fake' for offline load tests and benchmarks (no API key needed)
+    LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+    FAKE_LLM_LATENCY_MS = float(os.getenv('FAKE_LLM_LATENCY_MS', '50'))
+    FAKE_LLM_LATENCY_DISTRIBUTION = os.getenv('FAKE_LLM_LATENCY_DISTRIBUTION', 'lognormal')
+    FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '0'))
+    FAKE_LLM_ERROR_RATE = float(os.getenv('FAKE_LLM_ERROR_RATE', '0'))
     
     @staticmethod
     def get_api_key():
@@ -23,7 +225,7 @@ class Config:
         
         Returns:
             str: The Gemini API key
-            
+        
         Raises:
             APIKeyException: If API key is not found
         """
@@ -42,6 +244,35 @@ class Config:
         
         return api_key
     
+    @staticmethod
+    def get_api_keys():
+        """
+        Get all Gemini API keys to pool
+        
+        Reads the comma-separated GEMINI_API_KEYS variable, falling back to
+        the single GEMINI_API_KEY.
+        
+        Returns:
+            list: The API keys
+        
+        Raises:
+            APIKeyException: If no API key is found
+        """
+        keys = os.getenv('GEMINI_API_KEYS')
+        if not keys:
+            try:
+                from dotenv import load_dotenv
+                load_dotenv()
+                keys = os.getenv('GEMINI_API_KEYS')
+            except ImportError:
+                pass
+        
+        api_keys = [key.strip() for key in (keys or '').split(',') if key.strip()]
+        if not api_keys:
+            api_keys = [Config.get_api_key()]
+        
+        return api_keys
+    
     @staticmethod
     def validate_api_key(api_key):
         """
@@ -49,7 +280,7 @@ class Config:
         
         Args:
             api_key (str): The API key to validate
-            
+        
         Returns:
             bool: True if API key appears valid, False otherwise
         """
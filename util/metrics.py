@@ -0,0 +1,398 @@
+"""Minimal Prometheus-style metrics: counters, gauges, histograms and per-stage timers"""
+
+import contextvars
+import random
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from util.config import Config
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names, values, extra=None):
+    """Render a label set like {route="simple",stage="upstream"}"""
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class _Metric:
+    """Base class holding a metric's name, help text, labels and values"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        return tuple([labels.get(name, '') for name in self.label_names])
+    
+    def render(self):
+        """Return the metric in Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+    
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+class Counter(_Metric):
+    """A value that only goes up"""
+    
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        """Add amount to the counter for the given labels"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that can go up and down"""
+    
+    kind = 'gauge'
+    
+    def inc(self, amount=1, **labels):
+        """Add amount to the gauge for the given labels"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        """Subtract amount from the gauge for the given labels"""
+        self.inc(-amount, **labels)
+    
+    def set(self, value, **labels):
+        """Set the gauge for the given labels"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, **labels):
+        """Record one observation for the given labels"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]  # bucket counts, count, sum
+            index = bisect_left(self.buckets, value)  # first bucket with value <= bound
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+    
+    def _render_value(self, key, state):
+        counts, count, total = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.label_names, key, ('le', repr(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {count}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+        return lines
+
+class MetricsRegistry:
+    """Holds metrics and renders them all for the /api/metrics endpoint"""
+    
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+    
+    def counter(self, name, documentation, labels=()):
+        """Create and register a Counter"""
+        return self._add(Counter(name, documentation, labels))
+    
+    def gauge(self, name, documentation, labels=()):
+        """Create and register a Gauge"""
+        return self._add(Gauge(name, documentation, labels))
+    
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Create and register a Histogram"""
+        return self._add(Histogram(name, documentation, labels, buckets))
+    
+    def register_collector(self, collector):
+        """
+        Register a function called at scrape time
+        
+        Args:
+            collector (callable): Returns a list of (name, type, help, [(labels dict, value)]) tuples
+        """
+        self._collectors.append(collector)
+    
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self):
+        """Return all metrics in Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+# Shared registry and the application metrics
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests by route, method and status code', ('route', 'method', 'status'))
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Total request handling time', ('route',))
+IN_FLIGHT = registry.gauge(
+    'http_requests_in_flight', 'Requests currently being handled', ('route',))
+STAGE_LATENCY = registry.histogram(
+    'generation_stage_seconds',
+    'Time spent per request stage (parse, validation, cache_lookup, prompt_format, upstream, serialization)',
+    ('route', 'stage'))
+PROMPT_CHARS = registry.counter(
+    'generation_prompt_characters_total', 'Characters sent to the model', ('endpoint',))
+COMPLETION_CHARS = registry.counter(
+    'generation_completion_characters_total', 'Characters generated by the model', ('endpoint',))
+PROMPT_TOKENS = registry.counter(
+    'generation_prompt_tokens_total', 'Prompt tokens reported by the model', ('endpoint',))
+COMPLETION_TOKENS = registry.counter(
+    'generation_completion_tokens_total', 'Completion tokens reported by the model', ('endpoint',))
+MODEL_CALLS = registry.counter(
+    'generation_model_calls_total', 'Upstream calls by model tier and model', ('tier', 'model'))
+INPUT_BUDGET_EVENTS = registry.counter(
+    'generation_input_budget_events_total', 'Inputs over their token budget, rejected or truncated',
+    ('endpoint', 'action'))
+SCHEDULER_QUEUE_WAIT = registry.histogram(
+    'scheduler_queue_wait_seconds', 'Time upstream calls waited for a concurrency slot, by priority class',
+    ('priority',))
+PRIORITY_REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_by_priority_seconds', 'Generation request handling time by priority class',
+    ('priority',))
+SEMANTIC_SIMILARITY = registry.histogram(
+    'semantic_cache_similarity', 'Best cosine similarity found per semantic cache lookup', (),
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99, 1.0))
+
+# Route label and trace for stage timings recorded deeper in the call stack (e.g. inside GeminiService)
+_current_route = contextvars.ContextVar('metrics_route', default='none')
+_current_trace = contextvars.ContextVar('metrics_trace', default=None)
+
+class RequestTrace:
+    """Phase durations of one request, reported in the Server-Timing header"""
+    
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.phases = {}  # phase -> seconds (summed when a phase runs more than once)
+        self._start = time.perf_counter()
+    
+    def add(self, phase, seconds):
+        """Add time spent in a phase"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+    
+    def total(self):
+        """Seconds since the request started"""
+        return time.perf_counter() - self._start
+    
+    def server_timing(self):
+        """Format the phases as a Server-Timing header value (durations in milliseconds)"""
+        parts = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.total() * 1000:.2f}")
+        return ', '.join(parts)
+    
+    def to_dict(self):
+        """Phase durations in milliseconds, for the optional debug field"""
+        return {
+            'request_id': self.request_id,
+            'phases_ms': {phase: round(seconds * 1000, 2) for phase, seconds in self.phases.items()},
+            'total_ms': round(self.total() * 1000, 2)
+        }
+
+def _observe_stage(stage, seconds):
+    """Record a stage duration in the histogram and in the current request's trace"""
+    STAGE_LATENCY.observe(seconds, route=_current_route.get(), stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a block of work as one stage of the current request
+    
+    Args:
+        stage (str): Stage name, e.g. 'upstream'
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe_stage(stage, time.perf_counter() - start)
+
+class StageClock:
+    """Records consecutive stages of a handler by marking the end of each one"""
+    
+    def __init__(self):
+        self._last = time.perf_counter()
+    
+    def mark(self, stage):
+        """Record the time since the previous mark as the given stage"""
+        now = time.perf_counter()
+        _observe_stage(stage, now - self._last)
+        self._last = now
+
+def record_generation(endpoint, prompt, content, usage=None):
+    """
+    Count prompt and completion sizes for one upstream call
+    
+    Args:
+        endpoint (str): simple, styled or creative
+        prompt (str): Prompt sent to the model
+        content (str): Generated text
+        usage (dict): Optional token usage with input_tokens / output_tokens
+    """
+    PROMPT_CHARS.inc(len(prompt), endpoint=endpoint)
+    COMPLETION_CHARS.inc(len(content or ''), endpoint=endpoint)
+    if isinstance(usage, dict):
+        PROMPT_TOKENS.inc(usage.get('input_tokens', 0), endpoint=endpoint)
+        COMPLETION_TOKENS.inc(usage.get('output_tokens', 0), endpoint=endpoint)
+
+def _status_of(result):
+    """Extract the HTTP status code from a view's return value"""
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1]
+    return getattr(result, 'status_code', 200)
+
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+def _request_id(incoming):
+    """Reuse the caller's X-Request-ID if it is safe to echo, otherwise make a new one"""
+    if incoming and _REQUEST_ID_PATTERN.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+def _with_headers(result, headers, debug=None):
+    """Add headers (and optionally a debug field) to a view's return value"""
+    if hasattr(result, 'headers'):
+        # Already a Response (e.g. a stream): the body has been built, only headers can change
+        result.headers.update(headers)
+        return result
+    
+    if isinstance(result, tuple):
+        body, status = result[0], result[1]
+        headers = dict(result[2], **headers) if len(result) > 2 else headers
+    else:
+        body, status = result, 200
+    if debug is not None and isinstance(body, dict):
+        body = dict(body, debug=debug)
+    return body, status, headers
+
+def track_request(route):
+    """
+    Decorator recording latency and in-flight gauge for a route handler
+    
+    Request counts by status are recorded by init_request_metrics(), once the
+    final response is known. Every response gets an X-Request-ID header. Sampled requests (TRACE_SAMPLE_RATE)
+    also get a Server-Timing header with their phase durations, and requests
+    sent with ``X-Debug-Timing: true`` get the same durations in a ``debug`` field.
+    
+    Args:
+        route (str): Route label, e.g. 'simple'
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            from flask import g, request
+            
+            request_id = _request_id(request.headers.get('X-Request-ID'))
+            debug = request.headers.get('X-Debug-Timing', '').lower() in ('1', 'true', 'yes')
+            trace = None
+            if debug or random.random() < Config.TRACE_SAMPLE_RATE:
+                trace = RequestTrace(request_id)
+            
+            g.metrics_route = route
+            token = _current_route.set(route)
+            trace_token = _current_trace.set(trace)
+            IN_FLIGHT.inc(route=route)
+            start = time.perf_counter()
+            status = 500
+            try:
+                result = func(*args, **kwargs)
+                status = _status_of(result)
+                headers = {'X-Request-ID': request_id}
+                if trace is None:
+                    return _with_headers(result, headers)
+                
+                headers['Server-Timing'] = trace.server_timing()
+                slow_after = Config.TRACE_SLOW_REQUEST_SECONDS
+                if slow_after and trace.total() >= slow_after:
+                    print(f"Slow request {request_id} on {route} ({status}): {headers['Server-Timing']}")
+                return _with_headers(result, headers, trace.to_dict() if debug else None)
+            finally:
+                REQUEST_LATENCY.observe(time.perf_counter() - start, route=route)
+                IN_FLIGHT.dec(route=route)
+                _current_trace.reset(trace_token)
+                _current_route.reset(token)
+        wrapper.metrics_route = route
+        return wrapper
+    return decorator
+
+def _tracked_route(app):
+    """Route label of the tracked handler the current request is routed to, or None"""
+    from flask import request
+    
+    view = app.view_functions.get(request.endpoint)
+    handler = getattr(getattr(view, 'view_class', None), request.method.lower(), None)
+    return getattr(handler, 'metrics_route', None)
+
+def init_request_metrics(app):
+    """
+    Count requests to tracked routes by method and final status code
+    
+    Counting after the response is built includes responses that never reach
+    the handler, such as a 429 from rate limiting or a 413 from the body limit.
+    
+    Args:
+        app (Flask): The application
+    """
+    from flask import g, request
+    
+    @app.after_request
+    def count_request(response):
+        route = g.get('metrics_route') or _tracked_route(app)
+        if route is not None:
+            REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+            g.metrics_counted = True
+        return response
+    
+    @app.teardown_request
+    def count_failed_request(error=None):
+        # after_request does not run when an exception escaped every error handler
+        if g.pop('metrics_counted', False) or 'metrics_route' not in g:
+            return
+        REQUESTS.inc(route=g.metrics_route, method=request.method, status='500')
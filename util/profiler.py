@@ -0,0 +1,186 @@
+"""Statistical stack sampler and per-request cProfile capture for live workers"""
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+# Leaf frames of threads parked in the standard library (idle pool workers, the
+# server's accept loop, event loops with nothing to do); not where CPU goes
+_IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+    ('socketserver.py', 'serve_forever')
+}
+
+def _thread_label(name):
+    """Drop pool numbering from a thread name ('ThreadPoolExecutor-0_3' -> 'ThreadPoolExecutor') so pools aggregate"""
+    return re.sub(r'[-_]?\d+', '', name) or 'thread'
+
+def _frame_label(code):
+    """Return 'module.py:function' for a code object"""
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+class StackSampler:
+    """
+    Samples the Python stacks of every thread in this process at a fixed interval
+    
+    Nothing is installed in the interpreter: a background thread reads
+    sys._current_frames() while sampling, so threads serving requests run at
+    full speed and there is no cost at all between profiles. The result is in
+    the collapsed-stack format read by flamegraph.pl and speedscope
+    (``thread;outer;...;leaf count`` per line, with the thread pool's name as
+    the root frame).
+    """
+    
+    def __init__(self, interval=0.01, include_idle=False, max_depth=128):
+        """
+        Initialize the sampler
+        
+        Args:
+            interval (float): Seconds between samples
+            include_idle (bool): Keep samples of threads parked in thread pools, locks and selectors
+            max_depth (int): Frames kept per stack (innermost first)
+        """
+        self.interval = interval
+        self.include_idle = include_idle
+        self.max_depth = max_depth
+        self.samples = 0
+        self.stacks = Counter()
+    
+    def sample_once(self, skip_thread=None):
+        """
+        Record the current stack of every thread once
+        
+        Args:
+            skip_thread (int): Thread id to leave out (the sampler's own thread)
+        """
+        names = {thread.ident: _thread_label(thread.name) for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            code = frame.f_code
+            if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                continue
+            
+            labels = []
+            while frame is not None and len(labels) < self.max_depth:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, 'thread'))
+            self.stacks[';'.join(reversed(labels))] += 1
+        self.samples += 1
+    
+    def run(self, seconds, stop=None):
+        """
+        Sample for a number of seconds in the calling thread
+        
+        Args:
+            seconds (float): How long to sample
+            stop (threading.Event): Optional event that ends sampling early
+        
+        Returns:
+            StackSampler: self, for chaining collapsed()
+        """
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= deadline or (stop is not None and stop.is_set()):
+                break
+            self.sample_once(skip_thread=me)
+            next_sample = max(next_sample + self.interval, now)
+            time.sleep(max(0.0, min(next_sample, deadline) - time.monotonic()))
+        return self
+    
+    def collapsed(self):
+        """Return the samples as collapsed stacks, most frequent first"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class RequestProfiles:
+    """
+    Keeps the cProfile results of the last few profiled requests in memory
+    
+    A request is profiled by calling start() before the handler runs and
+    finish() after it; cProfile only instruments the thread that called
+    start(), so concurrent requests are unaffected.
+    """
+    
+    FORMATS = ('pstats', 'prof')
+    
+    def __init__(self, max_entries=20):
+        """
+        Initialize the store
+        
+        Args:
+            max_entries (int): Profiles kept; the oldest is dropped first
+        """
+        self.max_entries = max_entries
+        self._profiles = OrderedDict()  # profile id -> pstats.Stats
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def start():
+        """Start profiling the current thread and return the profiler"""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    
+    def finish(self, profiler):
+        """
+        Stop a profiler from start() and keep its result
+        
+        Args:
+            profiler (cProfile.Profile): Profiler returned by start()
+        
+        Returns:
+            str: Profile id for get()
+        """
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        profile_id = uuid.uuid4().hex
+        with self._lock:
+            self._profiles[profile_id] = stats
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+        return profile_id
+    
+    def get(self, profile_id, format='pstats', limit=60):
+        """
+        Render a stored profile
+        
+        Args:
+            profile_id (str): Id returned by finish()
+            format (str): 'pstats' for a text table sorted by cumulative time, or
+                'prof' for the binary file read by snakeviz, flameprof and pstats
+            limit (int): Rows in the 'pstats' table
+        
+        Returns:
+            tuple: (content, mimetype), or None if the profile is unknown or was dropped
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown profile format '{format}'. Choose from: {', '.join(self.FORMATS)}")
+        with self._lock:
+            stats = self._profiles.get(profile_id)
+            if stats is None:
+                return None
+            if format == 'prof':
+                return marshal.dumps(stats.stats), 'application/octet-stream'
+            
+            # Stats objects print to their own stream, so render one at a time
+            output = io.StringIO()
+            stats.stream = output
+            stats.sort_stats('cumulative').print_stats(limit)
+            return output.getvalue(), 'text/plain'
@@ -0,0 +1,119 @@
+"""
+Cold-start report for the Flask application
+
+Runs a fresh interpreter with ``python -X importtime`` and reports how long it
+takes to import the app, build it with create_app() and answer /api/health,
+plus the slowest imports. Use it to catch startup regressions:
+    
+    python -m util.startup_report
+    python -m util.startup_report --json --max-ms 1500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Runs in the child interpreter; prints phase timings as JSON on the last stdout line
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app(warmup={warmup})
+created = time.perf_counter()
+response = flask_app.test_client().get('/api/health')
+served = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_health_ms': (served - created) * 1000,
+    'health_status': response.status_code
+}}))
+"""
+
+def parse_importtime(stderr):
+    """
+    Parse ``-X importtime`` output
+    
+    Args:
+        stderr (str): Standard error of the child interpreter
+    
+    Returns:
+        list: (module, self_us, cumulative_us) tuples
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            imports.append((module.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return imports
+
+def measure_startup(warmup=False, top=15):
+    """
+    Measure application cold start in a fresh interpreter
+    
+    Args:
+        warmup (bool): Also build the Gemini service inside create_app()
+        top (int): Number of slowest imports to include
+    
+    Returns:
+        dict: Phase timings in milliseconds and the slowest imports
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(warmup=warmup)],
+        cwd=project_root,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+    
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(result.stderr)
+    report['total_ms'] = report['import_ms'] + report['create_app_ms'] + report['first_health_ms']
+    report['modules_imported'] = len(imports)
+    report['slowest_imports'] = [
+        {'module': module, 'self_ms': self_us / 1000, 'cumulative_ms': cumulative_us / 1000}
+        for module, self_us, cumulative_us in sorted(imports, key=lambda i: i[2], reverse=True)[:top]
+    ]
+    report['langchain_imported'] = any(module.startswith('langchain') for module, _, _ in imports)
+    return report
+
+def main():
+    """Print the startup report and optionally fail when it exceeds a budget"""
+    parser = argparse.ArgumentParser(description='Measure Flask app cold-start time')
+    parser.add_argument('--warmup', action='store_true', help='Build the Gemini service during create_app()')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to show')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--max-ms', type=float, help='Exit with status 1 if total startup exceeds this')
+    args = parser.parse_args()
+    
+    report = measure_startup(warmup=args.warmup, top=args.top)
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("⏱️  Startup report")
+        print(f"   import app:        {report['import_ms']:8.1f} ms")
+        print(f"   create_app():      {report['create_app_ms']:8.1f} ms")
+        print(f"   first /api/health: {report['first_health_ms']:8.1f} ms")
+        print(f"   total:             {report['total_ms']:8.1f} ms")
+        print(f"   modules imported:  {report['modules_imported']}")
+        print(f"   LangChain loaded:  {'yes' if report['langchain_imported'] else 'no'}")
+        print("\n🐢 Slowest imports (cumulative):")
+        for entry in report['slowest_imports']:
+            print(f"   {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+    
+    if args.max_ms is not None and report['total_ms'] > args.max_ms:
+        print(f"\n❌ Startup took {report['total_ms']:.1f} ms, budget is {args.max_ms:.1f} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
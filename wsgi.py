@@ -0,0 +1,12 @@
+"""
+WSGI entry point for the Text Generation API
+
+Used by gunicorn in production (see gunicorn_conf.py):
+    gunicorn -c gunicorn_conf.py wsgi:application
+"""
+
+from app import create_app
+
+# The Gemini service is built in each worker after fork (post_fork in gunicorn_conf.py),
+# never in the preloading master: network clients must not be shared between processes
+application = create_app(warmup=False)